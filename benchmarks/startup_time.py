@@ -0,0 +1,70 @@
+"""
+Startup-time benchmark for the express CLI.
+
+Runs `python -X importtime` for the CLI entry point and each top-level command
+module in a fresh interpreter and reports the cumulative import time per module.
+
+    $ python benchmarks/startup_time.py [--budget-ms 150] [--top 15]
+
+Exits with 1 when the import time of pf9.express exceeds the budget.
+"""
+
+import sys
+import argparse
+import subprocess
+
+MODULES = ['pf9.express',
+           'pf9.config.commands',
+           'pf9.support.commands',
+           'pf9.cluster.commands']
+
+
+def import_times(module, runs=3):
+    """return (best cumulative import time of module in ms, {imported module: cumulative ms})"""
+    best_total = None
+    best_times = {}
+    for _ in range(runs):
+        proc = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import {}'.format(module)],
+                              stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, universal_newlines=True,
+                              check=True)
+        # Only keep imports nested under module, interpreter startup (site, .pth files) is not ours
+        times = {}
+        pending = {}
+        for line in proc.stderr.splitlines():
+            if not line.startswith('import time:') or 'cumulative' in line:
+                continue
+            _, cumulative, name = line.split('|')
+            pending[name.strip()] = int(cumulative) / 1000.0
+            if not name.startswith('  '):
+                if name.strip() == module:
+                    times = pending
+                pending = {}
+        if best_total is None or times[module] < best_total:
+            best_total, best_times = times[module], times
+    return best_total, best_times
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--budget-ms', type=float, default=150.0,
+                        help='Maximum import time of pf9.express in ms')
+    parser.add_argument('--top', type=int, default=15, help='Number of slowest imports listed per module')
+    args = parser.parse_args()
+
+    express_time = None
+    for module in MODULES:
+        total, times = import_times(module)
+        if module == 'pf9.express':
+            express_time = total
+        print("{:<40} {:>8.1f} ms".format(module, total))
+        slowest = sorted(((ms, name) for name, ms in times.items() if name != module), reverse=True)
+        for ms, name in slowest[:args.top]:
+            print("    {:<36} {:>8.1f} ms".format(name, ms))
+
+    if express_time > args.budget_ms:
+        print("FAIL: pf9.express import took {:.1f} ms, budget {:.1f} ms".format(express_time, args.budget_ms))
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,28 @@
+import importlib
+import click
+
+
+class LazyGroup(click.Group):
+    """click.Group that imports its subcommands only when they are resolved.
+    lazy_subcommands maps a command name to '<module path>.<command attribute>'.
+    """
+    def __init__(self, *args, **kwargs):
+        self.lazy_subcommands = kwargs.pop('lazy_subcommands', {})
+        super(LazyGroup, self).__init__(*args, **kwargs)
+
+    def list_commands(self, ctx):
+        commands = super(LazyGroup, self).list_commands(ctx)
+        return sorted(set(commands) | set(self.lazy_subcommands))
+
+    def get_command(self, ctx, cmd_name):
+        if cmd_name in self.lazy_subcommands and cmd_name not in self.commands:
+            self.add_command(self._load_command(cmd_name), cmd_name)
+        return super(LazyGroup, self).get_command(ctx, cmd_name)
+
+    def _load_command(self, cmd_name):
+        module_name, command_name = self.lazy_subcommands[cmd_name].rsplit('.', 1)
+        command = getattr(importlib.import_module(module_name), command_name)
+        if not isinstance(command, click.BaseCommand):
+            raise ValueError("Lazy subcommand {} is not a click command: {}".format(
+                cmd_name, self.lazy_subcommands[cmd_name]))
+        return command
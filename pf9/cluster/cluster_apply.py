@@ -0,0 +1,150 @@
+"""
+Declarative bulk create for `express cluster apply -f clusters.yaml`.
+Each cluster takes the fields of `cluster create` (option or parameter names, any case),
+`defaults` are applied to every cluster:
+
+    defaults:
+      user: ubuntu
+      ssh_key: ~/.ssh/id_rsa
+    clusters:
+      - name: edge-1
+        master_ip: [10.0.0.11]
+        worker_ip: [10.0.0.12, 10.0.0.13]
+      - name: edge-2
+        master_ip: [10.0.1.11, 10.0.1.12, 10.0.1.13]
+        masterVip: 10.0.1.100
+        masterVipIf: eth0
+"""
+
+import os
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+import click
+
+from pf9.exceptions import CLIException
+from pf9.cluster.exceptions import ClusterSpecInvalid
+from pf9.modules.util import Logger
+
+logger = Logger(os.path.join(os.path.expanduser("~"), 'pf9/log/pf9ctl.log')).get_logger(__name__)
+
+# Clusters created at the same time, each one runs its own prep playbook
+DEFAULT_APPLY_PARALLEL = 4
+
+ClusterResult = namedtuple('ClusterResult', ['name', 'status', 'cluster_uuid', 'masters', 'workers',
+                                             'elapsed', 'error'])
+
+
+def spec_key(key):
+    """'masterVip', 'master-ip' and 'master_ip' style keys map to the click parameter names"""
+    return str(key).replace('-', '_').lower()
+
+
+def resolve_cluster_params(command, cluster_spec, where):
+    """Convert and validate cluster_spec like click does for the options of command
+            return params dict with every parameter of command
+    """
+    values = dict((spec_key(key), value) for key, value in cluster_spec.items())
+    if 'name' in values:
+        values.setdefault('cluster_name', values.pop('name'))
+    known = dict((param.name, param) for param in command.params)
+    unknown = sorted(set(values) - set(known))
+    if unknown:
+        raise ClusterSpecInvalid("{}: unknown field(s): {}".format(where, ', '.join(unknown)))
+
+    ctx = click.Context(command)
+    params = {}
+    for name, param in known.items():
+        value = values.get(name)
+        # YAML numbers and booleans are parsed like the same text given on the command line
+        if isinstance(value, (list, tuple)):
+            value = [str(item) for item in value]
+        elif value is not None:
+            value = [str(value)] if param.multiple else str(value)
+        try:
+            value = param.full_process_value(ctx, value)
+            if param.callback is not None:
+                value = param.callback(ctx, param, value)
+        except click.ClickException as except_err:
+            raise ClusterSpecInvalid("{}: {}".format(where, except_err.format_message()))
+        params[name] = value
+    return params
+
+
+def load_cluster_specs(spec_file, command):
+    """Read the clusters of spec_file, resolved against the parameters of command
+            return list of params dicts, in file order
+    """
+    import yaml
+    try:
+        with open(spec_file) as spec:
+            document = yaml.safe_load(spec)
+    except (IOError, OSError) as except_err:
+        raise ClusterSpecInvalid("Failed reading {}: {}".format(spec_file, except_err))
+    except yaml.YAMLError as except_err:
+        raise ClusterSpecInvalid("Failed parsing {}: {}".format(spec_file, except_err))
+
+    if isinstance(document, list):
+        document = {'clusters': document}
+    if not isinstance(document, dict) or not document.get('clusters') \
+            or not isinstance(document['clusters'], list):
+        raise ClusterSpecInvalid("{} does not list any clusters".format(spec_file))
+    defaults = document.get('defaults') or {}
+    if not isinstance(defaults, dict):
+        raise ClusterSpecInvalid("{}: defaults must be a mapping".format(spec_file))
+
+    specs = []
+    names = set()
+    for index, cluster_spec in enumerate(document['clusters']):
+        where = "{}: cluster #{}".format(spec_file, index + 1)
+        if not isinstance(cluster_spec, dict):
+            raise ClusterSpecInvalid("{} must be a mapping".format(where))
+        merged = dict(defaults)
+        merged.update(cluster_spec)
+        params = resolve_cluster_params(command, merged, where)
+        if params['cluster_name'] in names:
+            raise ClusterSpecInvalid("{}: cluster {} is listed more than once".format(
+                where, params['cluster_name']))
+        names.add(params['cluster_name'])
+        specs.append(params)
+    return specs
+
+
+def apply_clusters(specs, create_one, parallel=DEFAULT_APPLY_PARALLEL):
+    """Call create_one(params) for every spec, at most parallel clusters at a time.
+    create_one returns the cluster UUID, a failure only fails its own cluster.
+            return list of ClusterResult, in spec order
+    """
+    def run(params):
+        start = time.time()
+        cluster_uuid = None
+        error = None
+        try:
+            cluster_uuid = create_one(params)
+        except CLIException as except_err:
+            error = except_err.msg
+        except SystemExit as except_err:
+            error = "exited with status {}".format(except_err.code)
+        except Exception as except_err:
+            logger.exception("Cluster {} failed".format(params['cluster_name']))
+            error = str(except_err) or except_err.__class__.__name__
+        if error is not None:
+            logger.error("Cluster {} failed: {}".format(params['cluster_name'], error))
+        return ClusterResult(params['cluster_name'], 'failed' if error else 'created', cluster_uuid,
+                             tuple(params['master_ip']), tuple(params['worker_ip']),
+                             time.time() - start, error)
+
+    with ThreadPoolExecutor(max_workers=max(1, min(parallel, len(specs)))) as executor:
+        return list(executor.map(run, specs))
+
+
+def results_table(results):
+    """PrettyTable of the per-cluster results of apply_clusters"""
+    from prettytable import PrettyTable
+    table = PrettyTable()
+    table.field_names = ["Cluster", "Status", "Cluster UUID", "Masters", "Workers", "Time (s)", "Error"]
+    for result in results:
+        table.add_row([result.name, result.status, result.cluster_uuid or '',
+                       ', '.join(result.masters), ', '.join(result.workers),
+                       int(result.elapsed), result.error or ''])
+    return table
@@ -1,15 +1,23 @@
 import os
 import time
-import requests
-import json
 import click
 
+from pf9.exceptions import DUCommFailure
 from pf9.cluster.exceptions import ClusterAttachFailed, FailedActiveMasters, ClusterNotAvailable, NodeNotFound
 from pf9.modules.util import Logger
 from pf9.modules.express import Get
+from pf9.modules.resmgr import HostIndex
+from pf9.modules.qbert import Qbert, ClusterNodes
+from pf9.cluster.poller import Poller
+from pf9.cluster.helpers import progressbar
 
 logger = Logger(os.path.join(os.path.expanduser("~"), 'pf9/log/pf9ctl.log')).get_logger(__name__)
 
+# Longest pause between two polls of qbert
+POLL_MAX_INTERVAL = 10
+# Cluster states that will never converge to ok
+TERMINAL_CLUSTER_STATES = ('error', 'deleting')
+
 def write_host(m):
     if m is not None:
         logger.info(m)
@@ -25,96 +33,56 @@ class AttachCluster(object):
         self.du_url = ctx.params['du_url']
         self.cluster_name = ctx.params['cluster_name']
         self.region_du_url = "https://{}".format(Get(ctx).region_fqdn())
-        self.headers = { 'content-type': 'application/json', 'X-Auth-Token': self.token }
-
-    def wait_for_n_active_masters(self, master_node_num):
-        if master_node_num == 1:
-            TIMEOUT_SECS = 900
-        else:
-            TIMEOUT_SECS = 900
-        POLL_INTERVAL = 10  # in secs
-        flag_found_n_masters = False
-        start_time = time.time()
-        with click.progressbar(length=TIMEOUT_SECS, color="orange",
-                               label='Waiting for all masters to become active') as bar:
-            log_counter = 0
-            update_interval = time.time()
-            while True:
-                log_counter = log_counter + 1
-                current_active_masters = self.get_num_active_masters()
-                if int(current_active_masters) == int(master_node_num):
-                    flag_found_n_masters = True
-                    break
-                elif int(time.time() - start_time) < TIMEOUT_SECS:
-                    bar.update(time.time() - update_interval)
-                    if log_counter % 3 == 0:
-                        logger.info("{} of {} Master nodes active".format(current_active_masters, master_node_num))
-                elif int(time.time() - start_time) > TIMEOUT_SECS:
-                    break
-                update_interval = time.time()
-                time.sleep(POLL_INTERVAL)
+        self.qbert = Qbert(self.region_du_url, self.token, self.project_id)
+        self.cluster_uuid = None
+        self._cluster_nodes = None
+
+    def wait_for_n_active_masters(self, master_node_num, deadline=None, label='Waiting for all masters to become active'):
+        """Wait until at least master_node_num masters are active, by deadline (epoch secs) or for 900s"""
+        TIMEOUT_SECS = 900
+        if deadline is None:
+            deadline = time.time() + TIMEOUT_SECS
+        with progressbar(self.ctx, length=TIMEOUT_SECS, color="orange", label=label) as bar:
+            # the bar shows the remaining time of the shared deadline
+            def show_progress(current_active_masters, attempts, elapsed):
+                bar.update(max(0, TIMEOUT_SECS - int(deadline - time.time())) - bar.pos)
+                if attempts % 3 == 0:
+                    logger.info("{} of {} Master nodes active".format(current_active_masters, master_node_num))
+
+            poll_result = Poller(deadline=deadline, max_interval=POLL_MAX_INTERVAL).poll(
+                self.get_num_active_masters,
+                lambda current_active_masters: int(current_active_masters) >= int(master_node_num),
+                on_progress=show_progress)
 
             # Success or failure... push the progress to 100%
             bar.update(TIMEOUT_SECS)
 
         # enforce TIMEOUT
-        if not flag_found_n_masters:
+        current_active_masters = poll_result.value
+        if not poll_result.done:
             msg = "Timed out waiting for {} master to become active. Current " \
                   "active count {}.".format(master_node_num, current_active_masters)
             raise FailedActiveMasters(msg)
         logger.info("{} of {} master nodes now available".format(master_node_num, current_active_masters))
 
+    def cluster_nodes(self):
+        """Node status view of this cluster, kept across polls to revalidate the listing"""
+        if self._cluster_nodes is None:
+            self._cluster_nodes = ClusterNodes(self.qbert, self.cluster_name, cluster_uuid=self.cluster_uuid)
+        return self._cluster_nodes
+
     def get_num_active_masters(self):
-        num_active_masters = 0
-        try:
-            api_endpoint = "qbert/v3/{}/nodes".format(self.project_id)
-            pf9_response = requests.get("{}/{}".format(self.region_du_url, api_endpoint),
-                                        headers=self.headers)
-            if pf9_response.status_code != 200:
-                return num_active_masters
-
-            # parse response
-            json_response = json.loads(pf9_response.text)
-        except Exception as except_err:
-            logger.exception("Failed get_num_active_masters: {}: {}".format(num_active_masters, except_err))
-            return num_active_masters
-
-        for node in json_response:
-            if 'clusterName' not in node:
-                continue
-            if node['clusterName'] == self.cluster_name:
-                try:
-                    if node['isMaster'] == 1 and node['api_responding'] == 1 \
-                            and node['status'] == 'ok':
-                        num_active_masters += 1
-                except Exception:
-                    continue
-        return num_active_masters
+        return self.cluster_nodes().num_active_masters()
 
-    def get_resmgr_hostid(self, host_ip):
-        try:
-            api_endpoint = "resmgr/v1/hosts"
-            pf9_response = requests.get("{}/{}".format(self.region_du_url, api_endpoint),
-                                        headers=self.headers)
-            if pf9_response.status_code != 200:
-                return None
-
-            # parse resmgr response
-            json_response = json.loads(pf9_response.text)
-        except Exception as except_err:
-            logger.exception(except_err)
-            return None
+    def host_index(self):
+        """Shared index of the resmgr hosts, listed once for all lookups of the command"""
+        return HostIndex.get(self.region_du_url, self.token, self.project_id)
 
-        # sequentially search results
-        for host in json_response:
-            try:
-                for iface_name, iface_ip in host['extensions']['interfaces']['data']['iface_ip'].items():
-                    if iface_ip == host_ip:
-                        logger.info("Node host_id: {}".format(host['id']))
-                        return host['id']
-            except Exception as e:
-                logger.exception(e)
-        return None
+    def get_resmgr_hostid(self, host_ip):
+        host_uuid = self.host_index().host_id(host_ip)
+        if host_uuid is not None:
+            logger.info("Node host_id: {}".format(host_uuid))
+        return host_uuid
 
     def get_uuids(self, host_ips):
         # map list of IPs to list of UUIDs
@@ -133,92 +101,70 @@ class AttachCluster(object):
     def cluster_convergence_status(self, cluster_uuid):
         converge_status = "pending"
         try:
-            api_endpoint = "qbert/v3/{}/clusters/{}".format(self.project_id, cluster_uuid)
-            pf9_response = requests.get("{}/{}".format(self.region_du_url, api_endpoint),
-                                        headers=self.headers)
-            if pf9_response.status_code != 200:
-                return converge_status
-
-            # parse qbert response
-            json_response = json.loads(pf9_response.text)
+            cluster_status = self.qbert.get_cluster(cluster_uuid).status
         except Exception as except_err:
             logger.exception("Converge Status: {}: {}".format(converge_status, except_err))
             return converge_status
+        return cluster_status or converge_status
 
-        if json_response['status']:
-            return json_response['status']
-        else:
-            return converge_status
+    def attach_payload(self, node_type, uuid_list):
+        """qbert attach request body for the nodes in uuid_list"""
+        master_flag = node_type == 'master'
+        return [{"uuid": uuid, "isMaster": master_flag} for uuid in uuid_list]
+
+    def unresponsive_nodes(self, uuid_list):
+        """UUIDs in uuid_list that a fresh resmgr listing does not report as responding"""
+        host_index = HostIndex.get(self.region_du_url, self.token, self.project_id, force_refresh=True)
+        return [uuid for uuid in uuid_list
+                if uuid not in host_index.by_id or not host_index.by_id[uuid].responding]
 
     def attach_to_cluster(self, cluster_uuid, node_type, uuid_list):
         write_host("Attaching {} nodes to the cluster".format(node_type))
+        self.cluster_uuid = cluster_uuid
 
-        # configure attach payload (master nodes)
-        cluster_attach_payload = []
-        for uuid in uuid_list:
-            if node_type == 'master':
-                master_flag = True
-            else:
-                master_flag = False
-
-            payload_item = {
-                "uuid": uuid,
-                "isMaster": master_flag
-            }
-            cluster_attach_payload.append(payload_item)
+        cluster_attach_payload = self.attach_payload(node_type, uuid_list)
 
         # wait for cluster to be ready
         TIMEOUT = 5
-        POLL_INTERVAL = 2
 
-        # timeout loop
-        timeout = int(time.time()) + (60 * TIMEOUT)
-        flag_cluster_ready = False
-        write_host("Waiting for cluster to become ready")
-        while True:
-            cluster_status = self.cluster_convergence_status(cluster_uuid)
+        def log_status(cluster_status, attempts, elapsed):
             logger.info("Waiting for cluster to become ready, status = {}".format(cluster_status))
-            if cluster_status == "ok":
-                flag_cluster_ready = True
-                break
-            elif int(time.time()) > timeout:
-                break
 
-            time.sleep(POLL_INTERVAL)
+        write_host("Waiting for cluster to become ready")
+        poll_result = Poller(timeout=60 * TIMEOUT, max_interval=POLL_MAX_INTERVAL).poll(
+            lambda: self.cluster_convergence_status(cluster_uuid),
+            lambda cluster_status: cluster_status == "ok",
+            is_terminal=lambda cluster_status: cluster_status in TERMINAL_CLUSTER_STATES,
+            on_progress=log_status)
 
         # enforce TIMEOUT
-        if not flag_cluster_ready:
+        if poll_result.terminal:
+            except_msg = "Cluster is in state {}, it will not become ready".format(poll_result.value)
+            raise ClusterNotAvailable(except_msg)
+        if not poll_result.done:
             except_msg = "TIMEOUT: waiting for cluster to become ready"
             raise ClusterNotAvailable(except_msg)
 
         # attach to cluster (retry loop)
         num_retries = 5
-        cnt = 0
-        while cnt < num_retries:
-            if cnt > 0:
-                write_host("Attaching to cluster (retry {})".format(cnt))
-            else:
-                write_host("Attaching to cluster")
 
+        def post_attach():
             try:
-                api_endpoint = "qbert/v3/{}/clusters/{}/attach".format(self.project_id,
-                                                                       cluster_uuid)
-                pf9_response = requests.post("{}/{}".format(self.region_du_url, api_endpoint),
-                                             headers=self.headers,
-                                             data=json.dumps(cluster_attach_payload))
-                if pf9_response.status_code == 200:
-                    write_host("Successfully attached to cluster")
-                    break
-                else:
-                    msg = "Failed to attach to cluster: {}".format(pf9_response.text)
-                    write_host(msg)
-            except:
-                pass
-
-            cnt += 1
-            time.sleep(5)
+                self.qbert.attach_nodes(cluster_uuid, cluster_attach_payload)
+                return True
+            except DUCommFailure as except_err:
+                write_host(except_err.msg)
+            except Exception as except_err:
+                logger.exception(except_err)
+            return False
+
+        write_host("Attaching to cluster")
+        poll_result = Poller(initial_interval=2, max_interval=POLL_MAX_INTERVAL, max_attempts=num_retries).poll(
+            post_attach, lambda attached: attached,
+            on_progress=lambda attached, attempts, elapsed: write_host("Attaching to cluster (retry {})".format(attempts)))
         logger.info("Attach Complete")
 
-        if cnt >= num_retries:
+        if not poll_result.done:
             msg = "Failed to attach to cluster after {} attempts".format(num_retries)
             raise ClusterAttachFailed(msg)
+        write_host("Successfully attached to cluster")
@@ -1,17 +1,19 @@
 import os
 import sys
-import time
-import requests
-import json
 import click
 from pf9.modules.util import Logger
 from pf9.cluster.exceptions import ClusterCreateFailed
 from pf9.cluster.exceptions import ClusterNotAvailable
 from pf9.modules.express import Get
+from pf9.modules.qbert import Qbert
+from pf9.cluster.poller import Poller
 
 
 logger = Logger(os.path.join(os.path.expanduser("~"), 'pf9/log/pf9ctl.log')).get_logger(__name__)
 
+# Longest pause between two polls of qbert
+POLL_MAX_INTERVAL = 10
+
 
 class CreateCluster(object):
     def __init__(self, ctx):
@@ -21,7 +23,7 @@ class CreateCluster(object):
         self.du_url = ctx.params['du_url']
         self.region_du_url = "https://{}".format(Get(ctx).region_fqdn())
         self.cluster_name = ctx.params['cluster_name']
-        self.headers = { 'content-type': 'application/json', 'X-Auth-Token': self.token }
+        self.qbert = Qbert(self.region_du_url, self.token, self.project_id)
 
     def write_host(self, m):
         if m != None:
@@ -30,23 +32,12 @@ class CreateCluster(object):
 
     def get_nodepool_id(self):
         try:
-            api_endpoint = "qbert/v3/{}/cloudProviders".format(self.project_id)
-            pf9_response = requests.get("{}/{}".format(self.region_du_url,api_endpoint), headers=self.headers)
-            if pf9_response.status_code != 200:
-                return None
-
-            # parse response
-            try:
-                json_response = json.loads(pf9_response.text)
-            except:
-                return None
-
-            for item in json_response:
-                if item['type'] == 'local':
-                    return item['nodePoolUuid']
+            for cloud_provider in self.qbert.get_cloud_providers():
+                if cloud_provider.type == 'local':
+                    return cloud_provider.node_pool_uuid
         except Exception as except_err:
             logger.exception(except_err)
-            return None
+        return None
 
     def create_cluster(self):
         nodepool_id = self.get_nodepool_id()
@@ -77,62 +68,36 @@ class CreateCluster(object):
 
         # create cluster (post to qbert)
         try:
-            api_endpoint = "qbert/v3/{}/clusters".format(self.project_id)
-            pf9_response = requests.post("{}/{}".format(self.region_du_url, api_endpoint),
-                                         headers=self.headers, data=json.dumps(cluster_create_payload))
+            return self.qbert.create_cluster(cluster_create_payload)
         except Exception as except_err:
             except_msg = "Failed to create cluster: {}".format(except_err)
             logger.exception(except_msg)
             raise ClusterCreateFailed(except_msg)
 
-        # parse resmgr response
-        try:
-            json_response = json.loads(pf9_response.text)
-        except Exception as except_err:
-            except_msg = "Cluster created, but response did not include the cluster uuid: {}".format(except_err)
-            logger.exception(except_msg)
-            raise ClusterCreateFailed(except_msg)
-
-        return json_response['uuid']
-
     def cluster_exists(self):
         try:
-            api_endpoint = "qbert/v3/{}/clusters".format(self.project_id)
-            pf9_response = requests.get("{}/{}".format(self.region_du_url, api_endpoint), headers=self.headers)
-            if pf9_response.status_code != 200:
-                return False, None
-            json_response = json.loads(pf9_response.text)
-            for item in json_response:
-                if item['name'] == self.cluster_name:
-                    return True, item['uuid']
+            for cluster in self.qbert.get_clusters():
+                if cluster.name == self.cluster_name:
+                    return True, cluster.uuid
         except Exception as except_err:
             logger.exception(except_err)
-            return False, None
-        # final return
         return False, None
 
     def wait_for_cluster(self):
         TIMEOUT = 5
-        POLL_INTERVAL = 2
-
-        # timeout loop
-        timeout = int(time.time()) + (60 * TIMEOUT)
-        flag_cluster_exists = False
-        while True:
-            cluster_status, cluster_uuid = self.cluster_exists()
-            self.write_host("Waiting for cluster create to complete, status = {}".format(cluster_status))
-            if cluster_status:
-                flag_cluster_exists = True
-                break
-            elif int(time.time()) > timeout:
-                break
-            time.sleep(POLL_INTERVAL)
+
+        def log_status(value, attempts, elapsed):
+            self.write_host("Waiting for cluster create to complete, status = {}".format(value[0]))
+
+        # fast first polls, backing off to POLL_MAX_INTERVAL
+        poll_result = Poller(timeout=60 * TIMEOUT, max_interval=POLL_MAX_INTERVAL).poll(
+            self.cluster_exists, lambda exists: exists[0], on_progress=log_status)
 
         # enforce TIMEOUT
-        if not flag_cluster_exists:
+        if not poll_result.done:
             except_msg = "TIMEOUT: waiting for cluster to be created (qbert)"
             logger.exception(except_msg)
             raise ClusterNotAvailable(except_msg)
 
         # return cluster uuid
-        return cluster_uuid
+        return poll_result.value[1]
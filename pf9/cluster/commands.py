@@ -1,26 +1,78 @@
 """Express Cluster Commands"""
 import sys
 import os
+import shutil
+import tempfile
 from datetime import datetime
 import time
-import shlex
-import subprocess
+from concurrent.futures import ThreadPoolExecutor
 import click
 from pf9.exceptions import CLIException
-from pf9.modules.express import PrepExpressRun
+from pf9.modules.express import PrepExpressRun, DEFAULT_ANSIBLE_FORKS
+from pf9.modules.ansible_config import STRATEGIES
 from pf9.modules.util import Logger
-from pf9.cluster.exceptions import PrepNodeFailed, ClusterNotAvailable, ClusterAttachFailed, ClusterCreateFailed
-from pf9.cluster.helpers import validate_ssh_details, get_local_node_addresses, check_vip_needed, print_help_msg
+from pf9.modules.ansible_events import PrepProgress
+from pf9.modules.resmgr import HostIndex, ResMgr, PF9_KUBE_ROLE, clear_host_indexes
+from pf9.modules.convergence import ConvergenceMonitor
+from pf9.modules.installer_cache import InstallerCache
+from pf9.cluster.exceptions import PrepNodeFailed, ClusterNotAvailable, ClusterAttachFailed, ClusterCreateFailed, \
+    FailedActiveMasters
+from pf9.cluster.helpers import validate_ssh_details, get_local_node_addresses, check_vip_needed, print_help_msg, \
+    validate_serial, wave_count, progressbar
 from pf9.cluster.cluster_create import CreateCluster
 from pf9.cluster.cluster_attach import AttachCluster
+from pf9.cluster.cluster_apply import load_cluster_specs, apply_clusters, results_table, DEFAULT_APPLY_PARALLEL
 from ..modules.express import Get
 from ..modules.analytics_utils import SegmentSession, SegmentSessionWrapper
 from pf9.support.generate_bundle import Log_Bundle
 logger = Logger(os.path.join(os.path.expanduser("~"), 'pf9/log/pf9ctl.log')).get_logger(__name__)
 
+# Time for all masters of an attach to become active
+MASTERS_ACTIVE_TIMEOUT = 900
+# Active config and auth session of `cluster apply`, copied into the context of every cluster
+APPLY_SHARED_PARAMS = ('config_name', 'du_url', 'du_username', 'du_password', 'du_tenant', 'du_region',
+                       'dev_key', 'disable_analytics', 'token', 'project_id', 'user_id')
+
+
+def is_prepared(host):
+    """A node needs no prep once resmgr reports pf9-kube applied with role_status ok and the host responding"""
+    return host is not None and 'pf9-kube' in host.roles and host.role_status == 'ok' and host.responding
+
+
+def skip_prepared_nodes(ctx, ips):
+    """Query resmgr once for all nodes and drop the already prepared ones, floating IPs included
+            return ips that still need to be prepared
+    """
+    try:
+        host_index = HostIndex.get("https://{}".format(Get(ctx).region_fqdn()), ctx.params['token'],
+                                   ctx.params.get('project_id'), force_refresh=True)
+    except CLIException as except_err:
+        logger.exception(except_err)
+        return ips
+    floating_ips = ctx.params.get('floating_ip')
+    if floating_ips:
+        floating_ips = ''.join(floating_ips).split(' ') if all(len(x) == 1 for x in floating_ips) \
+            else list(floating_ips)
+    keep = []
+    for ip in ips:
+        addresses = get_local_node_addresses() if ip == 'localhost' else [ip]
+        if any(is_prepared(host_index.lookup(address)) for address in addresses):
+            logger.info("Skipping node {}, it is already prepared".format(ip))
+            click.echo("Skipping node {}, it is already prepared (use --force to prepare it again)".format(ip))
+        else:
+            keep.append(ip)
+    if floating_ips and len(floating_ips) == len(ips):
+        ctx.params['floating_ip'] = tuple(floating_ip for ip, floating_ip in zip(ips, floating_ips) if ip in keep)
+    return tuple(keep)
+
 
 def prep_node(ctx, user, password, ssh_key, ips, node_prep_only):
-    # TODO: Filter all nodes against regmgr. If they have role[pf9_kube] and role_status: ok. Remove from inventory
+    if not ctx.params.get('force'):
+        ips = skip_prepared_nodes(ctx, ips)
+        if not ips:
+            logger.info('All nodes are already prepared')
+            click.echo('All nodes are already prepared')
+            return 0, None
     if len(ips) == 1 and ips[0] == 'localhost':
         logger.info('Preparing the local node to be added to Platform9 Managed Kubernetes')
         click.echo('Preparing the local node to be added to Platform9 Managed Kubernetes')
@@ -28,37 +80,83 @@ def prep_node(ctx, user, password, ssh_key, ips, node_prep_only):
     inv_file_template = os.path.join(cur_dir_path,
                                      'templates',
                                      'pmk_inventory.tpl')
-    cmd = PrepExpressRun(ctx, user, password, ssh_key, ips, node_prep_only, inv_file_template
-                         ).build_ansible_command()
-    log_file = os.path.join(ctx.obj['pf9_log_dir'],
-                            datetime.now().strftime('node_provision_%Y_%m_%d-%H_%M_%S.log'))
-    os.environ['ANSIBLE_CONFIG'] = ctx.obj['pf9_ansible_cfg']
+    prep_run = PrepExpressRun(ctx, user, password, ssh_key, ips, node_prep_only, inv_file_template)
+    # One resmgr poller in this process releases every host of the wait-for-convergence role
+    # and assigns the pf9-kube role to the hosts it releases from the k8s check, in batches
+    prep_run.convergence_dir = tempfile.mkdtemp(prefix='pf9_converge_')
+    prep_run.batch_role_assignment = True
+    convergence_monitor = ConvergenceMonitor(
+        ResMgr("https://{}".format(Get(ctx).region_fqdn()), ctx.params['token']), prep_run.convergence_dir,
+        assign_role=PF9_KUBE_ROLE)
+    # Installers are downloaded from the DU once per OS family here and copied to the nodes,
+    # the nodes of a family that could not be cached download the installer themselves
+    prep_run.installers, installer_errors = InstallerCache(Get(ctx).region_fqdn()).prefetch(
+        ctx.params['du_region'], ctx.params['token'])
+    for os_family, error in sorted(installer_errors.items()):
+        msg = "Failed caching the {} installer, nodes will download it from the DU: {}".format(os_family, error)
+        logger.warning(msg)
+        click.echo(msg)
+    # Unique per run: `cluster apply` preps several clusters within the same second
+    log_fd, log_file = tempfile.mkstemp(dir=ctx.obj['pf9_log_dir'], suffix='.log',
+                                        prefix=datetime.now().strftime('node_provision_%Y_%m_%d-%H_%M_%S_'))
+    os.close(log_fd)
+    # Structured playbook events, one JSON document per line
+    event_log = "{}.events.jsonl".format(os.path.splitext(log_file)[0])
+    playbook = prep_run.build_playbook_run(log_file, event_log)
     SegmentSessionWrapper(ctx).send_track('Prep Express Run')
 
-    # Progress bar logic: estimate total time, while cmd_proc running, poll at interval, refreshing progbar
-    # TODO: if both masters and workers, Add to est_total_time to allot for masters role, before workers.
-    time_per_host_secs = 200
-    poll_interval_secs = 5
-    est_total_time = time_per_host_secs
-    with click.progressbar(length=est_total_time, color="orange",
-                           label='Preparing nodes') as progbar:
-        elapsed = 0
-        with open(log_file, 'w') as log_file_write:
-            cmd_proc = subprocess.Popen(shlex.split(cmd), env=os.environ, stdout=log_file_write,
-                                        stderr=subprocess.STDOUT)
-            while cmd_proc.poll() is None:
-                elapsed = elapsed + poll_interval_secs
-                if elapsed < (est_total_time - poll_interval_secs):
-                    progbar.update(poll_interval_secs)
+    # Progress bar logic: one step per host and prep role, advanced from the playbook events
+    poll_interval_secs = 0.5
+    progress = PrepProgress(ips)
+    waves = wave_count(len(ips), ctx.params.get('serial'))
+    label = 'Preparing nodes' if waves == 1 else 'Preparing nodes in {} waves'.format(waves)
+    # With --fail-fast the first failed node stops the other nodes, otherwise Ansible finishes them.
+    # Failures tolerated up to max_fail_percentage are always left to Ansible.
+    fail_fast = ctx.params.get('fail_fast') and ctx.params.get('max_fail_percentage') is None
+    with progressbar(ctx, length=progress.total_steps, color="orange", label=label) as progbar:
+        playbook.start()
+        convergence_monitor.start()
+        try:
+            failure = None
+            while True:
+                running = playbook.is_running()
+                for event in playbook.events():
+                    host_failure = progress.update(event)
+                    if host_failure is not None:
+                        logger.error("Node {} failed in role {}, task '{}': {}".format(
+                            host_failure.host, host_failure.role, host_failure.task, host_failure.msg))
+                        failure = failure or host_failure
+                progbar.update(progress.completed_steps - progbar.pos)
+                if not running:
+                    break
+                if failure is not None and fail_fast:
+                    # One failed node fails the command, stop the other nodes now instead of at the end
+                    playbook.cancel()
+                    break
                 time.sleep(poll_interval_secs)
+        except KeyboardInterrupt:
+            playbook.cancel()
+            raise
+        finally:
+            playbook.close()
+            convergence_monitor.stop()
+            shutil.rmtree(prep_run.convergence_dir, ignore_errors=True)
+            # the pre-flight listing predates the hostagents of the prepared nodes,
+            # the attach that follows in this process must list resmgr again
+            clear_host_indexes()
+        logger.info("Prep node progress: {}".format(progress.status()))
         # Success or failure... push the progress to 100%
-        progbar.update(est_total_time)
-
-        if cmd_proc.returncode:
-            msg = "Code: {}, output log: {}".format(cmd_proc.returncode, log_file)
+        progbar.update(progress.total_steps)
+
+        if failure is not None:
+            click.secho("Node {} failed in role {}, task '{}': {}. Event log: {}".format(
+                failure.host, failure.role, failure.task, failure.msg, event_log), fg="red")
+        if playbook.returncode:
+            # Log_Bundle reads the output log path from this message
+            msg = "Code: {}, output log: {}".format(playbook.returncode, log_file)
             raise PrepNodeFailed(msg, ctx, ips, user, password)
 
-        return cmd_proc.returncode, log_file
+        return playbook.returncode, log_file
 
 
 def create_cluster(ctx):
@@ -96,6 +194,7 @@ def attach_cluster(cluster_name, master_ips, worker_ips, ctx):
 
     SegmentSessionWrapper(ctx).send_track("Validate Cluster Existence")
 
+    # One resmgr listing resolves the UUIDs of masters and workers up front
     master_nodes = None
     worker_nodes = None
     if master_ips:
@@ -121,27 +220,61 @@ def attach_cluster(cluster_name, master_ips, worker_ips, ctx):
 
     SegmentSessionWrapper(ctx).send_track("Fetch Node UUIDs")
 
-    # attach master nodes
-    #TODO: Likely needs a progress bar?
-    if master_nodes:
-        try:
-            cluster_attacher.attach_to_cluster(cluster_uuid, 'master', master_nodes)
-            cluster_attacher.wait_for_n_active_masters(len(master_nodes))
-        except (ClusterAttachFailed, ClusterNotAvailable) as except_err:
-            logger.exception(except_err)
-            click.echo("Failed attaching master node(s) to cluster: {}".format(except_err))
-            raise except_err
-    SegmentSessionWrapper(ctx).send_track("Attach Master Nodes")
-
-    # attach worker nodes
-    if worker_nodes:
-        try:
-            cluster_attacher.attach_to_cluster(cluster_uuid, 'worker', worker_nodes)
-        except (ClusterAttachFailed, ClusterNotAvailable) as except_err:
-            logger.exception(except_err)
-            click.echo("Failed attaching master node(s) to cluster: {}".format(except_err))
-            raise except_err
-    SegmentSessionWrapper(ctx).send_track("Attach Worker Nodes")
+    # Pipeline: workers are validated while masters converge and attached as soon as a
+    # quorum (majority) of masters is active, the remaining masters are awaited meanwhile.
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        worker_check = None
+        worker_attach = None
+        if worker_nodes:
+            worker_check = executor.submit(cluster_attacher.unresponsive_nodes, worker_nodes)
+
+        # attach master nodes
+        if master_nodes:
+            try:
+                cluster_attacher.attach_to_cluster(cluster_uuid, 'master', master_nodes)
+                masters_deadline = time.time() + MASTERS_ACTIVE_TIMEOUT
+                # workers never attach before a quorum of masters, with 1 or 2 masters that is all of them
+                master_quorum = len(master_nodes) // 2 + 1
+                cluster_attacher.wait_for_n_active_masters(
+                    master_quorum, deadline=masters_deadline,
+                    label='Waiting for a quorum of {} masters to become active'.format(master_quorum))
+                if worker_nodes:
+                    worker_attach = executor.submit(attach_workers, cluster_attacher, cluster_uuid,
+                                                    worker_nodes, worker_check)
+                if master_quorum < len(master_nodes):
+                    cluster_attacher.wait_for_n_active_masters(len(master_nodes), deadline=masters_deadline)
+            except (ClusterAttachFailed, ClusterNotAvailable, FailedActiveMasters) as except_err:
+                # a worker attach already under way is finished before the failure is reported
+                if worker_attach is not None and not worker_attach.cancel():
+                    try:
+                        worker_attach.result()
+                    except Exception as worker_err:
+                        logger.exception(worker_err)
+                logger.exception(except_err)
+                click.echo("Failed attaching master node(s) to cluster: {}".format(except_err))
+                raise except_err
+        SegmentSessionWrapper(ctx).send_track("Attach Master Nodes")
+
+        # attach worker nodes
+        if worker_nodes:
+            try:
+                if worker_attach is None:
+                    attach_workers(cluster_attacher, cluster_uuid, worker_nodes, worker_check)
+                else:
+                    worker_attach.result()
+            except (ClusterAttachFailed, ClusterNotAvailable) as except_err:
+                logger.exception(except_err)
+                click.echo("Failed attaching worker node(s) to cluster: {}".format(except_err))
+                raise except_err
+        SegmentSessionWrapper(ctx).send_track("Attach Worker Nodes")
+
+
+def attach_workers(cluster_attacher, cluster_uuid, worker_nodes, worker_check):
+    """Attach the workers once their resmgr check, started with the master attach, is done"""
+    for uuid in worker_check.result():
+        logger.warning("Worker node {} is not responding in resmgr, attaching it anyway".format(uuid))
+    cluster_attacher.attach_to_cluster(cluster_uuid, 'worker', worker_nodes)
+
 
 @click.group()
 def cluster():
@@ -177,6 +310,18 @@ def cluster():
               help="Taint master nodes (to enable workloads)")
 @click.option("--networkPlugin", type=str, required=False, default='flannel',
               help="Specify network plugin (Possible values: flannel or calico, Default: flannel)")
+@click.option('--forks', type=click.IntRange(1, 500), default=DEFAULT_ANSIBLE_FORKS,
+              help="Number of nodes prepared in parallel, Default: {}".format(DEFAULT_ANSIBLE_FORKS))
+@click.option('--batch-size', '--serial', 'serial', callback=validate_serial, default=None,
+              help="Prepare nodes in rolling waves of this many nodes, or percentage of nodes (e.g. 25%)")
+@click.option('--max-fail-percentage', type=click.IntRange(0, 100), default=None,
+              help="Do not start further waves once more than this percentage of a wave failed")
+@click.option('--fail-fast', is_flag=True, default=False,
+              help="Stop preparing all nodes as soon as one node fails")
+@click.option('--strategy', type=click.Choice(STRATEGIES), default='linear',
+              help="Ansible strategy, 'free' lets each node run ahead of the others, Default: linear")
+@click.option('--force', is_flag=True, default=False,
+              help="Prepare every node, including nodes resmgr already reports as prepared")
 @click.option('--floating-ip', '-f', multiple=True, hidden=True)
 @click.pass_context
 def create(ctx, **kwargs):
@@ -184,23 +329,8 @@ def create(ctx, **kwargs):
     logger.info(msg=click.get_current_context().info_name)
 
     segment_session = SegmentSession()
-    segment_event_properties = dict(arg_cluster_name=ctx.params['cluster_name'],
-                                    arg_master_ips=ctx.params['master_ip'],
-                                    arg_worker_ips=ctx.params['worker_ip'],
-                                    arg_user='REDACTED', arg_password='REDACTED',
-                                    arg_ssh_key=ctx.params.get('ssh_key', None),
-                                    arg_masterVip=ctx.params.get('mastervip', None),
-                                    arg_masterVipIf=ctx.params.get('mastervipif', None),
-                                    arg_metallbIpRange=ctx.params.get('metallbiprange', None),
-                                    arg_containersCidr=ctx.params.get('containerscidr', None),
-                                    arg_servicesCidr=ctx.params.get('servicescidr', None),
-                                    arg_externalDnsName=ctx.params.get('externaldnsname', None),
-                                    arg_privileged=ctx.params.get('privileged', None),
-                                    arg_appCatalogEnabled=ctx.params.get('appcatalogenabled', None),
-                                    arg_allowWorkloadsOnMaster=ctx.params.get('allowworkloadsonmaster', None),
-                                    arg_networkPlugin=ctx.params.get('networkplugin', None),
-                                    arg_floating_ip=ctx.params.get('floating_ip', None))
-    SegmentSessionWrapper(ctx).load_segment_session(segment_session, segment_event_properties, "Create Cluster")
+    SegmentSessionWrapper(ctx).load_segment_session(segment_session, create_segment_properties(ctx.params),
+                                                    "Create Cluster")
 
     try:
         # Load active config
@@ -217,6 +347,58 @@ def create(ctx, **kwargs):
     segment_session.send_identify(ctx.params['du_username'], ctx.params['user_id'])
     segment_session.send_group(ctx.params['user_id'], ctx.params['du_url'])
 
+    try:
+        cluster_uuid, master_ips, worker_ips = create_with_nodes(ctx)
+    except CLIException as e:
+        logger.exception("Cluster Create Failed")
+        click.secho("Failed to create cluster {}. {}".format(
+                    ctx.params['cluster_name'], e.msg), fg="red")
+        SegmentSessionWrapper(ctx).send_track_error('Cluster Create', e)
+        sys.exit(1)
+
+    response = ""
+    if len(master_ips) > 0:
+        response = response + "\n    masters: {}".format(master_ips)
+    if len(worker_ips) > 0:
+        response = response + "\n    workers: {}".format(worker_ips)
+    logger.info("Successfully created cluster {} "
+                "using node(s):{}".format(ctx.params['cluster_name'], response))
+    click.secho("Successfully created cluster {} "
+                "using node(s):{}".format(ctx.params['cluster_name'], response), fg="green")
+    SegmentSessionWrapper(ctx).send_track("Create Cluster Complete")
+
+
+def create_segment_properties(params):
+    """Segment event properties of a cluster create with the options in params"""
+    return dict(arg_cluster_name=params['cluster_name'],
+                arg_master_ips=params['master_ip'],
+                arg_worker_ips=params['worker_ip'],
+                arg_user='REDACTED', arg_password='REDACTED',
+                arg_ssh_key=params.get('ssh_key', None),
+                arg_masterVip=params.get('mastervip', None),
+                arg_masterVipIf=params.get('mastervipif', None),
+                arg_metallbIpRange=params.get('metallbiprange', None),
+                arg_containersCidr=params.get('containerscidr', None),
+                arg_servicesCidr=params.get('servicescidr', None),
+                arg_externalDnsName=params.get('externaldnsname', None),
+                arg_privileged=params.get('privileged', None),
+                arg_appCatalogEnabled=params.get('appcatalogenabled', None),
+                arg_allowWorkloadsOnMaster=params.get('allowworkloadsonmaster', None),
+                arg_networkPlugin=params.get('networkplugin', None),
+                arg_floating_ip=params.get('floating_ip', None),
+                arg_forks=params.get('forks', None),
+                arg_serial=params.get('serial', None),
+                arg_max_fail_percentage=params.get('max_fail_percentage', None),
+                arg_fail_fast=params.get('fail_fast', None),
+                arg_strategy=params.get('strategy', None),
+                arg_force=params.get('force', None))
+
+
+def create_with_nodes(ctx):
+    """Prep the nodes of a cluster create, create the cluster and attach the nodes.
+    Expects an authenticated ctx with the options of `cluster create`, raises CLIException on failure
+            return cluster_uuid, master_ips, worker_ips
+    """
     master_ips = ctx.params['master_ip']
     ctx.params['master_ip'] = ''.join(master_ips).split(' ') if all(len(x) == 1
                                                                     for x in master_ips
@@ -232,82 +414,127 @@ def create(ctx, **kwargs):
                                                                         ) else list(worker_ips)
         all_ips = all_ips + ctx.params['worker_ip']
 
-    try:
-        check_vip_needed(ctx.params['master_ip'], ctx.params.get('mastervip', None),
-                         ctx.params.get('mastervipif', None))
-        SegmentSessionWrapper(ctx).send_track("Validate VIP")
-
-        if len(all_ips) > 0:
-            # Nodes are provided. So prep them.
-            adj_ips = ()
-            for ip in all_ips:
-                if ip == "127.0.0.1" or ip == "localhost" or \
-                        ip in get_local_node_addresses():
-                    # Have to adjust this to localhost to ensure Ansible handles
-                    # this as a local connection.
-                    adj_ips = adj_ips + ("localhost",)
-                else:
-                    # check if ssh creds are provided.
-                    validate_ssh_details(ctx.params['user'],
-                                         ctx.params['password'],
-                                         ctx.params['ssh_key'])
-                    adj_ips = adj_ips + (ip,)
+    check_vip_needed(ctx.params['master_ip'], ctx.params.get('mastervip', None),
+                     ctx.params.get('mastervipif', None))
+    SegmentSessionWrapper(ctx).send_track("Validate VIP")
+
+    if len(all_ips) > 0:
+        # Nodes are provided. So prep them.
+        adj_ips = ()
+        for ip in all_ips:
+            if ip == "127.0.0.1" or ip == "localhost" or \
+                    ip in get_local_node_addresses():
+                # Have to adjust this to localhost to ensure Ansible handles
+                # this as a local connection.
+                adj_ips = adj_ips + ("localhost",)
+            else:
+                # check if ssh creds are provided.
+                validate_ssh_details(ctx.params['user'],
+                                     ctx.params['password'],
+                                     ctx.params['ssh_key'])
+                adj_ips = adj_ips + (ip,)
 
-            SegmentSessionWrapper(ctx).send_track("Validate SSH credentials")
+        SegmentSessionWrapper(ctx).send_track("Validate SSH credentials")
 
-            # Will throw in case of failed run
-            prep_node(ctx, ctx.params['user'], ctx.params['password'],
-                                        ctx.params['ssh_key'], adj_ips,
-                                        node_prep_only=True)
-            SegmentSessionWrapper(ctx).send_track("Prep Node")
+        # Will throw in case of failed run
+        prep_node(ctx, ctx.params['user'], ctx.params['password'],
+                  ctx.params['ssh_key'], adj_ips,
+                  node_prep_only=True)
+        SegmentSessionWrapper(ctx).send_track("Prep Node")
 
-        cluster_uuid = create_cluster(ctx)
-        SegmentSessionWrapper(ctx).send_track("Create Cluster")
+    cluster_uuid = create_cluster(ctx)
+    SegmentSessionWrapper(ctx).send_track("Create Cluster")
 
-        logger.info("Cluster UUID: {}".format(cluster_uuid))
-        click.echo("Cluster UUID: {}".format(cluster_uuid))
+    logger.info("Cluster UUID: {}".format(cluster_uuid))
+    click.echo("Cluster UUID: {}".format(cluster_uuid))
 
-        if len(all_ips) > 0:
-            # To attach nodes, we have to find the node uuid from the DU based on
-            # the IP address. This cannot be localhost, 127.0.0.1. We handle it by
-            # getting all the non local IPs and picking the first one.
-            # Attach nodes
-            master_ips = ()
-            worker_ips = ()
-            for ip in ctx.params['master_ip']:
-                if ip == "127.0.0.1" or ip == "localhost":
-                    local_ip = get_local_node_addresses()
-                    master_ips = master_ips + (local_ip[0],)
-                else:
-                    master_ips = master_ips + (ip,)
+    if len(all_ips) > 0:
+        # To attach nodes, we have to find the node uuid from the DU based on
+        # the IP address. This cannot be localhost, 127.0.0.1. We handle it by
+        # getting all the non local IPs and picking the first one.
+        # Attach nodes
+        master_ips = ()
+        worker_ips = ()
+        for ip in ctx.params['master_ip']:
+            if ip == "127.0.0.1" or ip == "localhost":
+                local_ip = get_local_node_addresses()
+                master_ips = master_ips + (local_ip[0],)
+            else:
+                master_ips = master_ips + (ip,)
 
-            for ip in ctx.params['worker_ip']:
-                if ip == "127.0.0.1" or ip == "localhost":
-                    local_ip = get_local_node_addresses()
-                    worker_ips = worker_ips + (local_ip[0],)
-                else:
-                    worker_ips = worker_ips + (ip,)
+        for ip in ctx.params['worker_ip']:
+            if ip == "127.0.0.1" or ip == "localhost":
+                local_ip = get_local_node_addresses()
+                worker_ips = worker_ips + (local_ip[0],)
+            else:
+                worker_ips = worker_ips + (ip,)
+
+        attach_cluster(ctx.params['cluster_name'], master_ips, worker_ips, ctx)
+        SegmentSessionWrapper(ctx).send_track("Attach Cluster")
+
+    return cluster_uuid, master_ips, worker_ips
 
-            attach_cluster(ctx.params['cluster_name'], master_ips, worker_ips, ctx)
-            SegmentSessionWrapper(ctx).send_track("Attach Cluster")
 
+@cluster.command('apply')
+@click.option('--file', '-f', 'spec_file', required=True, type=click.Path(exists=True, dir_okay=False),
+              help="YAML file listing the clusters to create, with the fields of 'cluster create'.")
+@click.option('--parallel', type=click.IntRange(1, 64), default=DEFAULT_APPLY_PARALLEL,
+              help="Number of clusters created at the same time, Default: {}".format(DEFAULT_APPLY_PARALLEL))
+@click.pass_context
+def apply(ctx, spec_file, parallel):
+    """Create the clusters listed in a YAML file, several at a time."""
+    logger.info(msg=click.get_current_context().info_name)
+
+    segment_session = SegmentSession()
+    segment_event_properties = dict(arg_parallel=parallel)
+    SegmentSessionWrapper(ctx).load_segment_session(segment_session, segment_event_properties, "Apply Clusters")
+
+    try:
+        specs = load_cluster_specs(spec_file, create)
+        # Authenticate and look up the region once, every cluster reuses this session
+        Get(ctx).active_config()
+        Get(ctx).get_token_project_user_id()
+        Get(ctx).region_fqdn()
     except CLIException as e:
-        logger.exception("Cluster Create Failed")
-        click.secho("Failed to create cluster {}. {}".format(
-                    ctx.params['cluster_name'], e.msg), fg="red")
-        SegmentSessionWrapper(ctx).send_track_error('Cluster Create', e)
+        click.secho("Failed to apply {}. {}".format(spec_file, e.msg), fg="red")
+        SegmentSessionWrapper(ctx).send_track_error('Load Cluster Specs', e)
         sys.exit(1)
 
-    response = ""
-    if len(master_ips) > 0:
-        response = response + "\n    masters: {}".format(master_ips)
-    if len(worker_ips) > 0:
-        response = response + "\n    workers: {}".format(worker_ips)
-    logger.info("Successfully created cluster {} "
-                "using node(s):{}".format(ctx.params['cluster_name'], response))
-    click.secho("Successfully created cluster {} "
-                "using node(s):{}".format(ctx.params['cluster_name'], response), fg="green")
-    SegmentSessionWrapper(ctx).send_track("Create Cluster Complete")
+    SegmentSessionWrapper(ctx).reload_segment_session_with_auth()
+    SegmentSessionWrapper(ctx).send_track("Load Active config")
+    segment_session.send_identify(ctx.params['du_username'], ctx.params['user_id'])
+    segment_session.send_group(ctx.params['user_id'], ctx.params['du_url'])
+
+    def create_one(params):
+        cluster_ctx = click.Context(create, parent=ctx.parent, info_name='create', obj=ctx.obj)
+        cluster_ctx.params.update(params)
+        cluster_ctx.params.update((key, ctx.params[key]) for key in APPLY_SHARED_PARAMS if key in ctx.params)
+        # progress bars of concurrent clusters would overwrite each other
+        cluster_ctx.params['no_progress'] = True
+        SegmentSessionWrapper(cluster_ctx).load_segment_session(
+            segment_session, create_segment_properties(cluster_ctx.params), "Create Cluster")
+        SegmentSessionWrapper(cluster_ctx).reload_segment_session_with_auth()
+        try:
+            cluster_uuid = create_with_nodes(cluster_ctx)[0]
+        except CLIException as e:
+            logger.exception("Cluster Create Failed: {}".format(params['cluster_name']))
+            SegmentSessionWrapper(cluster_ctx).send_track_error('Cluster Create', e)
+            raise
+        SegmentSessionWrapper(cluster_ctx).send_track("Create Cluster Complete")
+        return cluster_uuid
+
+    click.echo("Creating {} cluster(s), {} at a time".format(len(specs), min(parallel, len(specs))))
+    results = apply_clusters(specs, create_one, parallel)
+    click.echo(results_table(results))
+
+    failed = [result.name for result in results if result.error]
+    if failed:
+        msg = "Failed to create {} of {} clusters: {}".format(len(failed), len(results), ', '.join(failed))
+        click.secho(msg, fg="red")
+        SegmentSessionWrapper(ctx).send_track_error('Apply Clusters', msg)
+        sys.exit(1)
+    click.secho("Successfully created {} clusters".format(len(results)), fg="green")
+    SegmentSessionWrapper(ctx).send_track("Apply Clusters Complete")
 
 
 @cluster.command('bootstrap')
@@ -499,9 +726,24 @@ def attach_node(ctx, **kwargs):
               help='SSH key for nodes.')
 @click.option('--ips', '-i', multiple=True,
               help='IPs of the host to be prepared. Specify multiple IPs by repeating this option.')
+@click.option('--forks', type=click.IntRange(1, 500), default=DEFAULT_ANSIBLE_FORKS,
+              help="Number of nodes prepared in parallel, Default: {}".format(DEFAULT_ANSIBLE_FORKS))
+@click.option('--batch-size', '--serial', 'serial', callback=validate_serial, default=None,
+              help="Prepare nodes in rolling waves of this many nodes, or percentage of nodes (e.g. 25%)")
+@click.option('--max-fail-percentage', type=click.IntRange(0, 100), default=None,
+              help="Do not start further waves once more than this percentage of a wave failed")
+@click.option('--fail-fast', is_flag=True, default=False,
+              help="Stop preparing all nodes as soon as one node fails")
+@click.option('--strategy', type=click.Choice(STRATEGIES), default='linear',
+              help="Ansible strategy, 'free' lets each node run ahead of the others, Default: linear")
+@click.option('--reuse-facts', is_flag=True, default=False,
+              help="Reuse the node facts cached by a previous run instead of gathering them again")
+@click.option('--force', is_flag=True, default=False,
+              help="Prepare every node, including nodes resmgr already reports as prepared")
 @click.option('--floating-ip', '-f', default=None, multiple=True, hidden=True)
 @click.pass_context
-def prepnode(ctx, user, password, ssh_key, ips, floating_ip):
+def prepnode(ctx, user, password, ssh_key, ips, floating_ip, forks, serial, max_fail_percentage,
+             fail_fast, strategy, reuse_facts, force):
     """
     Prepare a node to be ready to be added to a Kubernetes cluster. Read more at http://pf9.io/cli_clprep.
     """
@@ -509,7 +751,10 @@ def prepnode(ctx, user, password, ssh_key, ips, floating_ip):
 
     segment_session = SegmentSession()
     segment_event_properties = dict(arg_user='REDACTED', arg_password='REDACTED', arg_ssh_key=ssh_key,
-                                    arg_ips=ips, arg_floating_ip=floating_ip)
+                                    arg_ips=ips, arg_floating_ip=floating_ip, arg_forks=forks,
+                                    arg_serial=serial, arg_max_fail_percentage=max_fail_percentage,
+                                    arg_fail_fast=fail_fast,
+                                    arg_strategy=strategy, arg_reuse_facts=reuse_facts, arg_force=force)
     SegmentSessionWrapper(ctx).load_segment_session(segment_session, segment_event_properties, "Prep Node")
 
     try:
@@ -61,3 +61,8 @@ class PrepNodeFailed(ClusterCLIException):
 class UserAuthFailure(CLIException):
     def __init__(self, msg):
         super(UserAuthFailure, self).__init__(msg)
+
+
+class ClusterSpecInvalid(ClusterCLIException):
+    def __init__(self, msg):
+        super(ClusterSpecInvalid, self).__init__(msg)
@@ -1,4 +1,5 @@
 import re
+import click
 import netifaces
 import ipaddress
 from .exceptions import SSHInfoMissing, MissingVIPDetails
@@ -69,3 +70,46 @@ def check_vip_needed(masters, vip, vip_if):
         raise MissingVIPDetails(missing)
 
     return True
+
+
+def validate_serial(ctx, param, value):
+    """click callback: a wave size is a number of nodes or a percentage of nodes, e.g. 10 or 25%"""
+    if not value:
+        return None
+    if not re.match(r'^[1-9][0-9]*%?$', value) or (value.endswith('%') and int(value[:-1]) > 100):
+        raise click.BadParameter("use a number of nodes or a percentage of nodes, e.g. 10 or 25%")
+    return value
+
+
+def wave_count(num_hosts, serial):
+    """Number of waves Ansible splits num_hosts into for play keyword serial"""
+    if not serial or num_hosts <= 1:
+        return 1
+    if serial.endswith('%'):
+        # same rounding as Ansible: floor, at least one node per wave
+        batch_size = max(1, int(num_hosts * int(serial[:-1]) / 100.0))
+    else:
+        batch_size = int(serial)
+    return (num_hosts + batch_size - 1) // batch_size
+
+
+class SilentProgressBar(object):
+    """Stand-in for click.progressbar, keeps the position without drawing"""
+    def __init__(self):
+        self.pos = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        return False
+
+    def update(self, n_steps):
+        self.pos += n_steps
+
+
+def progressbar(ctx, **kwargs):
+    """click.progressbar, or a silent one when several clusters share the terminal (cluster apply)"""
+    if ctx.params.get('no_progress'):
+        return SilentProgressBar()
+    return click.progressbar(**kwargs)
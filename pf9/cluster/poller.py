@@ -0,0 +1,65 @@
+"""
+Backoff poller for qbert/resmgr state waits.
+Polls start fast so quick transitions are seen within a second and back off
+exponentially with jitter so long waits do not hammer the Management Plane.
+"""
+
+import time
+import random
+from collections import namedtuple
+
+# done: is_done() matched, terminal: is_terminal() matched, otherwise the wait timed out
+PollResult = namedtuple('PollResult', ['done', 'terminal', 'value', 'attempts', 'elapsed'])
+
+
+class Poller(object):
+    """Poller(timeout).poll(fetch, is_done) calls fetch() until is_done(value), is_terminal(value),
+    max_attempts or the deadline. Pass deadline (epoch secs) instead of timeout to share one
+    deadline across several waits.
+    """
+    def __init__(self, timeout=None, deadline=None, initial_interval=0.5, max_interval=15,
+                 multiplier=2.0, jitter=0.2, max_attempts=None):
+        if deadline is None:
+            deadline = time.time() + timeout if timeout is not None else None
+        self.deadline = deadline
+        self.initial_interval = initial_interval
+        self.max_interval = max_interval
+        self.multiplier = multiplier
+        self.jitter = jitter
+        self.max_attempts = max_attempts
+
+    def remaining(self):
+        """Seconds left before the deadline, None when there is no deadline"""
+        if self.deadline is None:
+            return None
+        return max(0, self.deadline - time.time())
+
+    def intervals(self):
+        """Jittered exponential backoff: initial_interval, *multiplier, ... capped to max_interval"""
+        interval = self.initial_interval
+        while True:
+            yield interval * random.uniform(1 - self.jitter, 1 + self.jitter)
+            interval = min(interval * self.multiplier, self.max_interval)
+
+    def poll(self, fetch, is_done, is_terminal=None, on_progress=None):
+        """on_progress(value, attempts, elapsed) is called after every attempt that does not end the wait
+                return PollResult
+        """
+        start_time = time.time()
+        attempts = 0
+        value = None
+        for interval in self.intervals():
+            value = fetch()
+            attempts += 1
+            elapsed = time.time() - start_time
+            if is_done(value):
+                return PollResult(True, False, value, attempts, elapsed)
+            if is_terminal is not None and is_terminal(value):
+                return PollResult(False, True, value, attempts, elapsed)
+            remaining = self.remaining()
+            if (remaining is not None and remaining <= 0) or \
+                    (self.max_attempts is not None and attempts >= self.max_attempts):
+                return PollResult(False, False, value, attempts, elapsed)
+            if on_progress is not None:
+                on_progress(value, attempts, elapsed)
+            time.sleep(interval if remaining is None else min(interval, remaining))
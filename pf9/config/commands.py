@@ -4,7 +4,6 @@ import sys
 import shutil
 import click
 import re
-from prettytable import PrettyTable
 from ..exceptions import CLIException
 from ..exceptions import UserAuthFailure
 from ..modules.ostoken import GetToken
@@ -87,6 +86,7 @@ def create(ctx, du_url, os_username, os_password, os_region, os_tenant, dev_key,
 @click.pass_obj
 def config_list(obj):
     """List Platform9 management plane configs."""
+    from prettytable import PrettyTable
     logger.info(msg=click.get_current_context().info_name)
     pf9_exp_conf_dir = obj['pf9_db_dir']
 
@@ -191,7 +191,8 @@ def config_validate(ctx):
         # Load Active Config into ctx
         Get(ctx).active_config()
         # Get Token
-        token = GetToken().get_token_v3(
+        # Always authenticate against Keystone here, the fresh token replaces any cached one
+        token = GetToken(ctx.params['config_name'], force_refresh=True).get_token_v3(
                 ctx.params["du_url"],
                 ctx.params["du_username"],
                 ctx.params["du_password"],
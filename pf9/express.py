@@ -4,22 +4,30 @@ import sys
 import click
 
 from pf9.cli.commands import version
-from pf9.cluster.commands import cluster
-from pf9.config.commands import config
-from pf9.modules.util import Logger
-from pf9.support.commands import support
+from pf9.cli.lazy_group import LazyGroup
+from pf9.modules.util import Logger, LOG_LEVELS
 
 # Initialize logger
 logger = Logger(os.path.join(os.path.expanduser("~"), 'pf9/log/pf9ctl.log')).get_logger(__name__)
 logger.info(msg=__name__ + "Initialized")
 
 
-@click.group()
+# Top-level commands are imported only when invoked (or listed by --help)
+# Any commands added here will be toplevel
+@click.group(cls=LazyGroup, lazy_subcommands={
+    'config': 'pf9.config.commands.config',
+    'support': 'pf9.support.commands.support',
+    'cluster': 'pf9.cluster.commands.cluster',
+})
 @click.version_option(message='%(version)s')
+@click.option('--log-level', envvar='PF9_LOG_LEVEL', default='DEBUG', show_default=True,
+              type=click.Choice(LOG_LEVELS, case_sensitive=False),
+              help='Level of messages written to ~/pf9/log/pf9ctl.log.')
 @click.pass_context
-def cli(ctx):
+def cli(ctx, log_level):
     """Express-CLI
     A CLI for Platform9 Express."""
+    Logger.set_level(log_level)
     # Set Global Vars into context objs
     if ctx.obj is None:
         ctx.obj = dict()
@@ -38,11 +46,4 @@ def cli(ctx):
     ctx.obj['pf9_ansible_cfg'] = os.path.join(ctx.obj['pf9_exp_dir'], 'ansible.cfg')
     ctx.obj['pf9_k8_playbook'] = os.path.join(ctx.obj['pf9_exp_dir'], 'pf9-k8s-express.yml')
 
-# Add top-level commands to cli.
-# Any commands defined here or added will be toplevel
-
-
 # cli.add_command(version)
-cli.add_command(config)
-cli.add_command(support)
-cli.add_command(cluster)
@@ -0,0 +1,104 @@
+# Platform9 Systems, Inc. - https://www.platform9.com/
+#
+# Streams playbook events as JSON lines, one per line and flushed as they happen,
+# to the file named by the PF9_EVENT_LOG environment variable. The event shape
+# follows ansible-runner: {"event": ..., "counter": ..., "created": ..., "event_data": {...}}
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+
+DOCUMENTATION = '''
+    callback: pf9_events
+    type: notification
+    short_description: Stream playbook events as JSON lines for express-cli
+    description:
+      - Writes one JSON document per task result to the file in PF9_EVENT_LOG.
+      - Does nothing when PF9_EVENT_LOG is not set.
+    requirements:
+      - whitelisting in configuration
+'''
+
+import os
+import json
+import datetime
+
+from ansible.plugins.callback import CallbackBase
+
+# Result keys copied into the event, the full result can be large or sensitive
+RESULT_KEYS = ('msg', 'rc', 'changed', 'failed', 'unreachable', 'skipped', 'skip_reason')
+STDERR_TAIL_CHARS = 2000
+
+
+class CallbackModule(CallbackBase):
+    CALLBACK_VERSION = 2.0
+    CALLBACK_TYPE = 'notification'
+    CALLBACK_NAME = 'pf9_events'
+    CALLBACK_NEEDS_WHITELIST = True
+
+    def __init__(self):
+        super(CallbackModule, self).__init__()
+        self.counter = 0
+        self.play = None
+        self.event_log = None
+        event_log_path = os.environ.get('PF9_EVENT_LOG')
+        if event_log_path:
+            self.event_log = open(event_log_path, 'a')
+
+    def emit(self, event, **event_data):
+        if self.event_log is None:
+            return
+        self.counter += 1
+        self.event_log.write(json.dumps({
+            'event': event,
+            'counter': self.counter,
+            'pid': os.getpid(),
+            'created': datetime.datetime.utcnow().isoformat(),
+            'event_data': event_data,
+        }, default=str) + '\n')
+        self.event_log.flush()
+
+    def task_data(self, task):
+        role = task._role.get_name() if task._role else None
+        return dict(play=self.play, task=task.get_name(), task_action=task.action, role=role)
+
+    def result_data(self, result):
+        res = dict((key, result._result[key]) for key in RESULT_KEYS if key in result._result)
+        if result._result.get('stderr'):
+            res['stderr'] = result._result['stderr'][-STDERR_TAIL_CHARS:]
+        data = self.task_data(result._task)
+        data.update(host=result._host.get_name(), res=res)
+        return data
+
+    def v2_playbook_on_start(self, playbook):
+        self.emit('playbook_on_start', playbook=os.path.basename(playbook._file_name))
+
+    def v2_playbook_on_play_start(self, play):
+        self.play = play.get_name()
+        self.emit('playbook_on_play_start', play=self.play)
+
+    def v2_playbook_on_task_start(self, task, is_conditional):
+        self.emit('playbook_on_task_start', **self.task_data(task))
+
+    def v2_runner_on_start(self, host, task):
+        data = self.task_data(task)
+        data.update(host=host.get_name())
+        self.emit('runner_on_start', **data)
+
+    def v2_runner_on_ok(self, result):
+        self.emit('runner_on_ok', **self.result_data(result))
+
+    def v2_runner_on_failed(self, result, ignore_errors=False):
+        self.emit('runner_on_failed', ignore_errors=ignore_errors, **self.result_data(result))
+
+    def v2_runner_on_skipped(self, result):
+        self.emit('runner_on_skipped', **self.result_data(result))
+
+    def v2_runner_on_unreachable(self, result):
+        self.emit('runner_on_unreachable', **self.result_data(result))
+
+    def v2_playbook_on_stats(self, stats):
+        self.emit('playbook_on_stats',
+                  ok=stats.ok, failures=stats.failures, dark=stats.dark,
+                  changed=stats.changed, skipped=stats.skipped)
+        if self.event_log is not None:
+            self.event_log.close()
+            self.event_log = None
@@ -0,0 +1,134 @@
+#!/usr/bin/python
+# Platform9 Systems, Inc. - https://www.platform9.com/
+#
+# Collects the Platform9 state of a host in a single module call, in place of the
+# grep/awk/cat probes of /etc/passwd, /etc/group, the package database and host_id.conf.
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+
+DOCUMENTATION = '''
+    module: pf9_facts
+    short_description: Platform9 host state as facts for express-cli
+    description:
+      - Sets the pf9_* facts of a host in one call, without running a shell per probe.
+    options:
+      uid:
+        description: Custom UID of the pf9 service account, sets pf9_uid_in_use.
+        required: false
+      gid:
+        description: Custom GID of pf9group, sets pf9_gid_in_use.
+        required: false
+'''
+
+EXAMPLES = '''
+- name: Gather Platform9 facts
+  pf9_facts:
+    uid: "{{ pf9_uid | default(omit) }}"
+    gid: "{{ pf9_gid | default(omit) }}"
+'''
+
+RETURN = '''
+ansible_facts:
+  description: Platform9 facts of the host
+  returned: always
+  type: complex
+  contains:
+    pf9_host_id:
+      description: host_id of /etc/pf9/host_id.conf, empty until pf9-hostagent is installed
+      type: str
+    pf9_user_exists:
+      description: whether the pf9 service account exists
+      type: bool
+    pf9_uid_in_use:
+      description: whether uid is taken by an account, only with uid
+      type: bool
+    pf9_gid_in_use:
+      description: whether gid is taken by a group, only with gid
+      type: bool
+    pf9_hostagent_installed:
+      description: whether the pf9-hostagent package is installed
+      type: bool
+'''
+
+import grp
+import pwd
+
+from ansible.module_utils.basic import AnsibleModule
+
+HOST_ID_CONF = '/etc/pf9/host_id.conf'
+PF9_USER = 'pf9'
+HOSTAGENT_PACKAGE = 'pf9-hostagent'
+
+
+def read_host_id(path=HOST_ID_CONF):
+    """return the host_id set in path, '' without one"""
+    try:
+        with open(path) as conf:
+            for line in conf:
+                key, sep, value = line.partition('=')
+                if sep and key.strip() == 'host_id':
+                    return value.strip()
+    except (IOError, OSError):
+        pass
+    return ''
+
+
+def user_exists(name):
+    try:
+        pwd.getpwnam(name)
+    except KeyError:
+        return False
+    return True
+
+
+def uid_in_use(uid):
+    try:
+        pwd.getpwuid(uid)
+    except KeyError:
+        return False
+    return True
+
+
+def gid_in_use(gid):
+    try:
+        grp.getgrgid(gid)
+    except KeyError:
+        return False
+    return True
+
+
+def hostagent_installed(module):
+    """Query dpkg or rpm, whichever the host has, for the pf9-hostagent package"""
+    dpkg_query = module.get_bin_path('dpkg-query')
+    if dpkg_query:
+        rc, out, _ = module.run_command([dpkg_query, '-W', '-f=${Status}', HOSTAGENT_PACKAGE])
+        return rc == 0 and out.strip().endswith(' installed')
+    rpm = module.get_bin_path('rpm')
+    if rpm:
+        rc, _, _ = module.run_command([rpm, '-q', HOSTAGENT_PACKAGE])
+        return rc == 0
+    return False
+
+
+def main():
+    module = AnsibleModule(
+        argument_spec=dict(
+            uid=dict(type='int', required=False),
+            gid=dict(type='int', required=False),
+        ),
+        supports_check_mode=True,
+    )
+    facts = {
+        'pf9_host_id': read_host_id(),
+        'pf9_user_exists': user_exists(PF9_USER),
+        'pf9_hostagent_installed': hostagent_installed(module),
+    }
+    if module.params['uid'] is not None:
+        facts['pf9_uid_in_use'] = uid_in_use(module.params['uid'])
+    if module.params['gid'] is not None:
+        facts['pf9_gid_in_use'] = gid_in_use(module.params['gid'])
+    module.exit_json(changed=False, ansible_facts=facts)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,7 +1,11 @@
 import getpass
+import hashlib
 import json
 import optparse
+import os
+import socket
 import sys
+import time
 
 if sys.version_info.major == 2:
     import httplib
@@ -10,19 +14,59 @@ elif sys.version_info.major == 3:
     from http import client as httplib
     from urllib import parse as urlparse
 
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+DOWNLOAD_ATTEMPTS = 5
+# Errors after which a connection is dropped and the request or download is retried
+CONNECTION_ERRORS = (socket.error, httplib.HTTPException)
 
-def do_request(action, host, relative_url, headers, body, proxyHost="", proxyPort=""):
-    if proxyHost != "" and proxyPort != "":
-        conn = httplib.HTTPSConnection(proxyHost, proxyPort)
-        conn.set_tunnel(host, 443)
+# One keep-alive connection per (host, proxy), shared by all requests of the run
+_connections = {}
 
-    else:
-        conn = httplib.HTTPSConnection(host)
-    
-    body_json = json.JSONEncoder().encode(body)
-    conn.request(action, relative_url, body_json, headers)
-    response = conn.getresponse()
-    return conn, response
+
+def get_connection(host, proxyHost="", proxyPort=""):
+    key = (host, proxyHost, proxyPort)
+    conn = _connections.get(key)
+    if conn is None:
+        if proxyHost != "" and proxyPort != "":
+            conn = httplib.HTTPSConnection(proxyHost, proxyPort)
+            conn.set_tunnel(host, 443)
+        else:
+            conn = httplib.HTTPSConnection(host)
+        _connections[key] = conn
+    return conn
+
+
+def drop_connection(host, proxyHost="", proxyPort=""):
+    conn = _connections.pop((host, proxyHost, proxyPort), None)
+    if conn is not None:
+        conn.close()
+
+
+def close_connections():
+    for key in list(_connections):
+        drop_connection(*key)
+
+
+def do_request(action, host, relative_url, headers, body, proxyHost="", proxyPort=""):
+    """Send a request over the pooled connection of host, reconnecting once if the server
+    closed the idle connection. The response must be read completely before the next request.
+    """
+    # no body on GETs, an unread body would corrupt the next request of the kept-alive connection
+    body_json = json.JSONEncoder().encode(body) if body else None
+    for attempt in range(2):
+        conn = get_connection(host, proxyHost, proxyPort)
+        try:
+            conn.request(action, relative_url, body_json, headers)
+            response = conn.getresponse()
+            return conn, response
+        except CONNECTION_ERRORS:
+            drop_connection(host, proxyHost, proxyPort)
+            if attempt:
+                raise
+
+
+def read_json(response):
+    return json.loads(response.read().decode('utf-8'))
 
 
 def download_report(bytes_so_far, total_size, installer_name):
@@ -35,35 +79,127 @@ def download_report(bytes_so_far, total_size, installer_name):
         sys.stdout.write('\n')
 
 
-def download_installer(url, token, cookie, installer_name, proxyHost="", proxyPort=""):
-    headers = {"X-Auth-Token": token, "cookie": cookie}
-    body = ""
+def file_sha256(path):
+    sha256 = hashlib.sha256()
+    with open(path, 'rb') as f:
+        while True:
+            chunk = f.read(DOWNLOAD_CHUNK_SIZE)
+            if not chunk:
+                break
+            sha256.update(chunk)
+    return sha256
 
-    _, net_location, path, _, _ = urlparse.urlsplit(url)
-    conn, response = do_request("GET", net_location, path, headers, body, proxyHost, proxyPort)
 
-    if response.status != 200:
-        print("{0}: {1}".format(response.status, response.reason))
-        exit(1)
+def read_meta(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (IOError, ValueError):
+        return {}
+
 
-    total_size = int(response.getheader('Content-Length').strip())
-    bytes_read = 0
+def write_meta(path, meta):
+    with open(path + '.tmp', 'w') as f:
+        json.dump(meta, f)
+    os.rename(path + '.tmp', path)
 
-    # writes the file in the current working directory
-    installer_file = open(installer_name, 'wb')
 
-    while True:
-        body = response.read(512 * 1024)
-        bytes_read += len(body)
+def installer_is_current(installer_name, meta):
+    """The installer on disk is complete and unmodified since its download"""
+    if not meta.get('sha256') or not os.path.isfile(installer_name):
+        return False
+    if os.path.getsize(installer_name) != meta.get('size'):
+        return False
+    return file_sha256(installer_name).hexdigest() == meta['sha256']
 
-        if not body:
-            break
 
-        installer_file.write(body)
-        download_report(bytes_read, total_size, installer_name)
+def response_validators(response):
+    return {'etag': response.getheader('ETag'), 'last_modified': response.getheader('Last-Modified')}
 
-    installer_file.close()
-    conn.close()
+
+def download_installer(url, token, cookie, installer_name, proxyHost="", proxyPort=""):
+    """Download url to installer_name in the current working directory.
+    installer_name.meta keeps the validators, size and sha256 of the download: an unchanged
+    installer is not downloaded again and an interrupted download resumes from installer_name.part.
+    """
+    _, net_location, path, _, _ = urlparse.urlsplit(url)
+    part_name = installer_name + '.part'
+    meta_name = installer_name + '.meta'
+    meta = read_meta(meta_name)
+    if meta.get('url') != url:
+        meta = {'url': url}
+    current = installer_is_current(installer_name, meta)
+
+    for attempt in range(1, DOWNLOAD_ATTEMPTS + 1):
+        headers = {"X-Auth-Token": token, "cookie": cookie}
+        validator = meta.get('etag') or meta.get('last_modified')
+        bytes_read = os.path.getsize(part_name) if os.path.isfile(part_name) and validator else 0
+        if current:
+            # revalidate the installer on disk
+            if meta.get('etag'):
+                headers['If-None-Match'] = meta['etag']
+            if meta.get('last_modified'):
+                headers['If-Modified-Since'] = meta['last_modified']
+        elif bytes_read:
+            # resume, unless the installer changed since the partial download started
+            headers['Range'] = 'bytes={0}-'.format(bytes_read)
+            headers['If-Range'] = validator
+
+        try:
+            conn, response = do_request("GET", net_location, path, headers, "", proxyHost, proxyPort)
+            if response.status == 304 and current:
+                response.read()
+                print("{0}: unchanged, skipping download".format(installer_name))
+                return
+            if response.status == 416:
+                # the partial download does not fit the installer anymore, start over
+                response.read()
+                os.remove(part_name)
+                continue
+            if response.status == 206 and bytes_read:
+                sha256 = file_sha256(part_name)
+                installer_file = open(part_name, 'ab')
+            elif response.status == 200:
+                bytes_read = 0
+                sha256 = hashlib.sha256()
+                meta = {'url': url}
+                meta.update(response_validators(response))
+                write_meta(meta_name, meta)
+                installer_file = open(part_name, 'wb')
+            else:
+                response.read()
+                print("{0}: {1}".format(response.status, response.reason))
+                exit(1)
+
+            total_size = bytes_read + int(response.getheader('Content-Length').strip())
+            try:
+                while True:
+                    body = response.read(DOWNLOAD_CHUNK_SIZE)
+                    if not body:
+                        break
+                    bytes_read += len(body)
+                    installer_file.write(body)
+                    sha256.update(body)
+                    download_report(bytes_read, total_size, installer_name)
+            finally:
+                installer_file.close()
+            if bytes_read != total_size:
+                raise httplib.IncompleteRead(b'', total_size - bytes_read)
+        except CONNECTION_ERRORS as except_err:
+            drop_connection(net_location, proxyHost, proxyPort)
+            current = False
+            print("{0}: download interrupted ({1}), attempt {2} of {3}".format(
+                installer_name, except_err, attempt, DOWNLOAD_ATTEMPTS))
+            time.sleep(min(30, 2 ** attempt))
+            continue
+
+        os.rename(part_name, installer_name)
+        meta.update(size=bytes_read, sha256=sha256.hexdigest())
+        write_meta(meta_name, meta)
+        return
+
+    print("{0}: download failed after {1} attempts".format(installer_name, DOWNLOAD_ATTEMPTS))
+    exit(1)
 
 
 def get_package_info_from_token(host, token, region, proxyHost="", proxyPort=""):
@@ -82,10 +218,8 @@ def get_package_info_from_token(host, token, region, proxyHost="", proxyPort="")
         print("{0}: {1}".format(response.status, response.reason))
         exit(1)
 
-    response_text = response.read().decode('utf-8')
-    response_body = json.loads(response_text)
+    response_body = read_json(response)
     service_id = response_body['services'][0]['id']
-    conn.close()
 
     conn, response = do_request(
         "GET", host,
@@ -95,15 +229,13 @@ def get_package_info_from_token(host, token, region, proxyHost="", proxyPort="")
         print("{0}: {1}".format(response.status, response.reason))
         exit(1)
 
-    response_text = response.read().decode('utf-8')
-    response_body = json.loads(response_text)
+    response_body = read_json(response)
     for endpoint in response_body['endpoints']:
         if endpoint['region'] == region:
             if endpoint['interface'] == 'internal':
                 internal_url = endpoint['url']
             elif endpoint['interface'] == 'public':
                 public_url = endpoint['url']
-    conn.close()
 
     _, net_location, path, _, _ = urlparse.urlsplit(public_url)
     conn, response = do_request("GET", net_location, path, headers, {}, proxyHost, proxyPort)
@@ -111,10 +243,8 @@ def get_package_info_from_token(host, token, region, proxyHost="", proxyPort="")
         print("{0}: {1}".format(response.status, response.reason))
         exit(1)
 
-    response_text = response.read().decode('utf-8')
-    response_body = json.loads(response_text)
+    response_body = read_json(response)
     cookie_url = response_body['links']['token2cookie']
-    conn.close()
 
     _, net_location, path, _, _ = urlparse.urlsplit(cookie_url)
     conn, response = do_request("GET", net_location, path, headers, {}, proxyHost, proxyPort)
@@ -123,7 +253,7 @@ def get_package_info_from_token(host, token, region, proxyHost="", proxyPort="")
         exit(1)
 
     cookie = response.getheader('set-cookie')
-    conn.close()
+    response.read()
 
     headers['cookie'] = cookie
     _, net_location, path, _, _ = urlparse.urlsplit(internal_url)
@@ -132,11 +262,9 @@ def get_package_info_from_token(host, token, region, proxyHost="", proxyPort="")
         print("{0}: {1}".format(response.status, response.reason))
         exit(1)
 
-    response_text = response.read().decode('utf-8')
-    response_body = json.loads(response_text)
+    response_body = read_json(response)
     deb_installer = response_body['links']['deb_install']
     rpm_installer = response_body['links']['rpm_install']
-    conn.close()
 
     out = {
         'cookie': cookie,
@@ -151,14 +279,17 @@ def get_package_info_from_token(host, token, region, proxyHost="", proxyPort="")
 
 def get_installer(options, proxyHost="", proxyPort=""):
 
-    info = get_package_info_from_token(options.endpoint, options.token, options.region, proxyHost, proxyPort)
-    if options.platform == 'debian':
-        package_url = info['deb_installer']
-    elif options.platform == 'redhat':
-        package_url = info['rpm_installer']
-
-    installer_name = package_url.rsplit('/', 1)[1]
-    download_installer(package_url, options.token, info['cookie'], installer_name, proxyHost, proxyPort)
+    try:
+        info = get_package_info_from_token(options.endpoint, options.token, options.region, proxyHost, proxyPort)
+        if options.platform == 'debian':
+            package_url = info['deb_installer']
+        elif options.platform == 'redhat':
+            package_url = info['rpm_installer']
+
+        installer_name = package_url.rsplit('/', 1)[1]
+        download_installer(package_url, options.token, info['cookie'], installer_name, proxyHost, proxyPort)
+    finally:
+        close_connections()
 
 
 def main():
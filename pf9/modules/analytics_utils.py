@@ -1,9 +1,15 @@
-import analytics
 import uuid
 import math
 import time
 import datetime
 import os
+import sys
+import glob
+import json
+import atexit
+import subprocess
+from pf9 import __version__
+from pf9.modules.cache import PF9_CACHE_DIR
 from pf9.modules.util import Utils, Logger
 
 logger = Logger(os.path.join(os.path.expanduser("~"), 'pf9/log/pf9ctl.log')).get_logger(__name__)
@@ -15,6 +21,20 @@ segment_prod_write_key = 'qDQpEaZQnDgqpXXG6jiV7OlZGqYZlQAa'
 # Project 'TEST - Python-testing-V2' in segment
 segment_dev_write_key = 't1tdSZocQ49Tx3G66lUjJXkOXjUSYRKx'
 
+# Events are spooled here and flushed by a detached process at exit
+SEGMENT_SPOOL_DIR = os.path.join(PF9_CACHE_DIR, 'analytics/')
+SEGMENT_SPOOL_FILE = os.path.join(SEGMENT_SPOOL_DIR, 'segment_spool.jsonl')
+# Hard limit on the time a flusher spends sending, and on each request
+FLUSH_DEADLINE_SECS = 10
+FLUSH_REQUEST_TIMEOUT = 5
+FLUSH_BATCH_SIZE = 100
+# Oldest events are dropped beyond this, e.g. when Segment is never reachable
+MAX_SPOOLED_EVENTS = 1000
+# Spools claimed by a flusher that did not finish are retried after this
+STALE_SPOOL_SECS = 10 * 60
+
+_flush_on_exit = False
+
 
 def strip_account_url(account_url):
     """
@@ -89,6 +109,10 @@ class SegmentSessionWrapper:
 
 
 class SegmentSession:
+    """Segment events are appended to a local spool file instead of being sent inline.
+    A detached `python -m pf9.modules.analytics_utils` process flushes the spool in
+    bounded batches when the command exits, so telemetry never delays a command.
+    """
 
     def __init__(self, use_dev_key=False, is_enabled=True):
         # unique for the device
@@ -106,20 +130,28 @@ class SegmentSession:
             self.write_key = segment_dev_write_key
         else:
             self.write_key = segment_prod_write_key
-        # Need to set the key into analytics module to take effect
-        analytics.write_key = self.write_key
 
         # send_* calls will actually send data to segment only if is_enabled is True
         self.is_enabled = is_enabled
 
     def use_dev_write_key(self):
         self.write_key = segment_dev_write_key
-        analytics.write_key = self.write_key
 
     def disable_analytics(self):
         self.is_enabled = False
 
+    def _spool(self, message):
+        """Complete message with the fields analytics-python would add and append it to the spool"""
+        message.setdefault('anonymousId', self.anonymous_id)
+        message.setdefault('integrations', {})
+        message['timestamp'] = datetime.datetime.utcnow().isoformat() + '+00:00'
+        message['messageId'] = str(uuid.uuid4())
+        message['context'] = {'library': {'name': 'express-cli', 'version': __version__}}
+        spool_event(self.write_key, message)
+
     def send_track(self, event_name, event_properties, user_id=None):
+        if not self.is_enabled:
+            return
         track_dict = {
             'anonymous_id': self.anonymous_id,
             'wizard_name': event_name,
@@ -133,24 +165,30 @@ class SegmentSession:
             track_dict['user_id'] = user_id
             track_user_id = user_id
         try:
-            if self.is_enabled:
-                analytics.track(track_user_id, event_name, track_dict,
-                    anonymous_id=self.anonymous_id,
-                    # The 'integrations array begin passed below is how the 'session' identifier is passed into Amplitude
-                    integrations={
-                        'Amplitude': {
-                            'session_id': self.session_time
-                        }
+            self._spool({
+                'type': 'track',
+                'event': event_name,
+                'userId': track_user_id,
+                'properties': track_dict,
+                # The 'integrations array begin passed below is how the 'session' identifier is passed into Amplitude
+                'integrations': {
+                    'Amplitude': {
+                        'session_id': self.session_time
                     }
-                )
+                }
+            })
         except Exception as except_err:
-            logger.error("Exception in send_track while communicating to segment")
+            logger.error("Exception in send_track while spooling segment event")
             logger.exception(except_err)
 
     def send_identify(self, email, user_id):
+        if not self.is_enabled:
+            return
         try:
-            if self.is_enabled:
-                analytics.identify(user_id, {
+            self._spool({
+                'type': 'identify',
+                'userId': user_id,
+                'traits': {
                     'anonymous_id': self.anonymous_id,
                     'installation_id': self.device_id,
                     'email': email,
@@ -158,22 +196,118 @@ class SegmentSession:
                     'deviceId': user_id,
                     # all DATE and TIME submissions need to be in ISO 8601 format
                     'createdAt': datetime.datetime.now().isoformat(),
-                    },
-                   anonymous_id=self.anonymous_id,
-                )
-                # Associate old unauthenticated events to post-authenticated events
-                analytics.alias(self.anonymous_id, user_id)
+                }
+            })
+            # Associate old unauthenticated events to post-authenticated events
+            self._spool({'type': 'alias', 'previousId': self.anonymous_id, 'userId': user_id})
         except Exception as except_err:
-            logger.error("Exception in send_identify while communicating to segment")
+            logger.error("Exception in send_identify while spooling segment event")
             logger.exception(except_err)
 
     def send_group(self, user_id, du_account_url):
+        if not self.is_enabled:
+            return
         try:
-            if self.is_enabled:
-                analytics.group(user_id, strip_account_url(du_account_url), traits={'ddu_url_': 'DU',
-                                                                 'account_url_': strip_account_url(du_account_url),
-                                                                 'cli_last_executed_at': datetime.datetime.now().isoformat()},
-                                anonymous_id=self.anonymous_id)
+            self._spool({
+                'type': 'group',
+                'userId': user_id,
+                'groupId': strip_account_url(du_account_url),
+                'traits': {'ddu_url_': 'DU',
+                           'account_url_': strip_account_url(du_account_url),
+                           'cli_last_executed_at': datetime.datetime.now().isoformat()}
+            })
         except Exception as except_err:
-            logger.error("Exception in send_group while communicating to segment")
+            logger.error("Exception in send_group while spooling segment event")
             logger.exception(except_err)
+
+
+def spool_event(write_key, message):
+    """Append one event to the spool and make sure a flusher is started when this process exits"""
+    global _flush_on_exit
+    if not os.path.isdir(SEGMENT_SPOOL_DIR):
+        os.makedirs(SEGMENT_SPOOL_DIR)
+    with open(SEGMENT_SPOOL_FILE, 'a') as spool:
+        spool.write(json.dumps({'write_key': write_key, 'message': message}) + '\n')
+    if not _flush_on_exit:
+        _flush_on_exit = True
+        atexit.register(start_background_flush)
+
+
+def start_background_flush():
+    """Start a detached flusher so the exiting command never waits on the network"""
+    try:
+        with open(os.devnull, 'w') as devnull:
+            subprocess.Popen([sys.executable, '-m', 'pf9.modules.analytics_utils'],
+                             stdin=devnull, stdout=devnull, stderr=devnull,
+                             close_fds=True, start_new_session=True)
+    except Exception as except_err:
+        logger.exception(except_err)
+
+
+def _claim_spool_files():
+    """Atomically take ownership of the spool and of spools left behind by crashed flushers"""
+    claimed = []
+    own_file = "{}.{}.flushing".format(SEGMENT_SPOOL_FILE, os.getpid())
+    try:
+        os.rename(SEGMENT_SPOOL_FILE, own_file)
+        claimed.append(own_file)
+    except OSError:
+        pass
+    for stale_file in glob.glob(SEGMENT_SPOOL_FILE + '.*.flushing'):
+        try:
+            if stale_file != own_file and os.path.getmtime(stale_file) < time.time() - STALE_SPOOL_SECS:
+                stale_claim = "{}.{}.{}.flushing".format(SEGMENT_SPOOL_FILE, os.getpid(), len(claimed))
+                os.rename(stale_file, stale_claim)
+                claimed.append(stale_claim)
+        except OSError:
+            continue
+    return claimed
+
+
+def flush_spool(deadline_secs=FLUSH_DEADLINE_SECS, batch_size=FLUSH_BATCH_SIZE):
+    """Send spooled events to Segment in batches until done or deadline_secs elapsed.
+    Events that could not be sent are returned to the spool, capped to MAX_SPOOLED_EVENTS.
+            return number of events sent
+    """
+    deadline = time.time() + deadline_secs
+    claimed = _claim_spool_files()
+    if not claimed:
+        return 0
+    events = []
+    for claimed_file in claimed:
+        with open(claimed_file, 'r') as spool:
+            for line in spool:
+                try:
+                    events.append(json.loads(line))
+                except ValueError:
+                    continue
+
+    from analytics.request import post
+    sent = 0
+    unsent = []
+    for write_key in sorted(set(event['write_key'] for event in events)):
+        messages = [event['message'] for event in events if event['write_key'] == write_key]
+        for start in range(0, len(messages), batch_size):
+            batch = messages[start:start + batch_size]
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                unsent.extend({'write_key': write_key, 'message': message} for message in batch)
+                continue
+            try:
+                post(write_key, timeout=min(remaining, FLUSH_REQUEST_TIMEOUT), batch=batch)
+                sent += len(batch)
+            except Exception as except_err:
+                logger.info("Segment flush failed, {} events kept in spool: {}".format(len(batch), except_err))
+                unsent.extend({'write_key': write_key, 'message': message} for message in batch)
+
+    if unsent:
+        with open(SEGMENT_SPOOL_FILE, 'a') as spool:
+            for event in unsent[-MAX_SPOOLED_EVENTS:]:
+                spool.write(json.dumps(event) + '\n')
+    for claimed_file in claimed:
+        os.remove(claimed_file)
+    return sent
+
+
+if __name__ == '__main__':
+    flush_spool()
@@ -0,0 +1,174 @@
+"""
+Execution backends for the Express playbooks.
+RunnerPlaybook drives ansible-playbook through ansible-runner: inventory and extravars are
+handed over as Python objects, events arrive through a callback and runs can be cancelled.
+SubprocessPlaybook is the ansible-playbook command line fallback when ansible-runner is missing.
+Both expose the same start/events/is_running/cancel/close interface.
+"""
+
+import os
+import json
+import shlex
+import shutil
+import tempfile
+import threading
+import subprocess
+from collections import deque
+
+from pf9.modules.ansible_events import EventTail
+from pf9.modules.util import Logger
+
+logger = Logger(os.path.join(os.path.expanduser("~"), 'pf9/log/pf9ctl.log')).get_logger(__name__)
+
+# event_data keys kept in the structured event log, 'res' is reduced to RESULT_KEYS
+EVENT_DATA_KEYS = ('play', 'task', 'task_action', 'role', 'host', 'ignore_errors')
+RESULT_KEYS = ('msg', 'rc', 'changed', 'failed', 'unreachable', 'skipped', 'skip_reason')
+
+
+def ansible_runner_available():
+    try:
+        import ansible_runner
+    except ImportError:
+        return False
+    return True
+
+
+def slim_event(event):
+    """Reduce an ansible-runner event to the shape written by the pf9_events callback plugin"""
+    event_data = event.get('event_data') or {}
+    slim_data = dict((key, event_data[key]) for key in EVENT_DATA_KEYS if key in event_data)
+    res = event_data.get('res')
+    if isinstance(res, dict):
+        slim_data['res'] = dict((key, res[key]) for key in RESULT_KEYS if key in res)
+    return {'event': event.get('event'), 'counter': event.get('counter'),
+            'pid': event.get('pid'), 'created': event.get('created'), 'event_data': slim_data}
+
+
+class SubprocessPlaybook:
+    """Run an ansible-playbook command line, events are read back from the pf9_events plugin log"""
+    def __init__(self, cmd, log_file, event_log, env=None):
+        self.cmd = cmd
+        self.log_file = log_file
+        self.event_log = event_log
+        self.env = dict(env if env is not None else os.environ)
+        self.env['PF9_EVENT_LOG'] = event_log
+        self.tail = EventTail(event_log)
+        self.proc = None
+        self.log_file_write = None
+
+    def start(self):
+        self.log_file_write = open(self.log_file, 'w')
+        self.proc = subprocess.Popen(shlex.split(self.cmd), env=self.env, stdout=self.log_file_write,
+                                     stderr=subprocess.STDOUT)
+
+    def events(self):
+        return self.tail.read()
+
+    def is_running(self):
+        return self.proc.poll() is None
+
+    def cancel(self):
+        if self.is_running():
+            self.proc.terminate()
+            self.proc.wait()
+
+    @property
+    def returncode(self):
+        return self.proc.poll()
+
+    def close(self):
+        if self.log_file_write is not None:
+            self.log_file_write.close()
+            self.log_file_write = None
+
+
+class RunnerPlaybook:
+    """Run a playbook with ansible_runner.run_async, with in-memory inventory and extravars.
+    The playbook output goes to log_file and a slim copy of every event to event_log.
+    """
+    def __init__(self, playbook, inventory, extravars, log_file, event_log, limit=None, forks=None,
+                 binary=None, envvars=None, cmdline=None):
+        self.playbook = playbook
+        self.inventory = inventory
+        self.extravars = extravars
+        self.log_file = log_file
+        self.event_log = event_log
+        self.limit = limit
+        self.forks = forks
+        self.binary = binary
+        self.envvars = envvars or {}
+        self.cmdline = cmdline
+        self.cancelled = False
+        self.pending_events = deque()
+        self.write_lock = threading.Lock()
+        self.private_data_dir = None
+        self.thread = None
+        self.runner = None
+        self.log_file_write = None
+        self.event_log_write = None
+
+    def start(self):
+        import ansible_runner
+        # holds the inventory with the SSH credentials, private to the user and removed in close()
+        self.private_data_dir = tempfile.mkdtemp(prefix='pf9_runner_')
+        self.log_file_write = open(self.log_file, 'w')
+        self.event_log_write = open(self.event_log, 'w')
+        self.thread, self.runner = ansible_runner.run_async(
+            private_data_dir=self.private_data_dir,
+            playbook=self.playbook,
+            inventory=self.inventory,
+            extravars=self.extravars,
+            limit=self.limit,
+            forks=self.forks,
+            binary=self.binary,
+            envvars=self.envvars,
+            cmdline=self.cmdline,
+            quiet=True,
+            event_handler=self.on_event,
+            cancel_callback=lambda: self.cancelled)
+
+    def on_event(self, event):
+        with self.write_lock:
+            if event.get('stdout'):
+                self.log_file_write.write(event['stdout'] + '\n')
+                self.log_file_write.flush()
+            if event.get('event') and event['event'] != 'verbose':
+                pf9_event = slim_event(event)
+                self.event_log_write.write(json.dumps(pf9_event, default=str) + '\n')
+                self.event_log_write.flush()
+                self.pending_events.append(pf9_event)
+        # keep ansible-runner's own job event artifacts out of private_data_dir
+        return False
+
+    def events(self):
+        events = []
+        while self.pending_events:
+            events.append(self.pending_events.popleft())
+        return events
+
+    def is_running(self):
+        return self.thread.is_alive()
+
+    def cancel(self):
+        self.cancelled = True
+        self.thread.join()
+
+    @property
+    def returncode(self):
+        if self.is_running():
+            return None
+        if self.runner.rc is None:
+            # ansible-playbook never ran, e.g. the binary is missing
+            return 0 if self.runner.status == 'successful' else 1
+        return self.runner.rc
+
+    def close(self):
+        if self.thread is not None:
+            self.thread.join()
+        for write_file in (self.log_file_write, self.event_log_write):
+            if write_file is not None:
+                write_file.close()
+        self.log_file_write = self.event_log_write = None
+        if self.private_data_dir is not None:
+            shutil.rmtree(self.private_data_dir, ignore_errors=True)
+            self.private_data_dir = None
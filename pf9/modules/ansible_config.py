@@ -0,0 +1,84 @@
+"""
+Runtime Ansible configuration for the Express playbooks.
+The bundled pf9/express/ansible.cfg is extended with SSH connection multiplexing,
+smart fact gathering backed by a jsonfile fact cache and the selected strategy, and
+written with absolute paths so it can live outside of the express directory.
+"""
+
+import os
+import tempfile
+from configparser import RawConfigParser
+
+from pf9.modules.cache import PF9_DIR, PF9_CACHE_DIR
+
+ANSIBLE_RUNTIME_DIR = os.path.join(PF9_CACHE_DIR, 'ansible/')
+ANSIBLE_FACT_CACHE_DIR = os.path.join(PF9_CACHE_DIR, 'facts/')
+# ssh limits ControlPath to ~100 characters, keep the socket directory short
+ANSIBLE_CONTROL_PATH_DIR = os.path.join(PF9_DIR, 'cp')
+# Cached facts are reused by `--reuse-facts` runs for up to a day
+FACT_CACHE_TIMEOUT = 24 * 60 * 60
+CONTROL_PERSIST_SECS = 300
+STRATEGIES = ('linear', 'free')
+# Options of the bundled config that hold paths relative to the express directory
+PATH_OPTIONS = ('inventory', 'role_path', 'roles_path', 'callback_plugins', 'library')
+
+
+def ansible_cfg_settings(strategy='linear'):
+    """Settings layered over the bundled ansible.cfg, by section"""
+    return {
+        'defaults': {
+            'gathering': 'smart',
+            'fact_caching': 'jsonfile',
+            'fact_caching_connection': ANSIBLE_FACT_CACHE_DIR,
+            'fact_caching_timeout': str(FACT_CACHE_TIMEOUT),
+            'strategy': strategy,
+        },
+        'ssh_connection': {
+            'pipelining': 'True',
+            'ssh_args': '-C -o ControlMaster=auto -o ControlPersist={}s'.format(CONTROL_PERSIST_SECS),
+            'control_path_dir': ANSIBLE_CONTROL_PATH_DIR,
+        },
+    }
+
+
+def write_ansible_cfg(bundled_cfg, strategy='linear', runtime_dir=None):
+    """Write the tuned config derived from bundled_cfg, rewriting it only when it changed
+            return path of the runtime ansible.cfg
+    """
+    if strategy not in STRATEGIES:
+        raise ValueError("Unknown Ansible strategy: {}".format(strategy))
+    runtime_dir = runtime_dir or ANSIBLE_RUNTIME_DIR
+    express_dir = os.path.dirname(os.path.abspath(bundled_cfg))
+    config = RawConfigParser()
+    config.read(bundled_cfg)
+    for section in config.sections():
+        for option in PATH_OPTIONS:
+            if config.has_option(section, option):
+                paths = [os.path.join(express_dir, path.strip())
+                         for path in config.get(section, option).split(':')]
+                config.set(section, option, ':'.join(paths))
+    for section, settings in sorted(ansible_cfg_settings(strategy).items()):
+        if not config.has_section(section):
+            config.add_section(section)
+        for option, value in sorted(settings.items()):
+            config.set(section, option, value)
+
+    for directory in (runtime_dir, ANSIBLE_FACT_CACHE_DIR, ANSIBLE_CONTROL_PATH_DIR):
+        if not os.path.isdir(directory):
+            os.makedirs(directory, 0o700)
+    runtime_cfg = os.path.join(runtime_dir, 'ansible-{}.cfg'.format(strategy))
+    fd, tmp_path = tempfile.mkstemp(dir=runtime_dir, prefix='.tmp_')
+    with os.fdopen(fd, 'w') as tmp_file:
+        config.write(tmp_file)
+    with open(tmp_path, 'r') as tmp_file:
+        new_contents = tmp_file.read()
+    try:
+        with open(runtime_cfg, 'r') as cfg_file:
+            unchanged = cfg_file.read() == new_contents
+    except (IOError, OSError):
+        unchanged = False
+    if unchanged:
+        os.remove(tmp_path)
+    else:
+        os.replace(tmp_path, runtime_cfg)
+    return runtime_cfg
@@ -0,0 +1,103 @@
+"""
+Consumer of the JSON-line event stream written by the pf9_events Ansible callback plugin
+(pf9/express/callback_plugins). Tracks per-host, per-role progress of a prep-node run
+and reports failed or unreachable hosts as soon as their event is written.
+"""
+
+import json
+from collections import namedtuple
+
+# Roles applied to every node by pf9-k8s-express.yml, in order
+PREP_ROLES = ('common', 'ntp', 'disable-swap', 'pf9-hostagent', 'wait-for-convergence')
+
+HostFailure = namedtuple('HostFailure', ['host', 'role', 'task', 'msg', 'unreachable'])
+
+
+class EventTail:
+    """EventTail(path).read() returns the events appended to path since the last read"""
+    def __init__(self, path):
+        self.path = path
+        self.offset = 0
+        self.partial = ''
+
+    def read(self):
+        try:
+            with open(self.path, 'r') as event_log:
+                event_log.seek(self.offset)
+                data = event_log.read()
+                self.offset = event_log.tell()
+        except (IOError, OSError):
+            return []
+        lines = (self.partial + data).split('\n')
+        # the last line is incomplete until the plugin writes its newline
+        self.partial = lines.pop()
+        events = []
+        for line in lines:
+            try:
+                events.append(json.loads(line))
+            except ValueError:
+                continue
+        return events
+
+
+class PrepProgress:
+    """PrepProgress(hosts) folds playbook events into the role each host is running,
+    the roles it completed and the first failure of each host.
+    """
+    def __init__(self, hosts, roles=PREP_ROLES):
+        self.roles = roles
+        self.hosts = list(hosts)
+        self.current_role = dict((host, None) for host in self.hosts)
+        self.completed_roles = dict((host, set()) for host in self.hosts)
+        self.failures = {}
+        self.finished = False
+
+    @property
+    def total_steps(self):
+        return max(1, len(self.hosts) * len(self.roles))
+
+    @property
+    def completed_steps(self):
+        if self.finished:
+            return self.total_steps
+        return sum(len(roles) for roles in self.completed_roles.values())
+
+    def update(self, event):
+        """Apply one event, return the HostFailure it reports or None"""
+        event_type = event.get('event')
+        event_data = event.get('event_data', {})
+        if event_type == 'playbook_on_stats':
+            self.finished = True
+            return None
+        host = event_data.get('host')
+        if host is None:
+            return None
+        if host not in self.current_role:
+            self.hosts.append(host)
+            self.current_role[host] = None
+            self.completed_roles[host] = set()
+        role = event_data.get('role')
+        if role in self.roles and role != self.current_role[host]:
+            # a host moving to a new role has completed the previous one
+            if self.current_role[host] is not None:
+                self.completed_roles[host].add(self.current_role[host])
+            self.current_role[host] = role
+        failed = event_type == 'runner_on_failed' and not event_data.get('ignore_errors')
+        unreachable = event_type == 'runner_on_unreachable'
+        if (failed or unreachable) and host not in self.failures:
+            self.failures[host] = HostFailure(host, role, event_data.get('task'),
+                                              event_data.get('res', {}).get('msg'), unreachable)
+            return self.failures[host]
+        return None
+
+    def status(self):
+        """One line summary, e.g. '2/3 hosts at pf9-hostagent, 1 failed'"""
+        by_role = {}
+        for host, role in self.current_role.items():
+            if host not in self.failures:
+                by_role.setdefault(role or 'starting', []).append(host)
+        summary = ', '.join("{}/{} hosts at {}".format(len(hosts), len(self.hosts), role)
+                            for role, hosts in sorted(by_role.items()))
+        if self.failures:
+            summary = "{}, {} failed".format(summary, len(self.failures))
+        return summary
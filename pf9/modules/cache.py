@@ -0,0 +1,67 @@
+"""
+Small on-disk JSON cache shared by CLI invocations.
+Each key is stored in its own file so concurrent express processes never
+rewrite each other's entries; writes go through a temp file and os.replace.
+"""
+
+import os
+import json
+import time
+import hashlib
+import tempfile
+
+PF9_DIR = os.path.join(os.path.expanduser("~"), 'pf9/')
+PF9_DB_DIR = os.path.join(PF9_DIR, 'db/')
+PF9_CACHE_DIR = os.path.join(PF9_DIR, 'cache/')
+
+
+class FileCache:
+    """FileCache(cache_dir) stores JSON values under cache_dir with an optional expiry"""
+    def __init__(self, cache_dir, ttl=None):
+        self.cache_dir = cache_dir
+        self.ttl = ttl
+
+    @staticmethod
+    def make_key(*parts):
+        """Build a stable key from any number of string parts"""
+        return '|'.join(str(part) for part in parts)
+
+    def _path(self, key):
+        digest = hashlib.sha256(key.encode('utf-8')).hexdigest()
+        return os.path.join(self.cache_dir, digest + '.json')
+
+    def get(self, key):
+        """Return the cached value for key, or None if missing, unreadable or expired"""
+        try:
+            with open(self._path(key), 'r') as cache_file:
+                entry = json.load(cache_file)
+        except (IOError, OSError, ValueError):
+            return None
+        expires_at = entry.get('expires_at')
+        if expires_at is not None and expires_at <= time.time():
+            return None
+        return entry.get('value')
+
+    def set(self, key, value, expires_at=None):
+        """Store value under key. expires_at (epoch secs) defaults to now + ttl"""
+        if expires_at is None and self.ttl is not None:
+            expires_at = time.time() + self.ttl
+        # the key is not stored, it can hold credential digests and the file name is its hash
+        entry = {'expires_at': expires_at, 'value': value}
+        try:
+            if not os.path.isdir(self.cache_dir):
+                os.makedirs(self.cache_dir, 0o700)
+            fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, prefix='.tmp_')
+            with os.fdopen(fd, 'w') as tmp_file:
+                json.dump(entry, tmp_file)
+            os.replace(tmp_path, self._path(key))
+        except (IOError, OSError):
+            # A cache that can not be written is only a missed optimization
+            return False
+        return True
+
+    def delete(self, key):
+        try:
+            os.remove(self._path(key))
+        except OSError:
+            pass
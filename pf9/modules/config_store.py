@@ -0,0 +1,92 @@
+"""
+Process wide store for Express CLI configs (~/pf9/db/express.conf and backups).
+Each config file is parsed once and only re-read when its mtime, size or inode changes.
+"""
+
+import os
+import threading
+from collections import namedtuple
+
+# config file key -> ExpressConfig field
+CONFIG_KEYS = {
+    'config_name': 'name',
+    'du_url': 'du_url',
+    'os_tenant': 'os_tenant',
+    'os_username': 'os_username',
+    'os_region': 'os_region',
+    'os_password': 'os_password',
+    'proxy_url': 'proxy_url',
+    'dns_resolver1': 'dns_resolver1',
+    'dns_resolver_2': 'dns_resolver_2',
+    'manage_hostname': 'manage_hostname',
+    'manage_resolver': 'manage_resolver',
+    'dev_key': 'dev_key',
+    'disable_analytics': 'disable_analytics',
+}
+REQUIRED_KEYS = ('du_url', 'os_username', 'os_password', 'os_tenant', 'os_region')
+
+_ExpressConfig = namedtuple('ExpressConfig', ['name', 'du_url', 'os_username', 'os_password', 'os_tenant',
+                                              'os_region', 'proxy_url', 'dns_resolver1', 'dns_resolver_2',
+                                              'manage_hostname', 'manage_resolver', 'dev_key',
+                                              'disable_analytics'])
+
+
+class ExpressConfig(_ExpressConfig):
+    """Typed record of an Express CLI config. dev_key and disable_analytics are python bools"""
+    __slots__ = ()
+
+    @classmethod
+    def from_dict(cls, config):
+        """Build an ExpressConfig from parse_config_lines() output, raises KeyError on missing keys"""
+        for key in REQUIRED_KEYS:
+            if key not in config:
+                raise KeyError(key)
+        fields = dict((field, config.get(field)) for field in cls._fields)
+        if not fields['name']:
+            fields['name'] = config["os_username"].split('@', 1)[0] + '-' + config["du_url"]
+        fields['dev_key'] = config.get("dev_key") == 'True'
+        fields['disable_analytics'] = config.get("disable_analytics") == 'True'
+        return cls(**fields)
+
+
+def parse_config_lines(config_lines):
+    """Convert pipe separated config lines to a dict with one lookup per line
+            return config
+    """
+    config = {}
+    for line in config_lines:
+        key, separator, value = line.strip().partition('|')
+        if not separator:
+            continue
+        field = CONFIG_KEYS.get(key)
+        if field is not None:
+            config[field] = value
+    return config
+
+
+class ConfigStore:
+    """ConfigStore.load(config_file) returns the ExpressConfig of config_file from memory
+    unless the file changed on disk since it was last parsed.
+    """
+    _entries = {}
+    _lock = threading.Lock()
+
+    @classmethod
+    def load(cls, config_file):
+        """return ExpressConfig, raises OSError/IOError when unreadable and KeyError when incomplete"""
+        file_stat = os.stat(config_file)
+        signature = (file_stat.st_mtime, file_stat.st_size, file_stat.st_ino)
+        with cls._lock:
+            entry = cls._entries.get(config_file)
+            if entry is not None and entry[0] == signature:
+                return entry[1]
+        with open(config_file, 'r') as data:
+            config = ExpressConfig.from_dict(parse_config_lines(data))
+        with cls._lock:
+            cls._entries[config_file] = (signature, config)
+        return config
+
+    @classmethod
+    def clear(cls):
+        with cls._lock:
+            cls._entries.clear()
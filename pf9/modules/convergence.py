@@ -0,0 +1,137 @@
+"""
+Controller-side convergence monitor for the wait-for-convergence role.
+A host waiting for pf9-hostagent to converge writes a '<host_id>.<check>.wait' marker into the
+convergence directory and waits for '<host_id>.<check>.done'. The monitor lists resmgr once per
+interval for all waiting hosts and answers each marker with 'ok', or with the reason it gave up.
+Check 'k8s' waits for the ip_address extension status, 'role' for the host's role_status.
+With assign_role, the hosts that pass the 'k8s' check in an interval get the role assigned in one
+concurrent batch before they are released, in place of the per-host k8s-assign-role tasks.
+"""
+
+import os
+import time
+import threading
+
+from pf9.modules.util import Logger
+
+logger = Logger(os.path.join(os.path.expanduser("~"), 'pf9/log/pf9ctl.log')).get_logger(__name__)
+
+CONVERGENCE_CHECKS = ('k8s', 'role')
+# Same pace and limit as wait_for_agent_convergence.sh, for all hosts at once
+CONVERGENCE_INTERVAL = 3
+CONVERGENCE_TIMEOUT = 1200
+
+
+class ConvergenceMonitor:
+    """ConvergenceMonitor(resmgr, convergence_dir).start() answers the wait markers of
+    convergence_dir from a background thread until stop(). Per-host state transitions are logged.
+    """
+    def __init__(self, resmgr, convergence_dir, interval=CONVERGENCE_INTERVAL, timeout=CONVERGENCE_TIMEOUT,
+                 assign_role=None):
+        self.resmgr = resmgr
+        self.convergence_dir = convergence_dir
+        self.assign_role = assign_role
+        self.interval = interval
+        self.timeout = timeout
+        # (host_id, check) -> last status seen and time of the first poll
+        self.states = {}
+        self.started = {}
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def pending(self):
+        """return (host_id, check) of every wait marker"""
+        waits = []
+        for name in os.listdir(self.convergence_dir):
+            # skip the temporary files of Ansible's atomic copy
+            if name.startswith('.') or not name.endswith('.wait'):
+                continue
+            host_id, _, check = name[:-len('.wait')].rpartition('.')
+            if host_id and check in CONVERGENCE_CHECKS:
+                waits.append((host_id, check))
+        return sorted(waits)
+
+    def check_once(self, now=None):
+        """Answer the wait markers whose host converged or timed out
+                return number of markers still waiting
+        """
+        waits = self.pending()
+        if not waits:
+            return 0
+        try:
+            hosts = dict((host.id, host) for host in self.resmgr.get_hosts_convergence())
+        except Exception as except_err:
+            logger.exception(except_err)
+            hosts = None
+        now = now or time.time()
+        waiting = 0
+        for key in waits:
+            host_id, check = key
+            self.started.setdefault(key, now)
+            if hosts is not None:
+                host = hosts.get(host_id)
+                status = None
+                if host is not None:
+                    status = host.ip_address_status if check == 'k8s' else host.role_status
+                self.transition(key, status or 'unknown')
+        role_errors = self.assign_roles([key[0] for key in waits
+                                         if key[1] == 'k8s' and self.states.get(key) == 'ok'])
+        for key in waits:
+            host_id, check = key
+            started = self.started[key]
+            if check == 'k8s' and host_id in role_errors:
+                self.release(key, "role {} assignment failed: {}".format(self.assign_role, role_errors[host_id]))
+            elif self.states.get(key) == 'ok':
+                self.release(key, 'ok')
+            elif now - started >= self.timeout:
+                self.release(key, "timed out after {}s, last status: {}".format(
+                    self.timeout, self.states.get(key, 'unknown')))
+            else:
+                waiting += 1
+        return waiting
+
+    def assign_roles(self, host_ids):
+        """Assign the role to the hosts of host_ids in one batch
+                return dict of host_id: error message of the hosts that failed
+        """
+        if not self.assign_role or not host_ids:
+            return {}
+        logger.info("Assigning role {} to {} host(s)".format(self.assign_role, len(host_ids)))
+        return self.resmgr.assign_roles(host_ids, self.assign_role)
+
+    def transition(self, key, status):
+        previous = self.states.get(key)
+        if status != previous:
+            logger.info("Host {} {} convergence: {} -> {}".format(key[0], key[1], previous or 'waiting', status))
+            self.states[key] = status
+
+    def release(self, key, result):
+        """Write the done marker atomically, the role reads it as soon as it exists"""
+        marker = os.path.join(self.convergence_dir, '{}.{}'.format(*key))
+        with open(marker + '.done.tmp', 'w') as done_file:
+            done_file.write(result)
+        os.replace(marker + '.done.tmp', marker + '.done')
+        os.remove(marker + '.wait')
+        self.started.pop(key, None)
+        self.states.pop(key, None)
+        if result != 'ok':
+            logger.error("Host {} {} convergence: {}".format(key[0], key[1], result))
+
+    def run(self):
+        while not self.stopped.is_set():
+            try:
+                self.check_once()
+            except Exception as except_err:
+                logger.exception(except_err)
+            self.stopped.wait(self.interval)
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run, name='pf9-convergence-monitor')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
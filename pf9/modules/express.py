@@ -6,44 +6,23 @@ Express can be found @ https://github.com/platform9/express.git
 """
 
 import os
+import json
+import shlex
 import tempfile
 from string import Template
 from pf9.exceptions import CLIException
 from pf9.exceptions import UserAuthFailure
-from pf9.modules.ostoken import GetRegionURL, GetToken
+from pf9.modules.ostoken import GetRegionURL, AuthSession
+from pf9.modules.config_store import ConfigStore, parse_config_lines
+from pf9.modules.resmgr import ResMgr
 from pf9.modules.util import Utils, Logger
+from pf9.modules.ansible_backend import RunnerPlaybook, SubprocessPlaybook, ansible_runner_available
+from pf9.modules.ansible_config import write_ansible_cfg
 
 logger = Logger(os.path.join(os.path.expanduser("~"), 'pf9/log/pf9ctl.log')).get_logger(__name__)
 
-
-class ResMgr:
-    """express.ResMgr(ctx) contains methods to interact with Platform9 Reservation Manager"""
-    def __init__(self, region_url, token):
-        self.region_url = region_url 
-        self.token = token
-
-    def get_hosts(self):
-        """express.ResMgr().get_resmgr_hosts
-        Calls Platform9 Reservation Manager using active config
-        retrieves all hosts associated with the region. (Responding, Not Responding, Not Authorized)
-                return resmgr_hosts_json
-        """
-        return_msg = ("--- Not Implemented ---"
-                      "Move just  call from support bundle here")
-        print(return_msg)
-        return return_msg
-        # resmgr_bundle_resp = requests.post("{}{}/support/bundle".
-        #                                   format(_resmgr_endpoint,
-        #                                          host_values['id']
-        #                                          ), verify=False, headers=headers)
-
-    def request_support_bundle(self, host_id):
-        """express.ResMgr().request_support_bundle(host_id)"""
-        return_msg = ("--- Not Implemented ---"
-                      "Move call from support bundle create"
-                      "takes in ")
-        print(return_msg)
-        return return_msg
+# Nodes prepared in parallel by ansible-playbook, Ansible's own default is 5
+DEFAULT_ANSIBLE_FORKS = 25
 
 
 class Get:
@@ -52,23 +31,27 @@ class Get:
         self.ctx = ctx
 
 
-    def get_token_project(self):
-        """Calls ostoken.GetToken().get_token_project() using active config
-                return token, project_id
+    def auth_session(self):
+        """Calls ostoken.AuthSession.get() using active config.
+        Keystone is contacted at most once per process, every other Get method reads from this session.
+                return AuthSession (token, project_id, user_id, expires_at, catalog)
         """
         try:
             self.active_config()
-            token_project = GetToken().get_token_project(
+            auth = AuthSession.get(
                 self.ctx.params["du_url"],
                 self.ctx.params["du_username"],
                 self.ctx.params["du_password"],
-                self.ctx.params["du_tenant"])
-            if not token_project:
+                self.ctx.params["du_tenant"],
+                config_name=self.ctx.params['config_name'])
+            if not auth.token:
                 except_err = "Failed to obtain an Authentication Token from: {}".format(self.ctx.params["du_url"])
                 raise CLIException(except_err)
-            # Add token and project_id to ctx and return token_project
-            self.ctx.params['token'], self.ctx.params['project_id'] = token_project
-            return token_project
+            # Add token, project_id and user_id to ctx
+            self.ctx.params['token'] = auth.token
+            self.ctx.params['project_id'] = auth.project_id
+            self.ctx.params['user_id'] = auth.user_id
+            return auth
         except UserAuthFailure as except_msg:
             logger.exception(except_msg)
             raise
@@ -76,53 +59,25 @@ class Get:
             logger.exception(except_err)
             raise except_err
 
-    def get_token_project_user_id(self):
-        """Calls ostoken.GetToken().get_token_project() using active config
+    def get_token_project(self):
+        """Reads the token and project_id of the active config AuthSession
                 return token, project_id
         """
-        try:
-            self.active_config()
-            token_project_user_id = GetToken().get_token_project_user_id(
-                self.ctx.params["du_url"],
-                self.ctx.params["du_username"],
-                self.ctx.params["du_password"],
-                self.ctx.params["du_tenant"])
-            if not token_project_user_id:
-                except_err = "Failed to obtain an Authentication Token from: {}".format(self.ctx.params["du_url"])
-                raise CLIException(except_err)
-            # Add token and project_id to ctx and return token_project
-            self.ctx.params['token'], self.ctx.params['project_id'], self.ctx.params['user_id'] = token_project_user_id
-            return token_project_user_id
-        except UserAuthFailure as except_msg:
-            logger.exception(except_msg)
-            raise
-        except CLIException as except_err:
-            logger.exception(except_err)
-            raise except_err
-        
+        auth = self.auth_session()
+        return auth.token, auth.project_id
+
+    def get_token_project_user_id(self):
+        """Reads the token, project_id and user_id of the active config AuthSession
+                return token, project_id, user_id
+        """
+        auth = self.auth_session()
+        return auth.token, auth.project_id, auth.user_id
+
     def get_token(self):
-        """Calls ostoken.GetToken.get_token_v3 using active config
+        """Reads the token of the active config AuthSession
                 return token
         """
-        try:
-            self.active_config()
-            token = GetToken().get_token_v3(
-                self.ctx.params["du_url"],
-                self.ctx.params["du_username"],
-                self.ctx.params["du_password"],
-                self.ctx.params["du_tenant"])
-            if not token:
-                except_err = "Failed to obtain an Authentication Token from: {}".format(self.ctx.params["du_url"])
-                raise CLIException(except_err)
-            # Add token to ctx and return token
-            self.ctx.params['token'] = token
-            return token
-        except UserAuthFailure as except_err:
-            logger.exception(except_err)
-            raise
-        except CLIException as except_err:
-            logger.exception(except_err)
-            raise except_err
+        return self.auth_session().token
 
     def region_fqdn(self):
         """Calls ostoken.GetRegionURL().get_region_url.
@@ -136,7 +91,8 @@ class Get:
                 self.ctx.params["du_username"],
                 self.ctx.params["du_password"],
                 self.ctx.params["du_tenant"],
-                self.ctx.params["du_region"]).get_region_url()
+                self.ctx.params["du_region"],
+                self.ctx.params["config_name"]).get_region_url()
             if region_url is None:
                 msg = "Failed to obtain region url from: {} " \
                       "for region: {}".format(self.ctx.param["du_url"], self.ctx.param["du_region"])
@@ -159,40 +115,24 @@ class Get:
         config_file = os.path.join(self.ctx.obj['pf9_db_dir'], 'express.conf')
         if os.path.exists(config_file):
             try:
-                with open(config_file, 'r') as data:
-                    config_file_lines = data.readlines()
-            except Exception as except_err:
+                config = ConfigStore.load(config_file)
+            except (IOError, OSError) as except_err:
                 except_msg = "Failed reading {}: ".format(config_file)
                 logger.exception(except_err, except_msg)
                 raise CLIException(except_msg)
-            try:
-                config = self.config_to_dict(config_file_lines)
-                if config is not None:
-                    if "name" in config:
-                        self.ctx.params['config_name'] = config["name"]
-                    else:
-                        self.ctx.params['config_name'] = (config["os_username"].
-                                                          split('@', 1)[0]) + '-' + config["du_url"]
-                    self.ctx.params['du_url'] = config["du_url"]
-                    self.ctx.params['du_username'] = config["os_username"]
-                    self.ctx.params['du_password'] = config["os_password"]
-                    self.ctx.params['du_tenant'] = config["os_tenant"]
-                    self.ctx.params['du_region'] = config["os_region"]
-                    # This is needed if we want them to be loaded as python bool
-                    if config.get("dev_key") == 'True':
-                        self.ctx.params['dev_key'] = True
-                    else:
-                        self.ctx.params['dev_key'] = False
-                    if config.get("disable_analytics") == 'True':
-                        self.ctx.params['disable_analytics'] = True
-                    else:
-                        self.ctx.params['disable_analytics'] = False
-
-                return self.ctx
             except Exception as except_err:
                 except_msg = "Failed parsing active config {}: ".format(config_file)
                 logger.exception(except_err, except_msg)
                 raise CLIException(except_msg)
+            self.ctx.params['config_name'] = config.name
+            self.ctx.params['du_url'] = config.du_url
+            self.ctx.params['du_username'] = config.os_username
+            self.ctx.params['du_password'] = config.os_password
+            self.ctx.params['du_tenant'] = config.os_tenant
+            self.ctx.params['du_region'] = config.os_region
+            self.ctx.params['dev_key'] = config.dev_key
+            self.ctx.params['disable_analytics'] = config.disable_analytics
+            return self.ctx
         except_msg = "No active config. Please define or activate a config."
         logger.exception(except_msg)
         raise CLIException(except_msg)
@@ -202,48 +142,7 @@ class Get:
         """Convert Pipe separated config to Dict()
                 return config
         """
-        config = {}
-        for line in config_file:
-            if 'config_name|' in line:
-                line = line.strip()
-                config.update({'name': line.replace('config_name|', '')})
-            if 'du_url' in line:
-                line = line.strip()
-                config.update({'du_url': line.replace('du_url|', '')})
-            if 'os_tenant' in line:
-                line = line.strip()
-                config.update({'os_tenant': line.replace('os_tenant|', '')})
-            if 'os_username' in line:
-                line = line.strip()
-                config.update({'os_username': line.replace('os_username|', '')})
-            if 'os_region' in line:
-                line = line.strip()
-                config.update({'os_region': line.replace('os_region|', '')})
-            if 'os_password' in line:
-                line = line.strip()
-                config.update({'os_password': line.replace('os_password|', '')})
-            if 'proxy_url' in line:
-                line = line.strip()
-                config.update({'proxy_url': line.replace('proxy_url|', '')})
-            if 'dns_resolver1' in line:
-                line = line.strip()
-                config.update({'dns_resolver1': line.replace('dns_resolver1|', '')})
-            if 'dns_resolver_2' in line:
-                line = line.strip()
-                config.update({'dns_resolver_2': line.replace('dns_resolver_2|', '')})
-            if 'manage_hostname' in line:
-                line = line.strip()
-                config.update({'manage_hostname': line.replace('manage_hostname|', '')})
-            if 'manage_resolver' in line:
-                line = line.strip()
-                config.update({'manage_resolver': line.replace('manage_resolver|', '')})
-            if 'dev_key' in line:
-                line = line.strip()
-                config.update({'dev_key': line.replace('dev_key|', '')})
-            if 'disable_analytics' in line:
-                line = line.strip()
-                config.update({'disable_analytics': line.replace('disable_analytics|', '')})
-        return config
+        return parse_config_lines(config_file)
 
 
 class PrepExpressRun:
@@ -257,6 +156,14 @@ class PrepExpressRun:
         self.ips = ips
         self.node_prep_only = node_prep_only
         self.inv_file_template = inv_file_template
+        # set to have the wait-for-convergence role released by a ConvergenceMonitor
+        self.convergence_dir = None
+        # set with convergence_dir when the ConvergenceMonitor assigns the pf9-kube role in batches
+        self.batch_role_assignment = False
+        # {'certless': {os_family: path}, 'classic': {os_family: path}} of the installers cached on
+        # this controller, the pf9-hostagent role copies them to the nodes
+        self.installers = None
+        self._extravars = None
         if self.ctx.params['floating_ip']:
             floating_ips=ctx.params['floating_ip']
             ctx.params['floating_ip'] = ''.join(floating_ips).split(' ') if all(len(x) == 1
@@ -269,11 +176,10 @@ class PrepExpressRun:
                 except_msg = "Number of floating IPs does not match nodes provided"
                 raise CLIException(except_msg)
 
-    def build_ansible_command(self):
-        """Build the bash command that will be sent to pf9-express"""
-        # Invoke PMK only related playbook.
-        # TODO: rework to allow for PMO/PMK or deauth. In this function or another
-        _inv_file = self.build_express_inventory_file()
+    def build_extravars(self):
+        """Variables of the pf9-express playbook, shared by both playbook backends"""
+        if self._extravars is not None:
+            return self._extravars
         try:
             Get(self.ctx).get_token_project()
             du_fqdn = Get(self.ctx).region_fqdn()
@@ -285,24 +191,105 @@ class PrepExpressRun:
             logger.exception(except_err)
             raise
 
+        self._extravars = {
+            'skip_prereq': 1,
+            'autoreg': 'on',
+            'du_fqdn': du_fqdn,
+            'ctrl_ip': Utils.ip_from_dns_name(du_fqdn),
+            'du_username': self.ctx.params['du_username'],
+            'du_password': self.ctx.params['du_password'],
+            'du_region': self.ctx.params['du_region'],
+            'du_tenant': self.ctx.params['du_tenant'],
+            'du_token': self.ctx.params['token'],
+        }
+        # Rolling waves: pf9_serial and pf9_max_fail_percentage are templated into the plays
+        if self.ctx.params.get('serial'):
+            self._extravars['pf9_serial'] = self.ctx.params['serial']
+        if self.ctx.params.get('max_fail_percentage') is not None:
+            self._extravars['pf9_max_fail_percentage'] = self.ctx.params['max_fail_percentage']
+        if self.convergence_dir:
+            self._extravars['pf9_convergence_dir'] = self.convergence_dir
+            if self.batch_role_assignment:
+                self._extravars['pf9_batch_role_assignment'] = True
+        if self.installers:
+            self._extravars['pf9_installers'] = self.installers
+        return self._extravars
+
+    def build_ansible_command(self):
+        """Build the bash command that will be sent to pf9-express"""
+        # Invoke PMK only related playbook.
+        # TODO: rework to allow for PMO/PMK or deauth. In this function or another
+        _inv_file = self.build_express_inventory_file()
+        extravars = self.build_extravars()
         extra_args = '-e "skip_prereq=1 autoreg={} du_fqdn={} ctrl_ip={} du_username={} du_password={} ' \
                      'du_region={} du_tenant={} du_token={}"'.format(
                       "'on'",
-                      du_fqdn,
-                      Utils.ip_from_dns_name(du_fqdn),
-                      self.ctx.params['du_username'],
-                      self.ctx.params['du_password'],
-                      self.ctx.params['du_region'],
-                      self.ctx.params['du_tenant'],
-                      self.ctx.params['token'])
-        cmd = '{} -i {} -l pmk {} {}' \
+                      extravars['du_fqdn'],
+                      extravars['ctrl_ip'],
+                      extravars['du_username'],
+                      extravars['du_password'],
+                      extravars['du_region'],
+                      extravars['du_tenant'],
+                      extravars['du_token'])
+        for extra_var in ('pf9_serial', 'pf9_max_fail_percentage', 'pf9_convergence_dir',
+                          'pf9_batch_role_assignment'):
+            if extra_var in extravars:
+                extra_args = '{} -e "{}={}"'.format(extra_args, extra_var, extravars[extra_var])
+        if 'pf9_installers' in extravars:
+            extra_args = '{} -e {}'.format(
+                extra_args, shlex.quote(json.dumps({'pf9_installers': extravars['pf9_installers']})))
+        cmd = '{} -i {} -l pmk --forks {} {} {}' \
               .format(
                       self.ctx.obj['pf9_exec_ansible-playbook'],
                       _inv_file,
+                      self.ctx.params.get('forks') or DEFAULT_ANSIBLE_FORKS,
                       extra_args,
                       self.ctx.obj['pf9_k8_playbook'])
         return cmd
 
+    def build_inventory(self):
+        """In-memory equivalent of the inventory file rendered from pmk_inventory.tpl"""
+        hosts = {}
+        for ip in self.ips:
+            if ip == 'localhost':
+                hosts[ip] = {'ansible_python_interpreter': self.ctx.obj['venv_python'],
+                             'ansible_connection': 'local', 'ansible_host': 'localhost'}
+            else:
+                hosts[ip] = {'ansible_ssh_common_args': '-o StrictHostKeyChecking=no',
+                             'ansible_user': self.user}
+                if self.password:
+                    hosts[ip]['ansible_ssh_pass'] = self.password
+                else:
+                    hosts[ip]['ansible_ssh_private_key_file'] = self.ssh_key
+        return {'all': {'vars': {'manage_hostname': False,
+                                 'manage_resolvers': False,
+                                 'dns_resolvers': ["8.8.8.8", "8.8.4.4"]},
+                        'children': {'pmk': {'children': {'k8s_worker': {'hosts': hosts}}}}}}
+
+    def build_playbook_run(self, log_file, event_log):
+        """Return the playbook run of these nodes: ansible-runner when installed, else ansible-playbook"""
+        ansible_cfg = write_ansible_cfg(self.ctx.obj['pf9_ansible_cfg'],
+                                        strategy=self.ctx.params.get('strategy') or 'linear')
+        # Facts are gathered once per host and run, and kept for the next run with --reuse-facts
+        cmdline = None if self.ctx.params.get('reuse_facts') else '--flush-cache'
+        if ansible_runner_available():
+            return RunnerPlaybook(self.ctx.obj['pf9_k8_playbook'],
+                                  self.build_inventory(),
+                                  self.build_extravars(),
+                                  log_file, event_log,
+                                  limit='pmk',
+                                  forks=self.ctx.params.get('forks') or DEFAULT_ANSIBLE_FORKS,
+                                  binary=self.ctx.obj['pf9_exec_ansible-playbook'],
+                                  envvars={'ANSIBLE_CONFIG': ansible_cfg},
+                                  cmdline=cmdline)
+        logger.info("ansible-runner is not installed, running ansible-playbook")
+        env = dict(os.environ)
+        env['ANSIBLE_CONFIG'] = ansible_cfg
+        cmd = self.build_ansible_command()
+        if cmdline:
+            cmd = '{} {}'.format(cmd, cmdline)
+        return SubprocessPlaybook(cmd, log_file, event_log, env=env)
+
     def build_express_inventory_file(self):
         inv_file_path = None
         node_details = ''
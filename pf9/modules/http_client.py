@@ -0,0 +1,130 @@
+"""
+Pooled HTTP client for Platform9 Management Plane traffic (keystone, qbert, resmgr).
+A single keep-alive requests.Session is kept per DU host for the life of the process,
+so repeated calls and polling loops reuse established TCP/TLS connections.
+Idempotent requests are retried with backoff on connection errors and gateway errors.
+"""
+
+import os
+import threading
+from urllib.parse import urlparse
+
+
+def env_timeout(name, default):
+    """Timeout in seconds from environment variable name, default when unset or not a positive number"""
+    try:
+        timeout = float(os.environ.get(name, default))
+    except ValueError:
+        return default
+    return timeout if timeout > 0 else default
+
+
+# (connect, read) timeouts in seconds, overridable from the environment
+DEFAULT_TIMEOUT = (env_timeout('PF9_HTTP_CONNECT_TIMEOUT', 10.0),
+                   env_timeout('PF9_HTTP_READ_TIMEOUT', 60.0))
+# Number of hosts and connections per host kept in the pool of each Session
+DEFAULT_POOL_CONNECTIONS = 4
+DEFAULT_POOL_MAXSIZE = 16
+# Retries of idempotent requests (GET, HEAD, PUT, DELETE), POSTs are never retried here
+DEFAULT_RETRIES = 3
+RETRY_BACKOFF_FACTOR = 0.5
+RETRY_STATUSES = (502, 503, 504)
+# Requests in flight at once for fan-out over many hosts or nodes, within DEFAULT_POOL_MAXSIZE
+DEFAULT_FAN_OUT = 8
+
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+
+def session_key(base_url):
+    """Sessions are shared per scheme and host"""
+    url_parts = urlparse(base_url)
+    if not url_parts.netloc:
+        return base_url
+    return "{}://{}".format(url_parts.scheme, url_parts.netloc)
+
+
+def get_session(base_url, pool_connections=DEFAULT_POOL_CONNECTIONS, pool_maxsize=DEFAULT_POOL_MAXSIZE):
+    """Return the process wide keep-alive Session for the host of base_url"""
+    # requests is imported on first use to keep CLI startup fast
+    import requests
+    import urllib3
+    from requests.adapters import HTTPAdapter
+    from urllib3.util.retry import Retry
+    urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+    key = session_key(base_url)
+    with _sessions_lock:
+        session = _sessions.get(key)
+        if session is None:
+            session = requests.Session()
+            retries = Retry(total=DEFAULT_RETRIES, backoff_factor=RETRY_BACKOFF_FACTOR,
+                            status_forcelist=RETRY_STATUSES, raise_on_status=False)
+            adapter = HTTPAdapter(pool_connections=pool_connections, pool_maxsize=pool_maxsize,
+                                  max_retries=retries)
+            session.mount('https://', adapter)
+            session.mount('http://', adapter)
+            session.headers.update({'Accept-Encoding': 'gzip, deflate',
+                                    'Content-Type': 'application/json'})
+            _sessions[key] = session
+    return session
+
+
+def fan_out(func, items, max_workers=DEFAULT_FAN_OUT):
+    """Call func(item) for every item on a bounded thread pool, the calls share the pooled Sessions
+            return list of results, in the order of items
+    """
+    from concurrent.futures import ThreadPoolExecutor
+    items = list(items)
+    if not items:
+        return []
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(items)))) as executor:
+        return list(executor.map(func, items))
+
+
+def close_sessions():
+    with _sessions_lock:
+        for session in _sessions.values():
+            session.close()
+        _sessions.clear()
+
+
+class HTTPClient:
+    """HTTPClient(base_url, token) sends requests to a DU host over its shared Session
+    with the auth headers, timeout and certificate verification of the caller.
+    """
+    def __init__(self, base_url, token=None, headers=None, timeout=None, verify=True):
+        self.base_url = base_url.rstrip('/')
+        self.headers = dict(headers or {})
+        if token:
+            self.headers['X-Auth-Token'] = token
+        self.timeout = timeout or DEFAULT_TIMEOUT
+        self.verify = verify
+        self.session = get_session(self.base_url)
+
+    def url(self, api_endpoint):
+        if api_endpoint.startswith('http'):
+            return api_endpoint
+        return "{}/{}".format(self.base_url, api_endpoint.lstrip('/'))
+
+    def request(self, method, api_endpoint, **kwargs):
+        """Issue method against base_url/api_endpoint and return the requests.Response"""
+        headers = dict(self.headers)
+        headers.update(kwargs.pop('headers', None) or {})
+        kwargs.setdefault('timeout', self.timeout)
+        kwargs.setdefault('verify', self.verify)
+        return self.session.request(method, self.url(api_endpoint), headers=headers, **kwargs)
+
+    def get(self, api_endpoint, **kwargs):
+        return self.request('GET', api_endpoint, **kwargs)
+
+    def post(self, api_endpoint, **kwargs):
+        return self.request('POST', api_endpoint, **kwargs)
+
+    def put(self, api_endpoint, **kwargs):
+        return self.request('PUT', api_endpoint, **kwargs)
+
+    def delete(self, api_endpoint, **kwargs):
+        return self.request('DELETE', api_endpoint, **kwargs)
+
+    def head(self, api_endpoint, **kwargs):
+        return self.request('HEAD', api_endpoint, **kwargs)
@@ -0,0 +1,173 @@
+"""
+Controller-side cache of the Platform9 hostagent installers for prep-node.
+prep-node fills the cache before the playbook starts and the pf9-hostagent role copies the installers
+to the nodes, instead of every node downloading them from the DU.
+Certless installers are kept in ~/pf9/cache/installers/<du_fqdn>/<version>/, the version is derived
+from the ETag (or Last-Modified) the DU reports, a new installer goes to a new directory and the older
+versions of it are removed. Classic installers need the token login of pf9_get_hostagent.py, the script
+runs in ~/pf9/cache/installers/<du_fqdn>/classic-<region>/ where its .meta file revalidates them.
+Concurrent express processes and threads fill the cache of a DU one at a time.
+"""
+
+import os
+import sys
+import fcntl
+import shutil
+import hashlib
+import tempfile
+import subprocess
+from contextlib import contextmanager
+
+from pf9.exceptions import DUCommFailure
+from pf9.modules.cache import PF9_CACHE_DIR
+from pf9.modules.http_client import HTTPClient
+from pf9.modules.util import Logger
+
+logger = Logger(os.path.join(os.path.expanduser("~"), 'pf9/log/pf9ctl.log')).get_logger(__name__)
+
+INSTALLER_CACHE_DIR = os.path.join(PF9_CACHE_DIR, 'installers/')
+CERTLESS_INSTALLER_ENDPOINT = 'clarity/platform9-install-{}.sh'
+CLASSIC_INSTALLER_NAME = 'platform9-install-{}-{}.sh'
+# ansible_os_family|lower of the supported nodes
+OS_FAMILIES = ('debian', 'redhat')
+GET_HOSTAGENT_SCRIPT = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                                    'express', 'roles', 'pf9-hostagent', 'files', 'pf9_get_hostagent.py')
+# Installers without ETag or Last-Modified can not be reused, they are downloaded to this version every time
+UNVERSIONED = 'unversioned'
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+
+
+def installer_version(headers):
+    """Directory name for the installer version described by the response headers
+            return hex digest of the ETag or Last-Modified, UNVERSIONED without either
+    """
+    # the size is no version, an updated installer can have the same size
+    validator = headers.get('ETag') or headers.get('Last-Modified')
+    if not validator:
+        return UNVERSIONED
+    return hashlib.sha1(validator.encode('utf-8')).hexdigest()[:16]
+
+
+class InstallerCache:
+    """InstallerCache(du_fqdn).certless_installer(os_family) returns the path of the cached
+    installer of os_family, downloading it only when the DU has a version not in the cache.
+    """
+    def __init__(self, du_fqdn, cache_dir=INSTALLER_CACHE_DIR):
+        self.du_fqdn = du_fqdn
+        self.du_dir = os.path.join(cache_dir, du_fqdn)
+        self.client = HTTPClient("https://{}".format(du_fqdn))
+
+    @contextmanager
+    def lock(self):
+        """Hold the cache of this DU, flock serializes processes and the threads of `cluster apply`"""
+        if not os.path.isdir(self.du_dir):
+            os.makedirs(self.du_dir, 0o700)
+        with open(os.path.join(self.du_dir, '.lock'), 'w') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def fetch(self, api_endpoint, installer_name):
+        """Cached copy of the installer at api_endpoint
+                return path of the installer, None when the DU does not have it
+        """
+        pf9_response = self.client.head(api_endpoint, allow_redirects=True)
+        if pf9_response.status_code == 404:
+            return None
+        if pf9_response.status_code != 200:
+            raise DUCommFailure("Installer {} is not available: {}".format(
+                api_endpoint, pf9_response.status_code))
+        version = installer_version(pf9_response.headers)
+        path = os.path.join(self.du_dir, version, installer_name)
+        if version != UNVERSIONED and os.path.isfile(path):
+            logger.info("Installer {} {} found in cache".format(installer_name, version))
+            return path
+        self.download(api_endpoint, path)
+        self.prune(installer_name, version)
+        return path
+
+    def download(self, api_endpoint, path):
+        """Stream api_endpoint to a part file renamed to path once complete"""
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        part_fd, part_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.part_')
+        os.close(part_fd)
+        logger.info("Downloading installer {} to {}".format(api_endpoint, path))
+        try:
+            pf9_response = self.client.get(api_endpoint, stream=True)
+            if pf9_response.status_code != 200:
+                raise DUCommFailure("Installer {} download failed: {}".format(
+                    api_endpoint, pf9_response.status_code))
+            size = 0
+            with open(part_path, 'wb') as part_file:
+                for chunk in pf9_response.iter_content(DOWNLOAD_CHUNK_SIZE):
+                    part_file.write(chunk)
+                    size += len(chunk)
+            expected = pf9_response.headers.get('Content-Length')
+            # Content-Length is the encoded size when the DU compresses the response
+            if expected and not pf9_response.headers.get('Content-Encoding') and int(expected) != size:
+                raise DUCommFailure("Installer {} download incomplete: {} of {} bytes".format(
+                    api_endpoint, size, expected))
+            os.chmod(part_path, 0o755)
+            os.replace(part_path, path)
+        finally:
+            if os.path.exists(part_path):
+                os.remove(part_path)
+
+    def prune(self, installer_name, keep_version):
+        """Remove installer_name from every version directory but keep_version"""
+        for version in os.listdir(self.du_dir):
+            version_dir = os.path.join(self.du_dir, version)
+            if version == keep_version or not os.path.isfile(os.path.join(version_dir, installer_name)):
+                continue
+            os.remove(os.path.join(version_dir, installer_name))
+            if not os.listdir(version_dir):
+                shutil.rmtree(version_dir, ignore_errors=True)
+
+    def certless_installer(self, os_family):
+        """return path of the certless installer of os_family ('debian', 'redhat'),
+        None when the DU only has classic installers
+        """
+        return self.fetch(CERTLESS_INSTALLER_ENDPOINT.format(os_family),
+                          'platform9-install-{}.sh'.format(os_family))
+
+    def classic_installer(self, os_family, region, token):
+        """Run pf9_get_hostagent.py in the classic cache directory of region, it downloads the
+        installer of os_family unless the cached copy is still current
+                return path of the installer
+        """
+        classic_dir = os.path.join(self.du_dir, 'classic-{}'.format(region))
+        if not os.path.isdir(classic_dir):
+            os.makedirs(classic_dir, 0o700)
+        get_hostagent = subprocess.Popen([sys.executable, GET_HOSTAGENT_SCRIPT, '--account_endpoint', self.du_fqdn,
+                                          '--region', region, '--token', token, '--platform', os_family],
+                                         cwd=classic_dir, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                                         universal_newlines=True)
+        output = get_hostagent.communicate()[0]
+        path = os.path.join(classic_dir, CLASSIC_INSTALLER_NAME.format(region, os_family))
+        if get_hostagent.returncode != 0 or not os.path.isfile(path):
+            raise DUCommFailure("Classic installer {} download failed: {}".format(
+                os.path.basename(path), output.strip()[-500:]))
+        return path
+
+    def prefetch(self, region, token, os_families=OS_FAMILIES):
+        """Cache the installer of every OS family, certless when the DU has one, else classic
+                return {'certless': {os_family: path}, 'classic': {os_family: path}},
+                       {os_family: error message} of the installers that could not be cached
+        """
+        installers = {'certless': {}, 'classic': {}}
+        errors = {}
+        with self.lock():
+            for os_family in os_families:
+                try:
+                    path = self.certless_installer(os_family)
+                    if path is not None:
+                        installers['certless'][os_family] = path
+                    else:
+                        installers['classic'][os_family] = self.classic_installer(os_family, region, token)
+                except Exception as except_err:
+                    logger.exception(except_err)
+                    errors[os_family] = str(except_err) or except_err.__class__.__name__
+        return installers, errors
@@ -4,22 +4,83 @@ Tested with python 2.7 and 3.7.0 on OSX and Ubuntu 16.04 and 18.04
 Maintainer: tom.christopoulos@platform9.com
 """
 
+import os
 import re
-import requests
-import urllib3
+import time
+import hashlib
+import calendar
+import threading
+from datetime import datetime
 from ..exceptions import UserAuthFailure
 from ..exceptions import DUCommFailure
 from ..exceptions import CLIException
-urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+from .cache import FileCache, PF9_DB_DIR, PF9_CACHE_DIR
+from .http_client import HTTPClient
+
+TOKEN_CACHE_DIR = os.path.join(PF9_DB_DIR, 'token_cache/')
+# Cached tokens are refreshed once they are this close (secs) to expiring, so a
+# long running prep-node never hands Ansible a token that lapses mid-run
+TOKEN_REFRESH_MARGIN = 30 * 60
+REGION_CACHE_DIR = os.path.join(PF9_CACHE_DIR, 'regions/')
+REGION_CACHE_TTL = 6 * 60 * 60
+
+# Region FQDNs resolved by this process, keyed by DU URL and region
+_region_urls = {}
+# AuthSessions of this process, keyed like the token cache
+_auth_sessions = {}
+_auth_sessions_lock = threading.Lock()
+
+
+def parse_keystone_time(timestamp):
+    """Convert a Keystone ISO 8601 UTC timestamp to epoch seconds"""
+    timestamp = timestamp.rstrip('Z')
+    for time_format in ('%Y-%m-%dT%H:%M:%S.%f', '%Y-%m-%dT%H:%M:%S'):
+        try:
+            return calendar.timegm(datetime.strptime(timestamp, time_format).timetuple())
+        except ValueError:
+            continue
+    return None
+
 
 class GetToken:
     """Authenticates to Platform9 Management Plane and Returns Authentication Token and ProjectID"""
+    def __init__(self, config_name=None, force_refresh=False):
+        """config_name scopes the on-disk token cache.
+        force_refresh skips cached tokens but still stores the new one.
+        """
+        self.config_name = config_name
+        self.force_refresh = force_refresh
+        self.token_cache = FileCache(TOKEN_CACHE_DIR)
+
+    def cache_key(self, host, username, password, tenant):
+        """Token cache key: config name, user, tenant, DU URL and a digest of the password"""
+        password_digest = hashlib.sha256(str(password).encode('utf-8')).hexdigest()
+        return FileCache.make_key(self.config_name, username, tenant, host, password_digest)
+
     def os_auth(self, host, username, password, tenant):
+        """Return raw Headers and JSON body of a Keystone auth for the given credentials.
+        A still valid token from the on-disk cache is returned without contacting Keystone.
+        """
+        cache_key = self.cache_key(host, username, password, tenant)
+        if not self.force_refresh:
+            cached = self.token_cache.get(cache_key)
+            if cached is not None:
+                return cached
+        response = self.keystone_auth(host, username, password, tenant)
+        expires_at = parse_keystone_time(response['json']['token'].get('expires_at', ''))
+        if expires_at is not None:
+            self.token_cache.set(cache_key,
+                                 {"headers": {'X-Subject-Token': response['headers']['X-Subject-Token']},
+                                  "json": response['json']},
+                                 expires_at=expires_at - TOKEN_REFRESH_MARGIN)
+        return response
+
+    def keystone_auth(self, host, username, password, tenant):
         """POST Authentication to PF9 Management Plane and return raw Headers and JSON body"""
+        from requests.exceptions import MissingSchema
         get_token_try = 0
         while get_token_try < 2:
-            keystone_endpoint = '%s/keystone/v3/auth/tokens?nocatalog' % host
-            headers = {"Content-Type": "application/json"}
+            keystone_endpoint = 'keystone/v3/auth/tokens'
             body = {
                 "auth": {
                     "identity": {
@@ -41,7 +102,7 @@ class GetToken:
                 }
             }
             try:
-                raw_response = requests.post(keystone_endpoint, headers=headers, json=body)
+                raw_response = HTTPClient(host).post(keystone_endpoint, json=body)
                 if raw_response.status_code not in (200, 201):
                     msg = "Failed to authenticate with {}".format(host)
                     raise UserAuthFailure(msg)
@@ -50,7 +111,7 @@ class GetToken:
                     "headers": raw_response.headers,
                     "json": raw_response.json()}
                 return response
-            except (UserAuthFailure, requests.exceptions.MissingSchema) as err:
+            except (UserAuthFailure, MissingSchema) as err:
                 get_token_try = get_token_try + 1
                 if not host.startswith('http'):
                     host = "https://{}".format(host)
@@ -59,63 +120,129 @@ class GetToken:
                 else:
                     raise UserAuthFailure(str(err))
 
+    def auth_session(self, host, username, password, tenant):
+        """Return the process wide AuthSession for the given credentials"""
+        return AuthSession.get(host, username, password, tenant,
+                               config_name=self.config_name, force_refresh=self.force_refresh)
+
     def get_token_v3(self, host, username, password, tenant):
-        """Calls os_auth and returns only the Auth Token"""
-        os_auth_req = self.os_auth(host, username, password, tenant)
-        token = os_auth_req['headers']['X-Subject-Token']
-        return token
+        """Returns only the Auth Token"""
+        return self.auth_session(host, username, password, tenant).token
 
     def get_project_id(self, host, username, password, tenant):
-        """Calls os_auth and only returns OpenStack Project_ID"""
-        os_auth_req = self.os_auth(host, username, password, tenant)
-        project_id = os_auth_req['json']['token']['project']['id']
-        return project_id
+        """Returns only OpenStack Project_ID"""
+        return self.auth_session(host, username, password, tenant).project_id
 
     def get_token_project(self, host, username, password, tenant):
-        """Call os_auth and returns OpenStack Project_ID and Authentication Token"""
-        os_auth_req = self.os_auth(host, username, password, tenant)
-        token = os_auth_req['headers']['X-Subject-Token']
-        project_id = os_auth_req['json']['token']['project']['id']
-        return token, project_id
+        """Returns OpenStack Project_ID and Authentication Token"""
+        auth = self.auth_session(host, username, password, tenant)
+        return auth.token, auth.project_id
 
     def get_token_project_user_id(self, host, username, password, tenant):
-        os_auth_req = self.os_auth(host, username, password, tenant)
-        token = os_auth_req['headers']['X-Subject-Token']
-        project_id = os_auth_req['json']['token']['project']['id']
-        user_id = os_auth_req['json']['token']['user']['id']
-        return token, project_id, user_id
+        auth = self.auth_session(host, username, password, tenant)
+        return auth.token, auth.project_id, auth.user_id
+
+
+class AuthSession:
+    """AuthSession holds the result of a single Keystone authentication:
+    token, project_id, user_id, expires_at and the service catalog.
+    AuthSession.get() authenticates at most once per process for a set of credentials.
+    """
+    def __init__(self, os_auth_req):
+        token_body = os_auth_req['json']['token']
+        self.token = os_auth_req['headers']['X-Subject-Token']
+        self.project_id = token_body['project']['id']
+        self.user_id = token_body['user']['id']
+        self.expires_at = parse_keystone_time(token_body.get('expires_at', ''))
+        self.catalog = token_body.get('catalog', [])
+
+    def is_valid(self):
+        return self.expires_at is None or self.expires_at - TOKEN_REFRESH_MARGIN > time.time()
+
+    @classmethod
+    def get(cls, host, username, password, tenant, config_name=None, force_refresh=False):
+        get_token = GetToken(config_name, force_refresh)
+        cache_key = get_token.cache_key(host, username, password, tenant)
+        with _auth_sessions_lock:
+            auth = _auth_sessions.get(cache_key)
+            if auth is None or force_refresh or not auth.is_valid():
+                auth = cls(get_token.os_auth(host, username, password, tenant))
+                _auth_sessions[cache_key] = auth
+        return auth
 
 
 class GetRegionURL:
     """GetRegionURL Returns FQDN of a public API service endpoint for a given Openstack Region"""
-    def __init__(self, host, username, password, tenant, region):
+    def __init__(self, host, username, password, tenant, region, config_name=None):
         """Initialize GetRegionURL()"""
         self.host = host
         self.username = username
         self.password = password
         self.tenant = tenant
         self.region = region
+        self.config_name = config_name
 
     def get_token(self):
         """Calls GetToken().get_token_v3() to obtain an Auth token"""
-        return GetToken().get_token_v3(
+        return GetToken(self.config_name).get_token_v3(
             self.host,
             self.username,
             self.password,
             self.tenant)
 
+    def cache_key(self):
+        return FileCache.make_key(self.host, self.region)
+
     def get_region_url(self):
-        """GetRegionURL Returns FQDN of a public API service endpoint for an Openstack Region"""
+        """GetRegionURL Returns FQDN of a public API service endpoint for an Openstack Region
+        Lookup order: in-process cache, on-disk cache, token service catalog, Keystone endpoints API
+        """
+        cache_key = self.cache_key()
+        cached = _region_urls.get(cache_key)
+        if cached is not None and cached[1] > time.time():
+            return cached[0]
+        region_cache = FileCache(REGION_CACHE_DIR, ttl=REGION_CACHE_TTL)
+        region_url = region_cache.get(cache_key)
+        if region_url is None:
+            region_url = self.region_url_from_catalog()
+            if region_url is None:
+                region_url = self.region_url_from_endpoints()
+            region_cache.set(cache_key, region_url)
+        _region_urls[cache_key] = (region_url, time.time() + REGION_CACHE_TTL)
+        return region_url
+
+    def region_url_from_catalog(self):
+        """Read the regionInfo public endpoint from the service catalog of the (cached) token.
+        return None if the token carries no catalog or no matching endpoint
+        """
+        try:
+            auth = GetToken(self.config_name).auth_session(
+                self.host,
+                self.username,
+                self.password,
+                self.tenant)
+        except UserAuthFailure:
+            raise
+        except Exception as err:
+            raise DUCommFailure("get_region_URL: Exception: {}".format(err))
+        for service in auth.catalog:
+            if service.get('type') != 'regionInfo':
+                continue
+            for endpoint in service.get('endpoints', []):
+                if endpoint.get('region_id') == self.region and endpoint.get('interface') == "public":
+                    return re.search("//(.*?)/", endpoint['url']).group(1)
+        return None
+
+    def region_url_from_endpoints(self):
+        """Resolve the region FQDN through the Keystone services and endpoints APIs"""
         try:
             token = self.get_token()
-            if not self.get_token:
+            if not token:
                 raise DUCommFailure("GetRegionURL: Failed to obtain token from \
                         {}".format(self.host))
-            headers = {'Content-Type': 'application/json', 'X-Auth-Token': token}
-            services_api = '{}/keystone/v3/services?type=regionInfo'.format(self.host)
-            response_services_api = requests.get("{}".format(services_api),
-                                                 verify=False,
-                                                 headers=headers)
+            keystone_client = HTTPClient(self.host, token=token, verify=False)
+            services_api = 'keystone/v3/services?type=regionInfo'
+            response_services_api = keystone_client.get(services_api)
             if response_services_api.status_code not in (200, 201):
                 msg = "GetRegionURL: Failed to obtain services regionInfo from {}".format(self.host)
                 raise DUCommFailure(msg)
@@ -126,8 +253,8 @@ class GetRegionURL:
 
         try:
             service_id = {"json": response_services_api.json()}['json']['services'][0]['id']
-            endpoints_api = "{}/keystone/v3/endpoints?service_id={}".format(self.host, service_id)
-            response_endpoints_api = requests.get(endpoints_api, verify=False, headers=headers)
+            endpoints_api = "keystone/v3/endpoints?service_id={}".format(service_id)
+            response_endpoints_api = keystone_client.get(endpoints_api)
             if response_endpoints_api.status_code not in (200, 201):
                 msg = "GetRegionURL: Failed to obtain Region EndPoints from \
                         {} for service id: {} ".format(self.host, service_id)
@@ -0,0 +1,164 @@
+"""
+Client of the Platform9 Kubernetes API (qbert) and node status of a single cluster.
+Qbert wraps the qbert v3 endpoints with namedtuple records and DUCommFailure errors.
+The node listing of ClusterNodes is requested with the cluster as filter and revalidated
+with If-None-Match, an unchanged listing costs a 304 instead of the nodes of the whole project.
+Only the fields used by the CLI are kept from each record.
+"""
+
+import os
+import json
+from collections import namedtuple
+
+from pf9.exceptions import DUCommFailure
+from pf9.modules.http_client import HTTPClient
+from pf9.modules.util import Logger
+
+logger = Logger(os.path.join(os.path.expanduser("~"), 'pf9/log/pf9ctl.log')).get_logger(__name__)
+
+QBERT_ENDPOINT = 'qbert/v3/{}'
+QBERT_NODES_ENDPOINT = 'qbert/v3/{}/nodes'
+
+_NodeStatus = namedtuple('NodeStatus', ['uuid', 'name', 'cluster_name', 'cluster_uuid', 'is_master',
+                                        'api_responding', 'status'])
+
+
+_QbertCluster = namedtuple('QbertCluster', ['uuid', 'name', 'status', 'node_pool_uuid'])
+
+_CloudProvider = namedtuple('CloudProvider', ['uuid', 'name', 'type', 'node_pool_uuid'])
+
+
+class QbertCluster(_QbertCluster):
+    """Subset of a qbert cluster record used by the CLI"""
+    __slots__ = ()
+
+    @classmethod
+    def from_json(cls, cluster):
+        return cls(uuid=cluster.get('uuid'),
+                   name=cluster.get('name'),
+                   status=cluster.get('status'),
+                   node_pool_uuid=cluster.get('nodePoolUuid'))
+
+
+class CloudProvider(_CloudProvider):
+    """Subset of a qbert cloud provider record used by the CLI"""
+    __slots__ = ()
+
+    @classmethod
+    def from_json(cls, cloud_provider):
+        return cls(uuid=cloud_provider.get('uuid'),
+                   name=cloud_provider.get('name'),
+                   type=cloud_provider.get('type'),
+                   node_pool_uuid=cloud_provider.get('nodePoolUuid'))
+
+
+class NodeStatus(_NodeStatus):
+    """Subset of a qbert node record used by the CLI"""
+    __slots__ = ()
+
+    @classmethod
+    def from_json(cls, node):
+        return cls(uuid=node.get('uuid'),
+                   name=node.get('name'),
+                   cluster_name=node.get('clusterName'),
+                   cluster_uuid=node.get('clusterUuid'),
+                   is_master=node.get('isMaster') == 1,
+                   api_responding=node.get('api_responding') == 1,
+                   status=node.get('status'))
+
+    @property
+    def active_master(self):
+        return self.is_master and self.api_responding and self.status == 'ok'
+
+
+class Qbert:
+    """Qbert(region_url, token, project_id) contains methods to interact with the qbert API of a project"""
+    def __init__(self, region_url, token, project_id):
+        self.region_url = region_url
+        self.token = token
+        self.project_id = project_id
+        self.client = HTTPClient(region_url, token=token, headers={'content-type': 'application/json'})
+
+    def endpoint(self, path=''):
+        return '{}/{}'.format(QBERT_ENDPOINT.format(self.project_id), path).rstrip('/')
+
+    def _get(self, path, **kwargs):
+        pf9_response = self.client.get(self.endpoint(path), **kwargs)
+        if pf9_response.status_code != 200:
+            raise DUCommFailure("qbert GET {} failed: {}".format(path, pf9_response.status_code))
+        return pf9_response.json()
+
+    def get_cloud_providers(self):
+        """return list of CloudProvider"""
+        return [CloudProvider.from_json(item) for item in self._get('cloudProviders')]
+
+    def get_clusters(self):
+        """return list of QbertCluster"""
+        return [QbertCluster.from_json(item) for item in self._get('clusters')]
+
+    def get_cluster(self, cluster_uuid):
+        """return QbertCluster of cluster_uuid"""
+        return QbertCluster.from_json(self._get('clusters/{}'.format(cluster_uuid)))
+
+    def create_cluster(self, cluster_create_payload):
+        """return uuid of the cluster created from cluster_create_payload"""
+        pf9_response = self.client.post(self.endpoint('clusters'), data=json.dumps(cluster_create_payload))
+        if pf9_response.status_code not in (200, 201):
+            raise DUCommFailure("qbert cluster create failed: {} {}".format(
+                pf9_response.status_code, pf9_response.text))
+        return pf9_response.json()['uuid']
+
+    def attach_nodes(self, cluster_uuid, cluster_attach_payload):
+        """Attach the nodes of cluster_attach_payload ([{uuid, isMaster}]) to cluster_uuid"""
+        pf9_response = self.client.post(self.endpoint('clusters/{}/attach'.format(cluster_uuid)),
+                                        data=json.dumps(cluster_attach_payload))
+        if pf9_response.status_code != 200:
+            raise DUCommFailure("Failed to attach to cluster: {}".format(pf9_response.text))
+
+    def get_nodes(self, cluster_uuid=None, etag=None):
+        """Node listing, filtered by cluster_uuid where qbert supports it and
+        conditional on etag, the ETag of a previous listing
+                return list of the node records or None when unchanged, ETag of the listing
+        """
+        headers = {'If-None-Match': etag} if etag else {}
+        params = {'clusterUuid': cluster_uuid} if cluster_uuid else None
+        pf9_response = self.client.get(self.endpoint('nodes'), params=params, headers=headers)
+        if pf9_response.status_code == 304:
+            return None, etag
+        if pf9_response.status_code != 200:
+            raise DUCommFailure("qbert GET nodes failed: {}".format(pf9_response.status_code))
+        return pf9_response.json(), pf9_response.headers.get('ETag')
+
+
+class ClusterNodes:
+    """ClusterNodes(qbert, cluster_name).refresh() returns the NodeStatus of the nodes of one
+    cluster. The listing asks qbert for the cluster's nodes only (clusterUuid filter, when the
+    UUID is known) and still filters by cluster name, as qbert may ignore the filter.
+    """
+    def __init__(self, qbert, cluster_name, cluster_uuid=None):
+        self.qbert = qbert
+        self.cluster_name = cluster_name
+        self.cluster_uuid = cluster_uuid
+        self.etag = None
+        self.nodes = None
+
+    def refresh(self):
+        """Fetch the cluster's nodes unless qbert reports them unchanged since the last refresh
+                return list of NodeStatus, None when qbert could not be queried
+        """
+        try:
+            listing, etag = self.qbert.get_nodes(self.cluster_uuid,
+                                                 etag=self.etag if self.nodes is not None else None)
+            if listing is None:
+                return self.nodes
+            nodes = [NodeStatus.from_json(node) for node in listing
+                     if node.get('clusterName') == self.cluster_name]
+        except Exception as except_err:
+            logger.exception(except_err)
+            return None
+        self.etag = etag
+        self.nodes = nodes
+        return self.nodes
+
+    def num_active_masters(self):
+        return sum(1 for node in self.refresh() or [] if node.active_master)
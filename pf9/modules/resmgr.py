@@ -0,0 +1,241 @@
+"""
+Client and host index of the Platform9 Reservation Manager (resmgr).
+ResMgr wraps the resmgr host API with ResMgrHost records and DUCommFailure errors.
+The host list is downloaded once per command and kept on disk for RESMGR_CACHE_TTL
+so consecutive commands resolve IPs and hostnames without listing resmgr again.
+"""
+
+import os
+import threading
+from collections import namedtuple
+
+from pf9.exceptions import DUCommFailure
+from pf9.modules.cache import FileCache, PF9_CACHE_DIR
+from pf9.modules.http_client import HTTPClient, fan_out
+from pf9.modules.util import Logger
+
+logger = Logger(os.path.join(os.path.expanduser("~"), 'pf9/log/pf9ctl.log')).get_logger(__name__)
+
+RESMGR_HOSTS_ENDPOINT = 'resmgr/v1/hosts'
+# Role of the nodes of Platform9 Managed Kubernetes
+PF9_KUBE_ROLE = 'pf9-kube'
+RESMGR_CACHE_DIR = os.path.join(PF9_CACHE_DIR, 'resmgr/')
+# Host state changes while nodes are prepped, keep the on-disk copy short lived
+RESMGR_CACHE_TTL = 60
+# Per-host detail and role requests in flight at once
+RESMGR_DETAIL_WORKERS = 8
+
+_host_indexes = {}
+_host_indexes_lock = threading.Lock()
+
+_ResMgrHost = namedtuple('ResMgrHost', ['id', 'hostname', 'ips', 'roles', 'role_status', 'responding'])
+
+HostStatus = namedtuple('HostStatus', ['uuid', 'roles', 'responding'])
+
+_HostConvergence = namedtuple('HostConvergence', ['id', 'role_status', 'ip_address_status', 'responding'])
+
+
+class ResMgrHost(_ResMgrHost):
+    """Subset of a resmgr host record used by the CLI"""
+    __slots__ = ()
+
+    @classmethod
+    def from_json(cls, host):
+        info = host.get('info') or {}
+        extensions = host.get('extensions') or {}
+        ips = set()
+        try:
+            ips.update(extensions['interfaces']['data']['iface_ip'].values())
+        except (KeyError, TypeError, AttributeError):
+            pass
+        try:
+            ips.update(extensions['ip_address']['data'])
+        except (KeyError, TypeError):
+            pass
+        return cls(id=host['id'],
+                   hostname=info.get('hostname'),
+                   ips=sorted(ips),
+                   roles=list(host.get('roles') or []),
+                   role_status=host.get('role_status'),
+                   responding=bool(info.get('responding')))
+
+
+class HostConvergence(_HostConvergence):
+    """Convergence state of a resmgr host: role_status and the status of its ip_address extension"""
+    __slots__ = ()
+
+    @classmethod
+    def from_json(cls, host):
+        try:
+            ip_address_status = host['extensions']['ip_address']['status']
+        except (KeyError, TypeError):
+            ip_address_status = None
+        return cls(id=host['id'],
+                   role_status=host.get('role_status'),
+                   ip_address_status=ip_address_status,
+                   responding=bool((host.get('info') or {}).get('responding')))
+
+
+class ResMgr:
+    """ResMgr(region_url, token) contains methods to interact with Platform9 Reservation Manager"""
+    def __init__(self, region_url, token, verify=True):
+        self.region_url = region_url
+        self.token = token
+        self.client = HTTPClient(region_url, token=token, headers={'content-type': 'application/json'},
+                                 verify=verify)
+
+    def get_hosts(self):
+        """All hosts of the region (responding, not responding, not authorized)
+                return list of ResMgrHost
+        """
+        pf9_response = self.client.get(RESMGR_HOSTS_ENDPOINT)
+        if pf9_response.status_code != 200:
+            raise DUCommFailure("Failed to list resmgr hosts: {}".format(pf9_response.status_code))
+        return [ResMgrHost.from_json(host) for host in pf9_response.json()]
+
+    def get_hosts_convergence(self):
+        """Convergence state of all hosts of the region from a single listing
+                return list of HostConvergence
+        """
+        pf9_response = self.client.get(RESMGR_HOSTS_ENDPOINT)
+        if pf9_response.status_code != 200:
+            raise DUCommFailure("Failed to list resmgr hosts: {}".format(pf9_response.status_code))
+        return [HostConvergence.from_json(host) for host in pf9_response.json()]
+
+    def get_host(self, host_id):
+        """return ResMgrHost of the resmgr detail record of host_id"""
+        pf9_response = self.client.get('{}/{}'.format(RESMGR_HOSTS_ENDPOINT, host_id))
+        if pf9_response.status_code != 200:
+            raise DUCommFailure("Failed to get resmgr host {}: {}".format(host_id, pf9_response.status_code))
+        return ResMgrHost.from_json(pf9_response.json())
+
+    def assign_role(self, host_id, role=PF9_KUBE_ROLE):
+        """Assign role to host_id, resmgr accepts the same role again"""
+        pf9_response = self.client.put('{}/{}/roles/{}'.format(RESMGR_HOSTS_ENDPOINT, host_id, role))
+        if pf9_response.status_code not in (200, 201):
+            raise DUCommFailure("Assigning role {} to host {} failed: {} {}".format(
+                role, host_id, pf9_response.status_code, pf9_response.text))
+
+    def assign_roles(self, host_ids, role=PF9_KUBE_ROLE, max_workers=RESMGR_DETAIL_WORKERS):
+        """Assign role to every host of host_ids, at most max_workers requests at a time
+                return dict of host_id: error message of the hosts that failed
+        """
+        def assign(host_id):
+            try:
+                self.assign_role(host_id, role)
+            except DUCommFailure as except_err:
+                return except_err.msg
+            except Exception as except_err:
+                logger.exception(except_err)
+                return str(except_err) or except_err.__class__.__name__
+            return None
+
+        host_ids = list(host_ids)
+        errors = fan_out(assign, host_ids, max_workers=max_workers)
+        return dict((host_id, error) for host_id, error in zip(host_ids, errors) if error is not None)
+
+    def request_support_bundle(self, host_id):
+        """Ask the hostagent of host_id to generate and upload a support bundle
+                return response status_code
+        """
+        pf9_response = self.client.post('{}/{}/support/bundle'.format(RESMGR_HOSTS_ENDPOINT, host_id))
+        if pf9_response.status_code not in (200, 201):
+            raise DUCommFailure("Support bundle request for host {} failed: {}".format(
+                host_id, pf9_response.status_code))
+        return pf9_response.status_code
+
+
+class HostIndex:
+    """HostIndex.get(du_url, token, project_id) returns the shared index of the resmgr hosts
+    of a DU. Lookups are dict hits, a miss triggers at most one refresh from resmgr.
+    """
+    def __init__(self, resmgr, cache_key, hosts, from_network):
+        self.resmgr = resmgr
+        self.cache_key = cache_key
+        self.from_network = from_network
+        self.refresh_attempted = False
+        self._build(hosts)
+
+    def _build(self, hosts):
+        self.hosts = list(hosts)
+        self.by_id = {}
+        self.by_ip = {}
+        self.by_hostname = {}
+        for host in self.hosts:
+            self.by_id[host.id] = host
+            for ip in host.ips:
+                self.by_ip[ip] = host
+            if host.hostname:
+                self.by_hostname[host.hostname] = host
+
+    @classmethod
+    def get(cls, du_url, token, project_id=None, force_refresh=False):
+        cache_key = FileCache.make_key(du_url.rstrip('/'), project_id)
+        with _host_indexes_lock:
+            index = _host_indexes.get(cache_key)
+        if index is not None and not force_refresh:
+            return index
+        resmgr = ResMgr(du_url, token)
+        cached_hosts = None if force_refresh else FileCache(RESMGR_CACHE_DIR).get(cache_key)
+        if cached_hosts is not None:
+            index = cls(resmgr, cache_key, [ResMgrHost(*host) for host in cached_hosts], from_network=False)
+        else:
+            index = cls(resmgr, cache_key, [], from_network=False)
+            index.refresh()
+        with _host_indexes_lock:
+            _host_indexes[cache_key] = index
+        return index
+
+    def refresh(self):
+        """Rebuild the index from a single resmgr host listing"""
+        self.refresh_attempted = True
+        try:
+            hosts = self.resmgr.get_hosts()
+        except Exception as except_err:
+            logger.exception(except_err)
+            return False
+        self._build(hosts)
+        self.from_network = True
+        FileCache(RESMGR_CACHE_DIR, ttl=RESMGR_CACHE_TTL).set(self.cache_key, [list(host) for host in hosts])
+        logger.info("Indexed {} resmgr hosts".format(len(hosts)))
+        return True
+
+    def lookup(self, address):
+        """Return the ResMgrHost with IP or hostname address, refreshing a cached index once on a miss"""
+        host = self.by_ip.get(address) or self.by_hostname.get(address)
+        if host is None and not self.from_network and not self.refresh_attempted and self.refresh():
+            host = self.by_ip.get(address) or self.by_hostname.get(address)
+        return host
+
+    def host_id(self, address):
+        host = self.lookup(address)
+        return host.id if host is not None else None
+
+
+def clear_host_indexes():
+    with _host_indexes_lock:
+        _host_indexes.clear()
+
+
+def _host_status(resmgr, host):
+    """Current roles and responding state of host from its resmgr detail record"""
+    try:
+        detail = resmgr.get_host(host.id)
+        return HostStatus(host.id, detail.roles, detail.responding)
+    except Exception as except_err:
+        logger.exception(except_err)
+    # fall back on the state of the listing
+    return HostStatus(host.id, host.roles, host.responding)
+
+
+def resolve_host_status(du_url, token, ips, project_id=None, max_workers=RESMGR_DETAIL_WORKERS):
+    """Map each IP to HostStatus(uuid, roles, responding) with one host listing and
+    concurrent detail requests. IPs unknown to resmgr map to None.
+            return {ip: HostStatus or None}
+    """
+    index = HostIndex.get(du_url, token, project_id)
+    hosts = dict((ip, index.lookup(ip)) for ip in ips)
+    found = dict((host.id, host) for host in hosts.values() if host is not None)
+    statuses = dict((status.uuid, status) for status in
+                    fan_out(lambda host: _host_status(index.resmgr, host), found.values(), max_workers))
+    return dict((ip, statuses[host.id] if host is not None else None) for ip, host in hosts.items())
@@ -1,8 +1,31 @@
-import requests
 from ..exceptions import CLIException
+import os
 import socket
+import atexit
 import logging
-from logging.handlers import TimedRotatingFileHandler
+import threading
+from logging.handlers import TimedRotatingFileHandler, QueueHandler, QueueListener
+import queue
+
+LOG_LEVELS = ('DEBUG', 'INFO', 'WARNING', 'ERROR', 'CRITICAL')
+
+
+def log_level_name(level, default='DEBUG'):
+    """return level as one of LOG_LEVELS, default when it is not a level name"""
+    level = str(level or '').upper()
+    return level if level in LOG_LEVELS else default
+
+
+# Level of all pf9 loggers, set with PF9_LOG_LEVEL or `express --log-level`.
+# An invalid PF9_LOG_LEVEL is reported by click's validation of --log-level, not at import.
+DEFAULT_LOG_LEVEL = log_level_name(os.environ.get('PF9_LOG_LEVEL'))
+
+# One QueueHandler per log file for the whole process, drained by a QueueListener thread
+_queue_handlers = {}
+_queue_listeners = []
+_pf9_loggers = set()
+_log_level = DEFAULT_LOG_LEVEL
+_logging_lock = threading.Lock()
 
 
 class Utils:
@@ -12,23 +35,66 @@ class Utils:
         return str(socket.gethostbyname_ex(fqdn)[2][0])
 
 
+def _stop_queue_listeners():
+    """Flush queued records to disk at exit"""
+    for listener in _queue_listeners:
+        listener.stop()
+    del _queue_listeners[:]
+
+
 class Logger:
+    """Process wide logging setup. Every logger writes through a shared, non-blocking
+    QueueHandler, a background QueueListener owns the single file handler per log file.
+    """
     def __init__(self, log_file):
         self.FORMATTER = logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s")
         self.LOG_FILE = log_file
 
     def get_file_handler(self):
-        file_handler = TimedRotatingFileHandler(self.LOG_FILE, when='midnight')
+        log_dir = os.path.dirname(self.LOG_FILE)
+        if log_dir and not os.path.isdir(log_dir):
+            os.makedirs(log_dir)
+        file_handler = TimedRotatingFileHandler(self.LOG_FILE, when='midnight', delay=True)
         file_handler.setFormatter(self.FORMATTER)
         return file_handler
 
+    def get_queue_handler(self):
+        """Return the QueueHandler of this log file, starting its listener on first use"""
+        with _logging_lock:
+            queue_handler = _queue_handlers.get(self.LOG_FILE)
+            if queue_handler is None:
+                log_queue = queue.Queue(-1)
+                listener = QueueListener(log_queue, self.get_file_handler())
+                listener.start()
+                if not _queue_listeners:
+                    atexit.register(_stop_queue_listeners)
+                _queue_listeners.append(listener)
+                queue_handler = QueueHandler(log_queue)
+                _queue_handlers[self.LOG_FILE] = queue_handler
+        return queue_handler
+
     def get_logger(self, logger_name):
         logger = logging.getLogger(logger_name)
-        logger.setLevel(logging.DEBUG)
-        logger.addHandler(self.get_file_handler())
+        logger.setLevel(_log_level)
+        queue_handler = self.get_queue_handler()
+        # Reloaded modules ask again for their logger, never stack a second handler
+        if queue_handler not in logger.handlers:
+            logger.addHandler(queue_handler)
         logger.propagate = False
+        with _logging_lock:
+            _pf9_loggers.add(logger_name)
         return logger
 
+    @staticmethod
+    def set_level(level):
+        """Change the level of every logger handed out by Logger.get_logger, now and later"""
+        global _log_level
+        with _logging_lock:
+            _log_level = level.upper()
+            logger_names = list(_pf9_loggers)
+        for logger_name in logger_names:
+            logging.getLogger(logger_name).setLevel(_log_level)
+
 
 class Pf9ExpVersion:
     """ Methods for managing PF9 Versions"""
@@ -42,6 +108,7 @@ class Pf9ExpVersion:
             raise CLIException(msg)
 
     def get_release_json(self, release='latest'):
+        import requests
         req = requests.get('https://api.github.com/repos/platform9/express/releases/' + release)
         response = req.json()
         json_return = {
@@ -52,11 +119,13 @@ class Pf9ExpVersion:
         return json_return
 
     def get_release(self, release='latest'):
+        import requests
         req = requests.get('https://api.github.com/repos/platform9/express/releases/' + release)
         response = req.json()
         return response["name"]
 
     def get_release_list(self):
+        import requests
         rel_list = []
         req = requests.get('https://api.github.com/repos/platform9/express/releases')
         response = req.json()
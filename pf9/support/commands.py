@@ -2,21 +2,17 @@
 import os
 import sys
 import click
-import requests
-import urllib3
 import getpass
 import shlex
 import subprocess
 import tarfile
 import shutil
-from fabric import Connection, Config
 import ipaddress
-import paramiko.ssh_exception
 import socket
-import invoke.exceptions
 from pf9.support.generate_bundle import Log_Bundle
 from pf9.exceptions import DUCommFailure, CLIException, UserAuthFailure
 from pf9.modules.express import Get
+from pf9.modules.resmgr import ResMgr
 from pf9.modules.util import Utils, Logger, Pf9ExpVersion
 
 logger = Logger(os.path.join(os.path.expanduser("~"), 'pf9/log/pf9ctl.log')).get_logger(__name__)
@@ -101,6 +97,9 @@ def bundle():
 @click.pass_context
 def create(ctx, silent, host, offline, mgmt_plane):
     """Request Creation of a Platform9 Support"""
+    from fabric import Connection, Config
+    import paramiko.ssh_exception
+    import invoke.exceptions
     if offline and mgmt_plane:
         click.echo("--mgmt-plane and --offline are not mutually exclusive.\n"
                    "Only one may be set")
@@ -207,14 +206,12 @@ def create(ctx, silent, host, offline, mgmt_plane):
     # \/--- From-Here ---\/
     # This all needs to go into a Module
     try:
-        urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
         token, project_id = Get(ctx).get_token_project()
     except CLIException as except_err:
         click.echo(except_err)
         sys.exit(1)
     # Building the data set
-    _resmgr_endpoint = '{}/resmgr/v1/hosts/'.format(ctx.params['du_url'])
-    headers = {'Content-Type': 'application/json', 'X-Auth-Token': token}
+    resmgr = ResMgr(ctx.params['du_url'], token, verify=False)
     try:
         ipaddress.ip_address(host)
     except ipaddress.AddressValueError:
@@ -226,38 +223,28 @@ def create(ctx, silent, host, offline, mgmt_plane):
         #    raise CLIException(except_msg)
 
     try:
-        resmgr_get_hosts = requests.get(_resmgr_endpoint,
-                                        verify=False,
-                                        headers=headers)
-        if resmgr_get_hosts.status_code not in (200, 201):
-            except_msg = "Failed to obtain host data from Platform9 Management Plane Reservation Manger"
-            raise DUCommFailure(except_msg)
-
         host_values = {}
-        for host_data in resmgr_get_hosts.json():
-            if 'responding' in host_data['info'] and host_data['info']['responding']:
-                if host in host_data['extensions']['ip_address']['data']:
-                    host_values['hostname'] = host_data['info']['hostname']
-                    host_values['id'] = host_data['id']
-                    host_values['ip_addresses'] = host_data['extensions']['ip_address']['data']
+        for resmgr_host in resmgr.get_hosts():
+            if resmgr_host.responding and host in resmgr_host.ips:
+                host_values['hostname'] = resmgr_host.hostname
+                host_values['id'] = resmgr_host.id
+                host_values['ip_addresses'] = resmgr_host.ips
     except (DUCommFailure, CLIException) as except_err:
         click.echo(except_err)
         sys.exit(1)
 
     if len(host_values):
-        resmgr_bundle_resp = requests.post("{}{}/support/bundle".
-                                           format(_resmgr_endpoint,
-                                                  host_values['id']
-                                                  ), verify=False, headers=headers)
-        if resmgr_bundle_resp.status_code not in (200, 201):
+        try:
+            bundle_status_code = resmgr.request_support_bundle(host_values['id'])
+        except DUCommFailure as except_err:
             except_msg = "Failure: Request to the Platform9 Management Plane for support bundle generation failed:" \
                          "host: {}\n" \
                          "hostname: {}\n" \
                          "id: {}\n" \
-                         "response status_code: {}".format(
+                         "{}".format(
                           host, host_values['hostname'],
                           host_values['id'],
-                          resmgr_bundle_resp.status_code)
+                          except_err)
             raise DUCommFailure(except_msg)
         # /\--- To-Here ---/\
 
@@ -267,7 +254,7 @@ def create(ctx, silent, host, offline, mgmt_plane):
                    "    id: {}\n"
                    "    response status_code: {}".format(
                     host, host_values['hostname'],
-                    host_values['id'], resmgr_bundle_resp.status_code))
+                    host_values['id'], bundle_status_code))
         sys.exit(0)
     else:
         click.echo("Unable to find an Active node that matched host: {}".format(host))
@@ -4,22 +4,15 @@ import click
 import getpass
 import shlex
 import subprocess
-import requests
 import json
-from fabric import Connection, Config
-import paramiko.ssh_exception
 import socket
-import invoke.exceptions
 import time
 from pf9.exceptions import DUCommFailure, CLIException, UserAuthFailure
 from pf9.modules.express import Get
+from pf9.modules.resmgr import HostIndex, resolve_host_status
 from pf9.modules.util import Utils, Logger, Pf9ExpVersion
 
-try:
-    from subprocess import DEVNULL # py3k
-except ImportError:
-    import os
-    DEVNULL = open(os.devnull, 'wb')
+from subprocess import DEVNULL
 
 class Log_Bundle:
 
@@ -29,80 +22,40 @@ class Log_Bundle:
     def get_uuid_from_resmgr(self, du_url, host_ip, headers):
         #Based on the host_ip this function would pull the host UUID from resmgr.
         try:
-            api_endpoint = "resmgr/v1/hosts"
-            pf9_response = requests.get("{}/{}".format(du_url, api_endpoint),
-                                        headers=headers)
-            if pf9_response.status_code != 200:
-                return None
-            # parse resmgr response
-            json_response = json.loads(pf9_response.text)
-             # sequentially search resmgr response for the ip of the host, if the ip is found return host uuid
-            for host in json_response:
-                try:
-                    for iface_name, iface_ip in host['extensions']['interfaces']['data']['iface_ip'].items():
-                        if iface_ip == host_ip:
-                            return host['id']
-                except Exception:
-                    # For future logging
-                    # Currently this try/except block is to ensure that we itterate through entire list of host
-                    pass
-
+            return HostIndex.get(du_url, headers.get('X-Auth-Token')).host_id(host_ip)
         except Exception:
             return None
 
-        return None
-
     def check_host_status(self, ctx, ips, user, password):
         """ Check the status of the host in Resource manager , obtaing the UUID and verify the role and responding status """
         Get(ctx).active_config()
         du_url = ctx.params['du_url']
         token = ctx.params['token']
-        host_uuid = {}
-        headers = {'Content-Type': 'application/json', 'X-Auth-Token': token}
+        host_ips = {}
         for host in ips:
             #If the host provided is local host
             # get ip of the localhost and get the hostname
             if host in ['127.0.0.1','localhost']:
                 hostname=socket.gethostname()
-                ip=socket.gethostbyname(hostname)
-            # get host uuid from resmgr using the ip of the localhost
-                host_uuid[ip]=self.get_uuid_from_resmgr(du_url, ip, headers)
-
-                if host_uuid[ip]:
-                # if a valid uuid is found , hostagent is configured and we can pull the support bundle from the host
-                    resmgr_endpoint = '{}/resmgr/v1/hosts/{}'.format(ctx.params['du_url'],host_uuid[ip])
-                    resmgr_get_hosts = requests.get(resmgr_endpoint, headers=headers)
-                    data = resmgr_get_hosts.json()
-                    roles = (data["roles"])
-                    if len(roles) >= 1 :
-                        if roles[0] == "pf9-kube" and data["info"]["responding"] == "true":  # Responding key will only be there is pf9-kube is installed else there will not be any responding key in response
-                            pass
-                        else:
-                            self.create_log_bundle(ctx, user, password, host)
-                    else:
-                        self.create_log_bundle(ctx, user, password, host)
-                else:
-                    self.upload_pf9cli_logs (du_url, host)
-
-            # host provided in not localhost, get host uuid from resmgr using the ip
+                host_ips[host]=socket.gethostbyname(hostname)
+            else:
+                host_ips[host]=host
+
+        # one resmgr listing for all hosts, role and responding state fetched concurrently
+        host_status = resolve_host_status(du_url, token, set(host_ips.values()),
+                                          project_id=ctx.params.get('project_id'))
+        for host, ip in host_ips.items():
+            status = host_status.get(ip)
+            if status is None:
+            # if a valid uuid not found in resmgr from the host , hostagent is not installed and support bundle cannot be generated
+            # uploading pf9ctl logs in this case
+                self.upload_pf9cli_logs (du_url, host)
+            # if a valid uuid is found , hostagent is configured and we can pull the support bundle from the host
+            elif status.roles and status.roles[0] == "pf9-kube" and status.responding:
+                # Responding key will only be there is pf9-kube is installed else there will not be any responding key in response
+                pass
             else:
-                host_uuid[host]=self.get_uuid_from_resmgr(du_url, host, headers)
-                if host_uuid[host]:
-                    resmgr_endpoint = '{}/resmgr/v1/hosts/{}'.format(ctx.params['du_url'],host_uuid[host])
-                    resmgr_get_hosts = requests.get(resmgr_endpoint, headers=headers)
-                    data = resmgr_get_hosts.json()
-                    roles = (data["roles"])
-                    if len(roles) >= 1:
-                        if roles[0] == "pf9-kube" and data["info"]["responding"] == "true": # Responding key will only be there is pf9-kube is installed else there will not be any responding key in response
-                            pass
-                        else:
-                            self.create_log_bundle(ctx, user, password, host)
-                    else:
-                        self.create_log_bundle(ctx, user, password, host)
-                else:
-                # if a valid uuid not found in resmgr from the host , hostagent is not installed and support bundle cannot be generated
-                # uploading pf9ctl logs in this case
-                    self.upload_pf9cli_logs (du_url, host)
+                self.create_log_bundle(ctx, user, password, host)
 
         return None
 
@@ -120,6 +73,9 @@ class Log_Bundle:
 
     def create_log_bundle(self, ctx, user, password, host='none'):
         #This function is used to generate the log bundle based on the host ip.
+        from fabric import Connection
+        import paramiko.ssh_exception
+        import invoke.exceptions
         Get(ctx).active_config()
         du_url = ctx.params['du_url']
         upload_logs =  True
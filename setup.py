@@ -60,11 +60,11 @@ setup(
         'License :: OSI Approved :: Apache Software License',
         'Natural Language :: English',
         'Operating System :: OS Independent',
-        'Programming Language :: Python :: 2.7',
         'Programming Language :: Python :: 3.5',
     ],
     include_package_data=True,
     zip_safe=False,
+    python_requires='>=3.5',
     keywords='cli',
     packages=find_packages(exclude=['docs', 'tests*']),
     install_requires=['click==7.1.2',
@@ -78,7 +78,9 @@ setup(
                       'fabric',
                       'invoke==1.6.0',
                       'ansible==2.9.13',
-                      'analytics-python'
+                      'ansible-runner>=1.4.6,<2.0',
+                      'analytics-python',
+                      'PyYAML'
                       ],
     extras_require={
         'test': ['coverage', 'pytest', 'pytest-cov', 'mock'],
@@ -2,6 +2,7 @@
 
 
 import os
+import sys
 import logging
 import inspect
 from subprocess import PIPE, Popen as popen
@@ -21,6 +22,28 @@ class TestHelp(TestCase):
         output = popen(['express', '--help'], stdout=PIPE).communicate()[0]
         self.assertTrue('Usage:' in str(output))
 
+class TestLazyStartup(TestCase):
+    """Test that express --help does not import heavy dependencies"""
+    heavy_modules = ('fabric', 'paramiko', 'invoke', 'analytics', 'prettytable', 'requests')
+
+    def imported_heavy_modules(self, args):
+        code = ("import sys\n"
+                "from click.testing import CliRunner\n"
+                "from pf9.express import cli\n"
+                "CliRunner().invoke(cli, {!r})\n"
+                "print(' '.join(sorted(set(m.split('.')[0] for m in sys.modules))))".format(args))
+        output = popen([sys.executable, '-c', code], stdout=PIPE).communicate()[0]
+        return [module for module in output.decode().split() if module in self.heavy_modules]
+
+    def test_help_imports(self):
+        """Test express --help imports"""
+        assert self.imported_heavy_modules(['--help']) == []
+
+    def test_cluster_help_imports(self):
+        """Test express cluster --help imports"""
+        assert self.imported_heavy_modules(['cluster', '--help']) == []
+
+
 class TestExpCliVersion(TestCase):
     """Test express --version call"""
     @skip("Skip disabled CLI version command")
@@ -1,7 +1,26 @@
 """Tests for express cluster."""
 
+import os
+import shutil
+import tempfile
+import time
+import threading
+
 from unittest import TestCase
+from click import BadParameter
 from click.testing import CliRunner
+from mock import patch, Mock
+
+from pf9.cluster.poller import Poller
+from pf9.cluster.cluster_apply import load_cluster_specs, apply_clusters
+from pf9.cluster.exceptions import ClusterSpecInvalid, ClusterCreateFailed, PrepNodeFailed, FailedActiveMasters
+from pf9.cluster.helpers import validate_serial, wave_count
+from pf9.cluster.commands import skip_prepared_nodes, attach_cluster, prep_node
+from pf9.cluster.cluster_attach import AttachCluster
+from pf9.modules import resmgr
+from pf9.modules.express import Get
+from pf9.modules.http_client import HTTPClient
+from pf9.modules.resmgr import HostIndex, ResMgrHost
 
 from pf9.cluster.commands import create as cli_cluster_create
 from pf9.cluster.commands import bootstrap as cli_cluster_bootstrap
@@ -35,3 +54,299 @@ class TestClusterHelp(TestCase):
     result = runner.invoke(cli_cluster_attachnode, ['--help'])
     assert result.exit_code == 0
     assert 'Usage:' in result.output
+
+
+class TestPoller(TestCase):
+    """Tests the backoff poller used by cluster waits"""
+    def test_backoff_until_done(self):
+        states = iter(['pending', 'pending', 'pending', 'ok'])
+        progress = []
+        with patch('time.sleep') as sleep:
+            result = Poller(timeout=60, initial_interval=0.5, max_interval=1, jitter=0).poll(
+                lambda: next(states), lambda state: state == 'ok',
+                on_progress=lambda state, attempts, elapsed: progress.append(attempts))
+        assert result.done and result.value == 'ok' and result.attempts == 4
+        assert [call[0][0] for call in sleep.call_args_list] == [0.5, 1, 1]
+        assert progress == [1, 2, 3]
+
+    def test_terminal_state(self):
+        with patch('time.sleep') as sleep:
+            result = Poller(timeout=60).poll(lambda: 'error', lambda state: state == 'ok',
+                                             is_terminal=lambda state: state == 'error')
+        assert result.terminal and not result.done
+        assert sleep.call_count == 0
+
+    def test_max_attempts_and_deadline(self):
+        with patch('time.sleep'):
+            result = Poller(max_attempts=5).poll(lambda: False, lambda attached: attached)
+        assert not result.done and result.attempts == 5
+        result = Poller(timeout=0).poll(lambda: False, lambda attached: attached)
+        assert not result.done and result.attempts == 1
+
+
+class TestWaves(TestCase):
+    """Tests rolling wave sizing for prep-node"""
+    def test_wave_count(self):
+        assert wave_count(200, None) == 1
+        assert wave_count(200, '50') == 4
+        assert wave_count(201, '50') == 5
+        assert wave_count(10, '25%') == 5
+        assert wave_count(3, '10%') == 3
+
+    def test_validate_serial(self):
+        assert validate_serial(None, None, '25%') == '25%'
+        assert validate_serial(None, None, '') is None
+        for value in ('0', '-1', '101%', 'half'):
+            self.assertRaises(BadParameter, validate_serial, None, None, value)
+
+
+class TestSkipPreparedNodes(TestCase):
+    """Tests the resmgr pre-flight of prep-node"""
+    def test_skip_prepared_nodes(self):
+        hosts = [ResMgrHost('host-1', 'node1', ['10.0.0.1'], ['pf9-kube'], 'ok', True),
+                 ResMgrHost('host-2', 'node2', ['10.0.0.2'], ['pf9-kube'], 'failed', True),
+                 ResMgrHost('host-3', 'node3', ['10.0.0.3'], [], None, True)]
+        index = HostIndex(None, 'key', hosts, from_network=True)
+        ctx = Mock(params={'token': 'token', 'floating_ip': ('1.1.1.1', '2.2.2.2', '3.3.3.3', '4.4.4.4')})
+        with patch.object(HostIndex, 'get', return_value=index), \
+                patch.object(Get, 'region_fqdn', return_value='region1.platform9.net'):
+            ips = skip_prepared_nodes(ctx, ('10.0.0.1', '10.0.0.2', '10.0.0.3', '10.0.0.4'))
+        assert ips == ('10.0.0.2', '10.0.0.3', '10.0.0.4')
+        assert ctx.params['floating_ip'] == ('2.2.2.2', '3.3.3.3', '4.4.4.4')
+
+
+class TestPrepNode(TestCase):
+    """Tests prep_node as run by create, bootstrap and apply, with the playbook mocked"""
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.cache_patch = patch.object(resmgr, 'RESMGR_CACHE_DIR', self.tmp_dir)
+        self.cache_patch.start()
+
+    def tearDown(self):
+        self.cache_patch.stop()
+        resmgr.clear_host_indexes()
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
+
+    def test_attach_lists_resmgr_after_prep(self):
+        listings = [[], [{'id': 'host-1', 'roles': [], 'info': {'hostname': 'node1', 'responding': True},
+                          'extensions': {'interfaces': {'data': {'iface_ip': {'eth0': '10.0.0.1'}}}}}]]
+
+        def get(api_endpoint, **kwargs):
+            return Mock(status_code=200, json=Mock(return_value=listings[0 if http_get.call_count == 1 else 1]))
+
+        ctx = Mock(params={'token': 'token', 'du_region': 'region1', 'project_id': 'project',
+                           'du_url': 'https://du.platform9.net', 'cluster_name': 'test', 'floating_ip': (), 'no_progress': True},
+                   obj={'pf9_log_dir': self.tmp_dir})
+        playbook = Mock(returncode=0)
+        playbook.is_running.return_value = False
+        playbook.events.return_value = []
+        with patch.object(HTTPClient, 'get', side_effect=get) as http_get, \
+                patch.object(Get, 'region_fqdn', return_value='region1.platform9.net'), \
+                patch('pf9.cluster.commands.PrepExpressRun') as prep_run, \
+                patch('pf9.cluster.commands.ConvergenceMonitor'), \
+                patch('pf9.cluster.commands.InstallerCache') as installer_cache, \
+                patch('pf9.cluster.commands.SegmentSessionWrapper'):
+            installer_cache.return_value.prefetch.return_value = ({'certless': {}, 'classic': {}}, {})
+            prep_run.return_value.build_playbook_run.return_value = playbook
+            assert prep_node(ctx, 'user', None, None, ('10.0.0.1',), node_prep_only=True)[0] == 0
+            assert AttachCluster(ctx).get_uuids(['10.0.0.1']) == ['host-1']
+        assert http_get.call_count == 2
+
+
+    def test_unique_log_per_run(self):
+        ctx = Mock(params={'token': 'token', 'du_region': 'region1', 'force': True, 'floating_ip': (),
+                           'no_progress': True},
+                   obj={'pf9_log_dir': self.tmp_dir})
+        playbook = Mock(returncode=0)
+        playbook.is_running.return_value = False
+        playbook.events.return_value = []
+        with patch.object(Get, 'region_fqdn', return_value='region1.platform9.net'), \
+                patch('pf9.cluster.commands.PrepExpressRun') as prep_run, \
+                patch('pf9.cluster.commands.ConvergenceMonitor'), \
+                patch('pf9.cluster.commands.InstallerCache') as installer_cache, \
+                patch('pf9.cluster.commands.SegmentSessionWrapper'):
+            installer_cache.return_value.prefetch.return_value = ({'certless': {}, 'classic': {}}, {})
+            prep_run.return_value.build_playbook_run.return_value = playbook
+            log_files = [prep_node(ctx, 'user', None, None, ('10.0.0.1',), node_prep_only=True)[1]
+                         for _ in range(3)]
+            event_logs = set(call[0][1] for call in prep_run.return_value.build_playbook_run.call_args_list)
+        assert len(set(log_files)) == 3 and len(event_logs) == 3
+        assert all(os.path.basename(log_file).startswith('node_provision_') for log_file in log_files)
+
+
+    def test_fail_fast_is_opt_in(self):
+        for fail_fast, cancelled in ((False, False), (True, True)):
+            ctx = Mock(params={'token': 'token', 'du_region': 'region1', 'force': True, 'floating_ip': (),
+                               'no_progress': True, 'fail_fast': fail_fast},
+                       obj={'pf9_log_dir': self.tmp_dir})
+            playbook = Mock(returncode=2)
+            # the failed node is reported while the other node is still being prepared
+            playbook.is_running.side_effect = [True, True, False]
+            playbook.events.side_effect = [[{'event': 'runner_on_failed', 'event_data': {
+                'host': '10.0.0.1', 'role': 'common', 'task': 'a', 'res': {'msg': 'failed'}}}], [], []]
+            with patch.object(Get, 'region_fqdn', return_value='region1.platform9.net'), \
+                    patch('pf9.cluster.commands.PrepExpressRun') as prep_run, \
+                    patch('pf9.cluster.commands.ConvergenceMonitor'), \
+                    patch('pf9.cluster.commands.InstallerCache') as installer_cache, \
+                    patch('pf9.cluster.commands.SegmentSessionWrapper'), \
+                    patch('pf9.cluster.exceptions.Log_Bundle'), \
+                    patch('time.sleep'):
+                installer_cache.return_value.prefetch.return_value = ({'certless': {}, 'classic': {}}, {})
+                prep_run.return_value.build_playbook_run.return_value = playbook
+                self.assertRaises(PrepNodeFailed, prep_node, ctx, 'user', None, None,
+                                  ('10.0.0.1', '10.0.0.2'), node_prep_only=True)
+            assert playbook.cancel.called == cancelled
+            assert playbook.is_running.call_count == (1 if cancelled else 3)
+
+
+class TestAttachPipeline(TestCase):
+    """Tests that workers attach once a quorum of masters is active"""
+    def test_workers_attach_at_master_quorum(self):
+        events = []
+        worker_attached = threading.Event()
+        attacher = Mock()
+        attacher.get_uuids.side_effect = lambda ips: ['uuid-{}'.format(ip) for ip in ips]
+        attacher.unresponsive_nodes.return_value = []
+
+        def attach_to_cluster(cluster_uuid, node_type, uuid_list):
+            events.append(('attach', node_type))
+            if node_type == 'worker':
+                worker_attached.set()
+
+        def wait_for_n_active_masters(master_node_num, deadline=None, label=None):
+            if master_node_num == 3:
+                # all masters only become active after the workers were attached
+                assert worker_attached.wait(5)
+            events.append(('masters', master_node_num))
+
+        attacher.attach_to_cluster.side_effect = attach_to_cluster
+        attacher.wait_for_n_active_masters.side_effect = wait_for_n_active_masters
+        ctx = Mock(params={'cluster_name': 'test'})
+        with patch('pf9.cluster.commands.AttachCluster', return_value=attacher), \
+                patch('pf9.cluster.commands.CreateCluster') as create_cluster, \
+                patch('pf9.cluster.commands.SegmentSessionWrapper'):
+            create_cluster.return_value.cluster_exists.return_value = (True, 'cluster-uuid')
+            attach_cluster('test', ('m1', 'm2', 'm3'), ('w1',), ctx)
+        assert events == [('attach', 'master'), ('masters', 2), ('attach', 'worker'), ('masters', 3)]
+
+    def test_single_master_active_before_workers(self):
+        events = []
+        attacher = Mock()
+        attacher.get_uuids.side_effect = lambda ips: ['uuid-{}'.format(ip) for ip in ips]
+        attacher.unresponsive_nodes.return_value = []
+        attacher.attach_to_cluster.side_effect = lambda cluster_uuid, node_type, uuid_list: \
+            events.append(('attach', node_type))
+        attacher.wait_for_n_active_masters.side_effect = lambda master_node_num, deadline=None, label=None: \
+            events.append(('masters', master_node_num))
+        ctx = Mock(params={'cluster_name': 'test'})
+        with patch('pf9.cluster.commands.AttachCluster', return_value=attacher), \
+                patch('pf9.cluster.commands.CreateCluster') as create_cluster, \
+                patch('pf9.cluster.commands.SegmentSessionWrapper'):
+            create_cluster.return_value.cluster_exists.return_value = (True, 'cluster-uuid')
+            attach_cluster('test', ('m1',), ('w1', 'w2'), ctx)
+        assert events == [('attach', 'master'), ('masters', 1), ('attach', 'worker')]
+
+    def test_masters_timeout_settles_worker_attach(self):
+        events = []
+        worker_started = threading.Event()
+        attacher = Mock()
+        attacher.get_uuids.side_effect = lambda ips: ['uuid-{}'.format(ip) for ip in ips]
+        attacher.unresponsive_nodes.return_value = []
+
+        def attach_to_cluster(cluster_uuid, node_type, uuid_list):
+            if node_type == 'worker':
+                worker_started.set()
+                time.sleep(0.1)
+            events.append(('attach', node_type))
+
+        def wait_for_n_active_masters(master_node_num, deadline=None, label=None):
+            if master_node_num == 3:
+                assert worker_started.wait(5)
+                raise FailedActiveMasters('timed out')
+
+        attacher.attach_to_cluster.side_effect = attach_to_cluster
+        attacher.wait_for_n_active_masters.side_effect = wait_for_n_active_masters
+        ctx = Mock(params={'cluster_name': 'test'})
+        with patch('pf9.cluster.commands.AttachCluster', return_value=attacher), \
+                patch('pf9.cluster.commands.CreateCluster') as create_cluster, \
+                patch('pf9.cluster.commands.SegmentSessionWrapper'), \
+                patch('pf9.cluster.commands.click.echo',
+                      side_effect=lambda message: events.append(('echo', message))):
+            create_cluster.return_value.cluster_exists.return_value = (True, 'cluster-uuid')
+            self.assertRaises(FailedActiveMasters, attach_cluster, 'test', ('m1', 'm2', 'm3'), ('w1',), ctx)
+        assert events[-2:] == [('attach', 'worker'),
+                               ('echo', 'Failed attaching master node(s) to cluster: timed out')]
+
+
+class TestClusterApply(TestCase):
+    """Tests the cluster specs and scheduler of cluster apply"""
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.spec_file = os.path.join(self.tmp_dir, 'clusters.yaml')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def write_spec(self, spec):
+        with open(self.spec_file, 'w') as spec_file:
+            spec_file.write(spec)
+
+    def test_load_cluster_specs(self):
+        self.write_spec("defaults:\n"
+                        "  user: ubuntu\n"
+                        "  ssh-key: /root/.ssh/id_rsa\n"
+                        "clusters:\n"
+                        "  - name: edge-1\n"
+                        "    master_ip: 10.0.0.1\n"
+                        "    worker_ip: [10.0.0.2, 10.0.0.3]\n"
+                        "  - cluster_name: edge-2\n"
+                        "    master-ip: [10.0.1.1, 10.0.1.2, 10.0.1.3]\n"
+                        "    masterVip: 10.0.1.100\n"
+                        "    networkPlugin: calico\n"
+                        "    serial: 1\n")
+        edge1, edge2 = load_cluster_specs(self.spec_file, cli_cluster_create)
+        assert edge1['cluster_name'] == 'edge-1'
+        assert edge1['master_ip'] == ('10.0.0.1',)
+        assert edge1['worker_ip'] == ('10.0.0.2', '10.0.0.3')
+        assert edge1['ssh_key'] == '/root/.ssh/id_rsa'
+        assert edge1['containerscidr'] == '10.20.0.0/16'
+        assert edge2['user'] == 'ubuntu'
+        assert edge2['mastervip'] == '10.0.1.100'
+        assert edge2['networkplugin'] == 'calico'
+        assert edge2['serial'] == '1'
+        assert edge2['worker_ip'] == ()
+
+    def test_invalid_cluster_specs(self):
+        for spec in ("clusters: []\n",
+                     "clusters:\n  - name: edge-1\n",
+                     "clusters:\n  - name: edge-1\n    master_ip: 10.0.0.1\n    masters: 3\n",
+                     "clusters:\n  - name: edge-1\n    master_ip: 10.0.0.1\n    serial: 0\n",
+                     "clusters:\n  - {name: edge-1, master_ip: 10.0.0.1}\n  - {name: edge-1, master_ip: 10.0.0.2}\n"):
+            self.write_spec(spec)
+            self.assertRaises(ClusterSpecInvalid, load_cluster_specs, self.spec_file, cli_cluster_create)
+
+    def test_apply_clusters(self):
+        lock = threading.Lock()
+        running = [0, 0]
+
+        def create_one(params):
+            with lock:
+                running[0] += 1
+                running[1] = max(running)
+            try:
+                threading.Event().wait(0.05)
+                if params['cluster_name'] == 'edge-2':
+                    raise ClusterCreateFailed("qbert said no")
+                return 'uuid-{}'.format(params['cluster_name'])
+            finally:
+                with lock:
+                    running[0] -= 1
+
+        specs = [{'cluster_name': 'edge-{}'.format(index), 'master_ip': ('10.0.0.{}'.format(index),),
+                  'worker_ip': ()} for index in range(6)]
+        results = apply_clusters(specs, create_one, parallel=2)
+        assert [result.name for result in results] == ['edge-{}'.format(index) for index in range(6)]
+        assert running[1] == 2
+        assert results[0].status == 'created' and results[0].cluster_uuid == 'uuid-edge-0'
+        assert results[2].status == 'failed' and results[2].error == 'qbert said no'
+        assert results[2].cluster_uuid is None
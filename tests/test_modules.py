@@ -0,0 +1,626 @@
+"""Tests for pf9.modules helpers."""
+
+
+import os
+import sys
+import json
+import time
+import shutil
+import tempfile
+
+from unittest import TestCase
+from configparser import RawConfigParser
+from mock import patch, Mock
+
+from pf9.modules import ostoken, analytics_utils, resmgr, ansible_events, ansible_backend, ansible_config, qbert, \
+    convergence, installer_cache
+from pf9.modules.cache import FileCache
+from pf9.modules.config_store import ConfigStore, parse_config_lines
+from pf9.exceptions import DUCommFailure
+from pf9.modules.http_client import HTTPClient, fan_out, env_timeout
+from pf9.modules.util import Logger, log_level_name
+from pf9.modules.ostoken import parse_keystone_time, GetRegionURL, GetToken
+
+
+class TestFileCache(TestCase):
+    """Test the on-disk JSON cache"""
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        self.cache = FileCache(self.cache_dir)
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir, ignore_errors=True)
+
+    def test_set_get(self):
+        key = FileCache.make_key('config', 'user', 'service', 'https://test.platform9.com')
+        self.cache.set(key, {'token': 'abc'}, expires_at=time.time() + 60)
+        assert self.cache.get(key) == {'token': 'abc'}
+        for name in os.listdir(self.cache_dir):
+            with open(os.path.join(self.cache_dir, name)) as cache_file:
+                assert 'user' not in cache_file.read()
+
+    def test_expired_entry(self):
+        self.cache.set('key', 'value', expires_at=time.time() - 1)
+        assert self.cache.get('key') is None
+
+    def test_missing_entry(self):
+        assert self.cache.get('missing') is None
+
+
+class TestKeystoneTime(TestCase):
+    """Test parsing of Keystone token expiry"""
+    def test_parse_fractional(self):
+        assert parse_keystone_time('1970-01-01T00:01:00.000000Z') == 60
+
+    def test_parse_whole_seconds(self):
+        assert parse_keystone_time('1970-01-01T00:01:00Z') == 60
+
+    def test_parse_invalid(self):
+        assert parse_keystone_time('') is None
+
+
+class TestGetRegionURL(TestCase):
+    """Test region FQDN resolution from the token service catalog"""
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        self.catalog_auth = {
+            "headers": {"X-Subject-Token": "token"},
+            "json": {"token": {"project": {"id": "project"}, "user": {"id": "user"}, "catalog": [
+                {"type": "regionInfo", "endpoints": [
+                    {"region_id": "region1", "interface": "internal",
+                     "url": "https://internal.platform9.net/private"},
+                    {"region_id": "region1", "interface": "public",
+                     "url": "https://region1.platform9.net/links/"}]}]}}}
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir, ignore_errors=True)
+        ostoken._region_urls.clear()
+        ostoken._auth_sessions.clear()
+
+    def test_region_url_from_catalog_is_cached(self):
+        with patch.object(ostoken, 'REGION_CACHE_DIR', self.cache_dir), \
+                patch.object(ostoken.GetToken, 'os_auth', return_value=self.catalog_auth) as os_auth:
+            get_region = GetRegionURL('https://test.platform9.com', 'user', 'pass', 'service', 'region1')
+            assert get_region.get_region_url() == 'region1.platform9.net'
+            assert get_region.get_region_url() == 'region1.platform9.net'
+            ostoken._region_urls.clear()
+            assert get_region.get_region_url() == 'region1.platform9.net'
+        assert os_auth.call_count == 1
+
+
+class TestHTTPClient(TestCase):
+    """Test the pooled DU HTTP client"""
+    def test_session_shared_per_host(self):
+        qbert = HTTPClient('https://region1.platform9.net', token='token1')
+        resmgr = HTTPClient('https://region1.platform9.net/', token='token2')
+        other = HTTPClient('https://region2.platform9.net')
+        assert qbert.session is resmgr.session
+        assert qbert.session is not other.session
+
+    def test_env_timeout(self):
+        with patch.dict(os.environ, {'PF9_HTTP_READ_TIMEOUT': '30'}):
+            assert env_timeout('PF9_HTTP_READ_TIMEOUT', 60.0) == 30.0
+        for value in ('30s', '', '0', '-5'):
+            with patch.dict(os.environ, {'PF9_HTTP_READ_TIMEOUT': value}):
+                assert env_timeout('PF9_HTTP_READ_TIMEOUT', 60.0) == 60.0
+
+    def test_url(self):
+        client = HTTPClient('https://region1.platform9.net/')
+        assert client.url('resmgr/v1/hosts') == 'https://region1.platform9.net/resmgr/v1/hosts'
+        assert client.url('https://other.platform9.net/x') == 'https://other.platform9.net/x'
+
+
+class TestAuthSession(TestCase):
+    """Test that a process authenticates once per set of credentials"""
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        self.keystone_response = {
+            "headers": {"X-Subject-Token": "token"},
+            "json": {"token": {"project": {"id": "project"}, "user": {"id": "user"},
+                               "expires_at": "2999-01-01T00:00:00.000000Z"}}}
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir, ignore_errors=True)
+        ostoken._auth_sessions.clear()
+
+    def test_single_auth(self):
+        credentials = ('https://test.platform9.com', 'user', 'pass', 'service')
+        with patch.object(ostoken, 'TOKEN_CACHE_DIR', self.cache_dir), \
+                patch.object(GetToken, 'keystone_auth', return_value=self.keystone_response) as keystone_auth:
+            assert GetToken('config').get_token_v3(*credentials) == 'token'
+            assert GetToken('config').get_project_id(*credentials) == 'project'
+            assert GetToken('config').get_token_project_user_id(*credentials) == ('token', 'project', 'user')
+            assert keystone_auth.call_count == 1
+            # A new process reuses the on-disk token
+            ostoken._auth_sessions.clear()
+            assert GetToken('config').get_token_project(*credentials) == ('token', 'project')
+            assert keystone_auth.call_count == 1
+
+
+class TestConfigStore(TestCase):
+    """Test parsing and caching of the active config"""
+    def setUp(self):
+        self.conf_dir = tempfile.mkdtemp()
+        self.config_file = os.path.join(self.conf_dir, 'express.conf')
+        with open(self.config_file, 'w') as write_exp_conf:
+            write_exp_conf.write('du_url|https://test.platform9.com\n'
+                                 'os_username|test.user@platform9.com\n'
+                                 'os_password|pass|with_du_url\n'
+                                 'os_region|region1\n'
+                                 'os_tenant|service\n'
+                                 'disable_analytics|True\n')
+
+    def tearDown(self):
+        shutil.rmtree(self.conf_dir, ignore_errors=True)
+        ConfigStore.clear()
+
+    def test_parse_config_lines(self):
+        config = parse_config_lines(['  config_name|test\n', 'os_password|du_url|x\n', 'garbage\n'])
+        assert config == {'name': 'test', 'os_password': 'du_url|x'}
+
+    def test_load(self):
+        config = ConfigStore.load(self.config_file)
+        assert config.du_url == 'https://test.platform9.com'
+        assert config.os_password == 'pass|with_du_url'
+        assert config.name == 'test.user-https://test.platform9.com'
+        assert config.disable_analytics is True
+        assert config.dev_key is False
+        assert ConfigStore.load(self.config_file) is config
+
+    def test_reload_on_change(self):
+        ConfigStore.load(self.config_file)
+        with open(self.config_file, 'a') as write_exp_conf:
+            write_exp_conf.write('config_name|renamed\n')
+        assert ConfigStore.load(self.config_file).name == 'renamed'
+
+    def test_incomplete_config(self):
+        with open(self.config_file, 'w') as write_exp_conf:
+            write_exp_conf.write('du_url|https://test.platform9.com\n')
+        self.assertRaises(KeyError, ConfigStore.load, self.config_file)
+
+
+class TestLogger(TestCase):
+    """Test the process wide logging setup"""
+    def setUp(self):
+        self.log_dir = tempfile.mkdtemp()
+        self.log_file = os.path.join(self.log_dir, 'log', 'pf9ctl.log')
+
+    def tearDown(self):
+        shutil.rmtree(self.log_dir, ignore_errors=True)
+
+    def test_handlers_shared_and_deduplicated(self):
+        logger_a = Logger(self.log_file).get_logger('pf9.test.a')
+        logger_b = Logger(self.log_file).get_logger('pf9.test.b')
+        Logger(self.log_file).get_logger('pf9.test.a')
+        assert len(logger_a.handlers) == 1
+        assert logger_a.handlers[0] is logger_b.handlers[0]
+
+    def test_set_level(self):
+        logger = Logger(self.log_file).get_logger('pf9.test.level')
+        Logger.set_level('info')
+        try:
+            assert logger.getEffectiveLevel() == 20
+            assert Logger(self.log_file).get_logger('pf9.test.later').getEffectiveLevel() == 20
+        finally:
+            Logger.set_level('debug')
+
+    def test_log_level_name(self):
+        assert log_level_name('warning') == 'WARNING'
+        assert log_level_name('verbose') == 'DEBUG'
+        assert log_level_name(None) == 'DEBUG'
+
+
+class TestSegmentSpool(TestCase):
+    """Test that Segment events are spooled locally and flushed in batches"""
+    def setUp(self):
+        self.spool_dir = tempfile.mkdtemp()
+        spool_file = os.path.join(self.spool_dir, 'segment_spool.jsonl')
+        self.patches = [patch.object(analytics_utils, 'SEGMENT_SPOOL_DIR', self.spool_dir),
+                        patch.object(analytics_utils, 'SEGMENT_SPOOL_FILE', spool_file),
+                        patch.object(analytics_utils, '_flush_on_exit', True)]
+        for patcher in self.patches:
+            patcher.start()
+
+    def tearDown(self):
+        for patcher in self.patches:
+            patcher.stop()
+        shutil.rmtree(self.spool_dir, ignore_errors=True)
+
+    def test_disabled_session_spools_nothing(self):
+        analytics_utils.SegmentSession(is_enabled=False).send_track('event', {})
+        assert not os.path.exists(analytics_utils.SEGMENT_SPOOL_FILE)
+
+    def test_flush_batches(self):
+        session = analytics_utils.SegmentSession()
+        for step in range(5):
+            session.send_track('event {}'.format(step), {'step': step}, user_id='user')
+        with patch('analytics.request.post') as post:
+            assert analytics_utils.flush_spool(batch_size=2) == 5
+        assert post.call_count == 3
+        assert post.call_args_list[0][1]['batch'][0]['event'] == 'event 0'
+        assert os.listdir(self.spool_dir) == []
+
+    def test_failed_flush_keeps_events(self):
+        session = analytics_utils.SegmentSession()
+        session.send_group('user', 'https://test.platform9.com')
+        with patch('analytics.request.post', side_effect=IOError('unreachable')):
+            assert analytics_utils.flush_spool() == 0
+        with open(analytics_utils.SEGMENT_SPOOL_FILE) as spool:
+            assert len(spool.readlines()) == 1
+
+
+class TestHostIndex(TestCase):
+    """Test that resmgr hosts are listed once and looked up by IP or hostname"""
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        self.hosts = [{"id": "host-{}".format(num), "roles": ["pf9-kube"], "role_status": "ok",
+                       "info": {"hostname": "node{}".format(num), "responding": True},
+                       "extensions": {"interfaces": {"data": {"iface_ip": {"eth0": "10.0.0.{}".format(num)}}}}}
+                      for num in range(50)]
+        self.cache_patch = patch.object(resmgr, 'RESMGR_CACHE_DIR', self.cache_dir)
+        self.cache_patch.start()
+
+    def tearDown(self):
+        self.cache_patch.stop()
+        resmgr.clear_host_indexes()
+        shutil.rmtree(self.cache_dir, ignore_errors=True)
+
+    def listing(self):
+        response = Mock(status_code=200)
+        response.json.return_value = self.hosts
+        return response
+
+    def test_single_listing_for_all_lookups(self):
+        with patch.object(HTTPClient, 'get', return_value=self.listing()) as get:
+            index = resmgr.HostIndex.get('https://region1.platform9.net', 'token', 'project')
+            assert [index.host_id('10.0.0.{}'.format(num)) for num in range(50)] == \
+                ['host-{}'.format(num) for num in range(50)]
+            assert index.lookup('node7').responding
+            assert resmgr.HostIndex.get('https://region1.platform9.net', 'token', 'project') is index
+        assert get.call_count == 1
+
+    def test_disk_cache_refreshed_once_on_miss(self):
+        with patch.object(HTTPClient, 'get', return_value=self.listing()):
+            resmgr.HostIndex.get('https://region1.platform9.net', 'token', 'project')
+        resmgr.clear_host_indexes()
+        with patch.object(HTTPClient, 'get', return_value=self.listing()) as get:
+            index = resmgr.HostIndex.get('https://region1.platform9.net', 'token', 'project')
+            assert index.host_id('10.0.0.3') == 'host-3'
+            assert get.call_count == 0
+            assert index.host_id('10.0.1.1') is None
+            assert index.host_id('10.0.1.2') is None
+        assert get.call_count == 1
+
+    def test_resolve_host_status(self):
+        def get(api_endpoint):
+            if api_endpoint == resmgr.RESMGR_HOSTS_ENDPOINT:
+                return self.listing()
+            response = Mock(status_code=200)
+            response.json.return_value = dict(self.hosts[int(api_endpoint.rsplit('-', 1)[1])], roles=[])
+            return response
+        with patch.object(HTTPClient, 'get', side_effect=get) as http_get:
+            host_status = resmgr.resolve_host_status('https://region1.platform9.net', 'token',
+                                                     ['10.0.0.1', '10.0.0.2', '10.0.1.1'])
+        assert host_status['10.0.0.1'] == resmgr.HostStatus('host-1', [], True)
+        assert host_status['10.0.0.2'].uuid == 'host-2'
+        assert host_status['10.0.1.1'] is None
+        assert http_get.call_count == 3
+
+
+class TestPrepProgress(TestCase):
+    """Test per-host progress and failure detection from the playbook event stream"""
+    def setUp(self):
+        self.event_dir = tempfile.mkdtemp()
+        self.event_log = os.path.join(self.event_dir, 'events.jsonl')
+
+    def tearDown(self):
+        shutil.rmtree(self.event_dir, ignore_errors=True)
+
+    def write_events(self, *events):
+        with open(self.event_log, 'a') as event_log:
+            for event_type, event_data in events:
+                event_log.write(json.dumps({'event': event_type, 'event_data': event_data}) + '\n')
+
+    def test_progress_and_failure(self):
+        tail = ansible_events.EventTail(self.event_log)
+        progress = ansible_events.PrepProgress(['10.0.0.1', '10.0.0.2'])
+        assert tail.read() == []
+        self.write_events(('runner_on_ok', {'host': '10.0.0.1', 'role': 'common', 'task': 'a'}),
+                          ('runner_on_ok', {'host': '10.0.0.1', 'role': 'ntp', 'task': 'b'}),
+                          ('runner_on_failed', {'host': '10.0.0.2', 'role': 'ntp', 'task': 'c',
+                                                'ignore_errors': True}))
+        assert [progress.update(event) for event in tail.read()] == [None, None, None]
+        assert progress.completed_steps == 1
+        self.write_events(('runner_on_unreachable', {'host': '10.0.0.2', 'role': 'ntp', 'task': 'd',
+                                                     'res': {'msg': 'timeout'}}))
+        failure = progress.update(tail.read()[0])
+        assert failure == ansible_events.HostFailure('10.0.0.2', 'ntp', 'd', 'timeout', True)
+        self.write_events(('playbook_on_stats', {}))
+        progress.update(tail.read()[0])
+        assert progress.completed_steps == progress.total_steps == 10
+
+    def test_partial_line(self):
+        tail = ansible_events.EventTail(self.event_log)
+        with open(self.event_log, 'w') as event_log:
+            event_log.write('{"event": "playbook_on_st')
+        assert tail.read() == []
+        with open(self.event_log, 'a') as event_log:
+            event_log.write('ats"}\n')
+        assert tail.read() == [{'event': 'playbook_on_stats'}]
+
+
+class TestPlaybookBackends(TestCase):
+    """Test the playbook execution backends"""
+    def setUp(self):
+        self.log_dir = tempfile.mkdtemp()
+        self.log_file = os.path.join(self.log_dir, 'node_provision.log')
+        self.event_log = os.path.join(self.log_dir, 'node_provision.events.jsonl')
+
+    def tearDown(self):
+        shutil.rmtree(self.log_dir, ignore_errors=True)
+
+    def test_slim_event(self):
+        event = {'event': 'runner_on_failed', 'counter': 7, 'stdout': 'fatal: [10.0.0.1]',
+                 'event_data': {'host': '10.0.0.1', 'role': 'ntp', 'task': 'sync', 'ignore_errors': None,
+                                'res': {'msg': 'timeout', 'ansible_facts': {'big': 'dict'}}}}
+        slim = ansible_backend.slim_event(event)
+        assert slim['event_data'] == {'host': '10.0.0.1', 'role': 'ntp', 'task': 'sync',
+                                      'ignore_errors': None, 'res': {'msg': 'timeout'}}
+        assert ansible_events.PrepProgress(['10.0.0.1']).update(slim).task == 'sync'
+
+    def test_subprocess_events(self):
+        script = os.path.join(self.log_dir, 'playbook.py')
+        with open(script, 'w') as script_file:
+            script_file.write("import os\n"
+                              "open(os.environ['PF9_EVENT_LOG'], 'w').write('{\"event\": \"playbook_on_stats\"}\\n')\n")
+        playbook = ansible_backend.SubprocessPlaybook('{} {}'.format(sys.executable, script),
+                                                      self.log_file, self.event_log)
+        playbook.start()
+        while playbook.is_running():
+            time.sleep(0.1)
+        playbook.close()
+        assert playbook.returncode == 0
+        assert playbook.events() == [{'event': 'playbook_on_stats'}]
+
+
+class TestAnsibleConfig(TestCase):
+    """Test the tuned runtime ansible.cfg"""
+    def setUp(self):
+        self.runtime_dir = tempfile.mkdtemp()
+        self.patches = [patch.object(ansible_config, 'ANSIBLE_FACT_CACHE_DIR', os.path.join(self.runtime_dir, 'facts')),
+                        patch.object(ansible_config, 'ANSIBLE_CONTROL_PATH_DIR', os.path.join(self.runtime_dir, 'cp'))]
+        for patcher in self.patches:
+            patcher.start()
+        self.bundled_cfg = os.path.join(os.path.dirname(ansible_config.__file__), '..', 'express', 'ansible.cfg')
+
+    def tearDown(self):
+        for patcher in self.patches:
+            patcher.stop()
+        shutil.rmtree(self.runtime_dir, ignore_errors=True)
+
+    def test_write_ansible_cfg(self):
+        runtime_cfg = ansible_config.write_ansible_cfg(self.bundled_cfg, strategy='free',
+                                                       runtime_dir=self.runtime_dir)
+        config = RawConfigParser()
+        config.read(runtime_cfg)
+        assert config.get('defaults', 'strategy') == 'free'
+        assert config.get('defaults', 'gathering') == 'smart'
+        assert config.get('defaults', 'fact_caching') == 'jsonfile'
+        assert 'ControlPersist' in config.get('ssh_connection', 'ssh_args')
+        assert os.path.isdir(config.get('defaults', 'callback_plugins'))
+        assert os.path.isfile(os.path.join(config.get('defaults', 'library'), 'pf9_facts.py'))
+        mtime = os.stat(runtime_cfg).st_mtime_ns
+        time.sleep(0.01)
+        assert ansible_config.write_ansible_cfg(self.bundled_cfg, strategy='free',
+                                                runtime_dir=self.runtime_dir) == runtime_cfg
+        assert os.stat(runtime_cfg).st_mtime_ns == mtime
+        self.assertRaises(ValueError, ansible_config.write_ansible_cfg, self.bundled_cfg, 'fast')
+
+
+class TestClusterNodes(TestCase):
+    """Tests the conditional, cluster scoped qbert node listing"""
+    def test_num_active_masters(self):
+        nodes = [{'uuid': 'n1', 'clusterName': 'c1', 'isMaster': 1, 'api_responding': 1, 'status': 'ok',
+                  'osInfo': 'x' * 1000},
+                 {'uuid': 'n2', 'clusterName': 'c1', 'isMaster': 1, 'api_responding': 0, 'status': 'ok'},
+                 {'uuid': 'n3', 'clusterName': 'c1', 'isMaster': 0, 'api_responding': 1, 'status': 'ok'},
+                 {'uuid': 'n4', 'clusterName': 'c2', 'isMaster': 1, 'api_responding': 1, 'status': 'ok'},
+                 {'uuid': 'n5', 'isMaster': 0}]
+        client = Mock()
+        client.get.side_effect = [Mock(status_code=200, headers={'ETag': '"v1"'}, json=Mock(return_value=nodes)),
+                                  Mock(status_code=304, headers={}),
+                                  Mock(status_code=500, headers={})]
+        api = qbert.Qbert('https://region1.platform9.net', 'token', 'project')
+        api.client = client
+        view = qbert.ClusterNodes(api, 'c1', cluster_uuid='cluster-uuid')
+        assert view.num_active_masters() == 1
+        assert [node.uuid for node in view.nodes] == ['n1', 'n2', 'n3']
+        assert view.nodes[0] == qbert.NodeStatus('n1', None, 'c1', None, True, True, 'ok')
+        assert view.num_active_masters() == 1
+        assert view.num_active_masters() == 0
+        first_call, second_call = client.get.call_args_list[:2]
+        assert first_call[0][0] == 'qbert/v3/project/nodes'
+        assert first_call[1]['params'] == {'clusterUuid': 'cluster-uuid'}
+        assert first_call[1]['headers'] == {}
+        assert second_call[1]['headers'] == {'If-None-Match': '"v1"'}
+
+
+class TestAPIClients(TestCase):
+    """Tests the typed resmgr and qbert clients"""
+    def test_qbert_records(self):
+        api = qbert.Qbert('https://region1.platform9.net', 'token', 'project')
+        api.client = Mock()
+        api.client.get.return_value = Mock(status_code=200, json=Mock(return_value=[
+            {'uuid': 'cp1', 'name': 'aws', 'type': 'aws', 'nodePoolUuid': 'np1'},
+            {'uuid': 'cp2', 'name': 'default', 'type': 'local', 'nodePoolUuid': 'np2'}]))
+        assert api.get_cloud_providers()[1] == qbert.CloudProvider('cp2', 'default', 'local', 'np2')
+        api.client.get.assert_called_with('qbert/v3/project/cloudProviders')
+        api.client.get.return_value = Mock(status_code=503)
+        self.assertRaises(DUCommFailure, api.get_clusters)
+        api.client.post.return_value = Mock(status_code=200, json=Mock(return_value={'uuid': 'c1'}))
+        assert api.create_cluster({'name': 'test'}) == 'c1'
+
+    def test_resmgr_support_bundle(self):
+        api = resmgr.ResMgr('https://region1.platform9.net', 'token')
+        api.client = Mock()
+        api.client.post.return_value = Mock(status_code=201)
+        assert api.request_support_bundle('host-1') == 201
+        api.client.post.assert_called_with('resmgr/v1/hosts/host-1/support/bundle')
+        api.client.post.return_value = Mock(status_code=500)
+        self.assertRaises(DUCommFailure, api.request_support_bundle, 'host-1')
+
+    def test_resmgr_assign_roles(self):
+        api = resmgr.ResMgr('https://region1.platform9.net', 'token')
+        api.client = Mock()
+        api.client.put.side_effect = lambda endpoint: Mock(
+            status_code=500 if endpoint.startswith('resmgr/v1/hosts/host-3/') else 200, text='error')
+        errors = api.assign_roles(('host-{}'.format(num) for num in range(10)), max_workers=4)
+        assert list(errors) == ['host-3']
+        assert api.client.put.call_count == 10
+        api.client.put.assert_any_call('resmgr/v1/hosts/host-7/roles/pf9-kube')
+
+    def test_fan_out_keeps_order(self):
+        assert fan_out(lambda num: num * 2, range(20), max_workers=4) == [num * 2 for num in range(20)]
+        assert fan_out(lambda num: num, []) == []
+
+
+class TestConvergenceMonitor(TestCase):
+    """Tests that one resmgr listing answers the convergence markers of all hosts"""
+    def setUp(self):
+        self.convergence_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.convergence_dir)
+
+    def wait_marker(self, name):
+        with open(os.path.join(self.convergence_dir, name), 'w') as marker:
+            marker.write('node\n')
+
+    def done_marker(self, name):
+        path = os.path.join(self.convergence_dir, name)
+        if not os.path.exists(path):
+            return None
+        with open(path) as marker:
+            return marker.read()
+
+    def test_check_once(self):
+        for name in ('host-1.k8s.wait', 'host-2.role.wait', 'host-3.role.wait', '.ansible_tmpxhost-4.role.wait'):
+            self.wait_marker(name)
+        api = Mock()
+        api.get_hosts_convergence.return_value = [
+            resmgr.HostConvergence('host-1', 'converging', 'ok', True),
+            resmgr.HostConvergence('host-2', 'converging', 'ok', True),
+            resmgr.HostConvergence('host-3', 'ok', None, True)]
+        monitor = convergence.ConvergenceMonitor(api, self.convergence_dir, timeout=60)
+        assert monitor.check_once(now=1000) == 1
+        assert api.get_hosts_convergence.call_count == 1
+        assert self.done_marker('host-1.k8s.done') == 'ok'
+        assert self.done_marker('host-3.role.done') == 'ok'
+        assert self.done_marker('host-2.role.done') is None
+        assert monitor.pending() == [('host-2', 'role')]
+        assert monitor.check_once(now=1061) == 0
+        assert self.done_marker('host-2.role.done').startswith('timed out after 60s, last status: converging')
+        assert monitor.check_once() == 0
+        assert api.get_hosts_convergence.call_count == 2
+
+    def test_batch_role_assignment(self):
+        for name in ('host-1.k8s.wait', 'host-2.k8s.wait', 'host-3.k8s.wait', 'host-4.role.wait'):
+            self.wait_marker(name)
+        api = Mock()
+        api.get_hosts_convergence.return_value = [
+            resmgr.HostConvergence('host-1', None, 'ok', True),
+            resmgr.HostConvergence('host-2', None, 'ok', True),
+            resmgr.HostConvergence('host-3', None, 'converging', True),
+            resmgr.HostConvergence('host-4', 'ok', 'ok', True)]
+        api.assign_roles.return_value = {'host-2': 'failed: 500'}
+        monitor = convergence.ConvergenceMonitor(api, self.convergence_dir, assign_role='pf9-kube')
+        assert monitor.check_once() == 1
+        api.assign_roles.assert_called_once_with(['host-1', 'host-2'], 'pf9-kube')
+        assert self.done_marker('host-1.k8s.done') == 'ok'
+        assert self.done_marker('host-2.k8s.done') == 'role pf9-kube assignment failed: failed: 500'
+        assert self.done_marker('host-4.role.done') == 'ok'
+
+
+class TestInstallerCache(TestCase):
+    """Tests that an installer is downloaded once per version reported by the DU"""
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        self.cache = installer_cache.InstallerCache('test.platform9.com', self.cache_dir)
+        self.cache.client = Mock()
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir)
+
+    def serve(self, etag, content):
+        self.cache.client.head.return_value = Mock(status_code=200, headers={'ETag': etag})
+        self.cache.client.get.return_value = Mock(
+            status_code=200, headers={'Content-Length': str(len(content))},
+            iter_content=Mock(return_value=[content[:3], content[3:]]))
+
+    def test_download_once_per_version(self):
+        self.serve('"v1"', b'#!/bin/sh v1')
+        path = self.cache.certless_installer('debian')
+        assert path == os.path.join(self.cache_dir, 'test.platform9.com', installer_cache.installer_version(
+            {'ETag': '"v1"'}), 'platform9-install-debian.sh')
+        assert self.cache.certless_installer('debian') == path
+        assert self.cache.client.get.call_count == 1
+        self.cache.client.head.assert_called_with('clarity/platform9-install-debian.sh', allow_redirects=True)
+
+        self.serve('"v2"', b'#!/bin/sh v2')
+        new_path = self.cache.certless_installer('debian')
+        assert new_path != path and not os.path.exists(os.path.dirname(path))
+        with open(new_path, 'rb') as installer:
+            assert installer.read() == b'#!/bin/sh v2'
+        assert self.cache.client.get.call_count == 2
+
+    def test_unavailable_or_incomplete(self):
+        self.cache.client.head.return_value = Mock(status_code=404)
+        assert self.cache.certless_installer('redhat') is None
+        self.cache.client.head.return_value = Mock(status_code=503)
+        self.assertRaises(DUCommFailure, self.cache.certless_installer, 'redhat')
+        self.serve('"v1"', b'#!/bin/sh v1')
+        self.cache.client.get.return_value.headers['Content-Length'] = '100'
+        self.assertRaises(DUCommFailure, self.cache.certless_installer, 'redhat')
+        assert os.listdir(os.path.join(self.cache_dir, 'test.platform9.com',
+                                       installer_cache.installer_version({'ETag': '"v1"'}))) == []
+        assert installer_cache.installer_version({'Content-Length': '12'}) == installer_cache.UNVERSIONED
+
+    def test_unversioned_downloaded_every_time(self):
+        self.serve('"v1"', b'#!/bin/sh v1')
+        self.cache.client.head.return_value.headers = {'Content-Length': '12'}
+        path = self.cache.certless_installer('debian')
+        assert os.path.basename(os.path.dirname(path)) == installer_cache.UNVERSIONED
+        self.serve('"v2"', b'#!/bin/sh v2')
+        self.cache.client.head.return_value.headers = {'Content-Length': '12'}
+        assert self.cache.certless_installer('debian') == path
+        with open(path, 'rb') as installer:
+            assert installer.read() == b'#!/bin/sh v2'
+        assert self.cache.client.get.call_count == 2
+
+    def test_prefetch(self):
+        def head(api_endpoint, **kwargs):
+            if 'redhat' in api_endpoint:
+                return Mock(status_code=404)
+            return Mock(status_code=200, headers={'ETag': '"v1"'})
+
+        def get_hostagent(cmd, cwd, **kwargs):
+            # pf9_get_hostagent.py downloads the classic installer into its working directory
+            with open(os.path.join(cwd, 'platform9-install-region1-redhat.sh'), 'w') as installer:
+                installer.write('#!/bin/sh')
+            return Mock(returncode=0, communicate=Mock(return_value=('done', None)))
+
+        self.serve('"v1"', b'#!/bin/sh v1')
+        self.cache.client.head.side_effect = head
+        with patch.object(installer_cache.subprocess, 'Popen', side_effect=get_hostagent) as popen:
+            installers, errors = self.cache.prefetch('region1', 'token')
+        assert errors == {}
+        assert list(installers['certless']) == ['debian'] and list(installers['classic']) == ['redhat']
+        assert installers['classic']['redhat'] == os.path.join(
+            self.cache_dir, 'test.platform9.com', 'classic-region1', 'platform9-install-region1-redhat.sh')
+        assert popen.call_args[0][0][-4:] == ['--token', 'token', '--platform', 'redhat']
+
+        popen_failed = Mock(returncode=1, communicate=Mock(return_value=('ERROR: bad token', None)))
+        with patch.object(installer_cache.subprocess, 'Popen', return_value=popen_failed):
+            installers, errors = self.cache.prefetch('region2', 'token')
+        assert list(installers['certless']) == ['debian'] and installers['classic'] == {}
+        assert 'ERROR: bad token' in errors['redhat']